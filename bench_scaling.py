@@ -0,0 +1,230 @@
+from __future__ import annotations
+from dataclasses import dataclass, field, asdict
+from random import Random
+from time import perf_counter, perf_counter_ns
+import argparse
+import csv
+import importlib
+import json
+import os
+
+
+# scaling benchmark for the simulator api: for every (simulator, runqueue size, churn rate) cell,
+# fill a runqueue w/ size entities, then time a loop of pick + run tick, where a churn fraction of
+# the ticks also dequeue a random entity and place it back. every tick is timed, the rq records
+# no timeline and has no observers, so only the scheduling itself is measured. a simulator w/ a
+# pick cache (invalidate_pick) has its cache dropped before the timed pick, which is then timed
+# again as pick_cached. reports ops/sec and latency percentiles per op, cells that take too long
+# to set up are recorded as skipped
+
+SIMULATORS = {
+    "simple": "simulator_simple",
+    "avg": "simulator_avg",
+    "avg_weighted": "simulator_avg_weighted",
+    "soa": "simulator_soa",
+}
+
+OPS = ("place", "pick", "pick_cached", "run", "dequeue")
+
+SLICES = (4000000, 8000000, 80000000)
+TICK = 4000000
+
+
+@dataclass
+class op_stats:
+    count: int = 0
+    ops_per_sec: float = 0
+    p50_ns: float = 0
+    p90_ns: float = 0
+    p99_ns: float = 0
+
+
+@dataclass
+class bench_cell:
+    simulator: str
+    size: int
+    churn: float
+    skipped: str = ""  # why the cell has no numbers, empty if it ran
+    setup_sec: float = 0
+    ticks: int = 0
+    ops: dict[str, op_stats] = field(default_factory=dict)
+
+
+def load_simulator(name : str):
+    module = importlib.import_module(SIMULATORS.get(name, name))
+    for flag in ("verbose", "print_match_linux", "check_lag_sum"):
+        if hasattr(module, flag):
+            setattr(module, flag, False)
+    return module
+
+
+def percentile(sorted_samples : list[int], p : float) -> float:
+    if not sorted_samples:
+        return 0
+    return sorted_samples[min(len(sorted_samples) - 1, int(p / 100 * len(sorted_samples)))]
+
+
+def summarise(samples : list[int]) -> op_stats:
+    samples.sort()
+    total = sum(samples)
+    return op_stats(len(samples), len(samples) / (total / 1e9) if total else 0,
+                    percentile(samples, 50), percentile(samples, 90), percentile(samples, 99))
+
+
+def run_cell(name : str, size : int, churn : float, ticks : int, setup_budget : float,
+             tick_budget : float, seed : int = 0) -> bench_cell:
+    module = load_simulator(name)
+    rng = Random(seed)
+    cell = bench_cell(name, size, churn)
+    samples = {op: [] for op in OPS}
+
+    rq = module.rq_struct([], record_timeline=False)
+    invalidate_pick = getattr(module, "invalidate_pick", None)
+    queued = []
+    lags = {}
+
+    # only the places done w/ the queue at size are measured, not the ones filling it
+    start = perf_counter()
+    for pid in range(1, size + 1):
+        se = module.sched_entity(pid, slice=rng.choice(SLICES))
+        module.place_entity(rq, se, 0)
+        queued.append(se)
+
+        if pid % 256 == 0 and perf_counter() - start > setup_budget:
+            cell.skipped = f"setup over {setup_budget}s at {pid} of {size} entities"
+            return cell
+    cell.setup_sec = perf_counter() - start
+
+    start = perf_counter()
+    for tick in range(ticks):
+        # a pick every tick, not just after a rollover, so the cheap cases are in the sample too
+        if invalidate_pick is not None:
+            invalidate_pick(rq)
+        t = perf_counter_ns()
+        module.pick_eevdf(rq)
+        samples["pick"].append(perf_counter_ns() - t)
+
+        if invalidate_pick is not None:
+            t = perf_counter_ns()
+            module.pick_eevdf(rq)
+            samples["pick_cached"].append(perf_counter_ns() - t)
+
+        t = perf_counter_ns()
+        module.run_curr(rq, TICK)
+        samples["run"].append(perf_counter_ns() - t)
+
+        if rng.random() < churn:
+            i = rng.randrange(len(queued))
+            se = queued[i]
+
+            t = perf_counter_ns()
+            lags[se.pid] = module.dequeue_entity(rq, se)
+            samples["dequeue"].append(perf_counter_ns() - t)
+
+            t = perf_counter_ns()
+            module.place_entity(rq, se, lags.pop(se.pid))
+            samples["place"].append(perf_counter_ns() - t)
+
+        cell.ticks = tick + 1
+        if perf_counter() - start > tick_budget:
+            break
+
+    cell.ops = {op: summarise(s) for op, s in samples.items()}
+    return cell
+
+
+def write_json(cells : list[bench_cell], path : str):
+    with open(path, "w") as f:
+        json.dump([asdict(cell) for cell in cells], f, indent=2)
+
+
+def write_csv(cells : list[bench_cell], path : str):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["simulator", "size", "churn", "op", "count", "ops_per_sec", "p50_ns", "p90_ns", "p99_ns",
+                         "setup_sec", "ticks", "skipped"])
+        for cell in cells:
+            if cell.skipped:
+                writer.writerow([cell.simulator, cell.size, cell.churn, "", 0, "", "", "", "", "", 0, cell.skipped])
+                continue
+            for op, s in cell.ops.items():
+                if not s.count:
+                    continue
+                writer.writerow([cell.simulator, cell.size, cell.churn, op, s.count, f"{s.ops_per_sec:.1f}",
+                                 s.p50_ns, s.p90_ns, s.p99_ns, f"{cell.setup_sec:.3f}", cell.ticks, ""])
+
+
+# one panel per op, p50 latency vs runqueue size on log-log axes, a line per simulator / churn
+def plot_scaling(cells : list[bench_cell], path : str):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(1, len(OPS), figsize=(5 * len(OPS), 4), sharey=True)
+    lines = sorted({(cell.simulator, cell.churn) for cell in cells})
+
+    for ax, op in zip(axes, OPS):
+        for simulator, churn in lines:
+            points = [(cell.size, cell.ops[op].p50_ns) for cell in cells
+                      if cell.simulator == simulator and cell.churn == churn and not cell.skipped
+                      and cell.ops[op].count]
+            if points:
+                xs, ys = zip(*sorted(points))
+                ax.plot(xs, ys, marker="o", label=f"{simulator} churn {churn}")
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.set_title(op)
+        ax.set_xlabel("runqueue size")
+    axes[0].set_ylabel("p50 latency (ns)")
+    axes[-1].legend(fontsize="small")
+
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ops/sec and latency percentiles of the simulators vs runqueue size and churn")
+    parser.add_argument("--simulators", nargs="+", default=list(SIMULATORS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[2, 10, 100, 1000, 10000, 100000])
+    parser.add_argument("--churn", nargs="+", type=float, default=[0, 0.01, 0.1, 0.5],
+                        help="fraction of ticks followed by a dequeue + re-place")
+    parser.add_argument("--ticks", type=int, default=2000, help="pick / run ticks measured per cell")
+    parser.add_argument("--setup-budget", type=float, default=10, help="seconds to fill a runqueue before the cell is skipped")
+    parser.add_argument("--tick-budget", type=float, default=10, help="seconds of measured ticks per cell")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="results/bench_scaling", help="output prefix for the .json / .csv / .png")
+    parser.add_argument("--no-plot", action="store_true")
+    args = parser.parse_args()
+
+    cells = []
+    for name in args.simulators:
+        # once a size is too slow to set up, the larger ones are too
+        too_big = None
+        for size in sorted(args.sizes):
+            for churn in args.churn:
+                if too_big is not None:
+                    cells.append(bench_cell(name, size, churn, skipped=f"size {too_big} already over the setup budget"))
+                    continue
+
+                cell = run_cell(name, size, churn, args.ticks, args.setup_budget, args.tick_budget, args.seed)
+                cells.append(cell)
+
+                if cell.skipped:
+                    too_big = size
+                    print(f"{name:>13} {size:>7} churn {churn:<5} skipped: {cell.skipped}")
+                    continue
+                print(f"{name:>13} {size:>7} churn {churn:<5} " +
+                      " ".join(f"{op} {s.ops_per_sec:>10.0f}/s p99 {s.p99_ns / 1000:>8.1f}us"
+                               for op, s in cell.ops.items() if s.count))
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    write_json(cells, args.out + ".json")
+    write_csv(cells, args.out + ".csv")
+    if not args.no_plot:
+        plot_scaling(cells, args.out + ".png")
+
+
+
+if __name__=="__main__":
+    main()
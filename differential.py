@@ -0,0 +1,201 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Optional
+from random import Random
+import argparse
+import importlib
+
+
+# drives any set of simulator modules (anything w/ the rq_struct / sched_entity / place_entity /
+# dequeue_entity / pick_eevdf / run_curr api) from one stream of ops, and when their picks
+# disagree shrinks the stream to a minimal one that still disagrees (ddmin)
+
+POLICIES = {
+    "simple": "simulator_simple",
+    "avg": "simulator_avg",
+    "avg_weighted": "simulator_avg_weighted",
+    "soa": "simulator_soa",
+}
+
+
+@dataclass
+class sim_op:
+    kind: str  # place, dequeue, pick, run
+    pid: int = 0
+    amount: int = 0  # time to run for
+    slice: int = 4000000  # the entity's slice and weight, used the first time it is placed
+    weight: int = 1024
+
+    def __str__(self) -> str:
+        if self.kind == "place":
+            return f"place pid {self.pid} (slice {self.slice}, weight {self.weight})"
+        if self.kind == "dequeue":
+            return f"dequeue pid {self.pid}"
+        if self.kind == "run":
+            return f"run {self.amount}"
+        return "pick"
+
+
+@dataclass
+class divergence:
+    op_index: int
+    picks: dict[str, int]  # policy -> picked pid
+
+
+@dataclass
+class policy_state:
+    name: str
+    module: object
+    rq: object
+    entities: dict = field(default_factory=dict)  # pid -> sched_entity
+    lags: dict = field(default_factory=dict)  # pid -> lag it left w/
+
+
+def load_policy(name : str):
+    module = importlib.import_module(POLICIES.get(name, name))
+    # keep the simulators quiet, same as simulator_cmp does
+    for flag in ("verbose", "print_match_linux"):
+        if hasattr(module, flag):
+            setattr(module, flag, False)
+    return module
+
+
+# ops that don't make sense at that point (placing a queued pid, running w/o a curr, ...) are
+# skipped, so any subsequence of a stream is still a valid stream
+def run_ops(policies : dict[str, object], ops : list[sim_op]) -> Optional[divergence]:
+    states = [policy_state(name, module, module.rq_struct([])) for name, module in policies.items()]
+    queued = set()
+
+    for i, op in enumerate(ops):
+        if op.kind == "place":
+            if op.pid in queued:
+                continue
+            for st in states:
+                se = st.entities.get(op.pid)
+                if se is None:
+                    se = st.entities[op.pid] = st.module.sched_entity(op.pid, slice=op.slice, weight=op.weight)
+                st.module.place_entity(st.rq, se, st.lags.pop(op.pid, 0))
+            queued.add(op.pid)
+
+        elif op.kind == "dequeue":
+            if op.pid not in queued:
+                continue
+            for st in states:
+                st.lags[op.pid] = st.module.dequeue_entity(st.rq, st.entities[op.pid])
+            queued.discard(op.pid)
+
+        elif op.kind == "pick":
+            if not queued:
+                continue
+            for st in states:
+                st.module.pick_eevdf(st.rq)
+            picks = {st.name: st.rq.curr.pid for st in states}
+            if len(set(picks.values())) > 1:
+                return divergence(i, picks)
+
+        elif op.kind == "run":
+            if not queued or any(st.rq.curr is None for st in states):
+                continue
+            for st in states:
+                st.module.run_curr(st.rq, op.amount)
+
+    return None
+
+
+def shrink(policies : dict[str, object], ops : list[sim_op]) -> list[sim_op]:
+
+    def diverges(candidate : list[sim_op]) -> bool:
+        return run_ops(policies, candidate) is not None
+
+    found = run_ops(policies, ops)
+    if found is None:
+        return ops
+
+    # nothing after the first disagreement matters
+    ops = ops[:found.op_index + 1]
+
+    n = 2
+    while len(ops) >= 2:
+        size = -(-len(ops) // n)
+        chunks = [ops[i:i + size] for i in range(0, len(ops), size)]
+
+        reduced = False
+        for chunk in chunks:
+            if diverges(chunk):
+                ops, n, reduced = chunk, 2, True
+                break
+
+        if not reduced:
+            for i in range(len(chunks)):
+                rest = [op for j, chunk in enumerate(chunks) if j != i for op in chunk]
+                if diverges(rest):
+                    ops, n, reduced = rest, max(n - 1, 2), True
+                    break
+
+        if not reduced:
+            if n >= len(ops):
+                break
+            n = min(len(ops), 2 * n)
+
+    return ops
+
+
+# same shape as the random_mixed drivers: pids w/ different slices come and go at random,
+# a pick before every burst of 1-4 ticks
+def random_ops(seed : int, total_num_ticks : int = 1000, slices : tuple = (80000000, 4000000)) -> list[sim_op]:
+    rng = Random(seed)
+    ops = [sim_op("place", pid + 1, slice=s) for pid, s in enumerate(slices)]
+    queued = set(range(1, len(slices) + 1))
+
+    curr_tick = 0
+    while curr_tick < total_num_ticks:
+        gone = sorted(set(range(1, len(slices) + 1)) - queued)
+        if gone and (not queued or rng.uniform(0, 1) > 0.5):
+            pid = rng.choice(gone)
+            ops.append(sim_op("place", pid, slice=slices[pid - 1]))
+            queued.add(pid)
+
+        ops.append(sim_op("pick"))
+
+        ticks_to_tick = rng.randrange(1, 5)
+        ops.extend(sim_op("run", amount=4000000) for _ in range(ticks_to_tick))
+
+        if queued and rng.uniform(0, 1) > 0.9:
+            pid = rng.choice(sorted(queued))
+            ops.append(sim_op("dequeue", pid))
+            queued.discard(pid)
+
+        curr_tick += ticks_to_tick
+
+    return ops
+
+
+def main():
+    parser = argparse.ArgumentParser(description="lockstep differential run of the simulators w/ divergence shrinking")
+    parser.add_argument("--policies", nargs="+", default=["simple", "avg_weighted"])
+    parser.add_argument("--seeds", type=int, default=200)
+    parser.add_argument("--ticks", type=int, default=1000)
+    parser.add_argument("--all", action="store_true", help="keep going after the first diverging seed")
+    args = parser.parse_args()
+
+    policies = {name: load_policy(name) for name in args.policies}
+
+    for seed in range(args.seeds):
+        ops = random_ops(seed, args.ticks)
+        found = run_ops(policies, ops)
+        if found is None:
+            continue
+
+        print(f"seed {seed}: picks diverge at op {found.op_index} of {len(ops)}: {found.picks}")
+        minimal = shrink(policies, ops)
+        print(f"  minimal scenario ({len(minimal)} ops), ends w/ {run_ops(policies, minimal).picks}:")
+        for op in minimal:
+            print(f"    {op}")
+
+        if not args.all:
+            break
+
+
+
+if __name__=="__main__":
+    main()
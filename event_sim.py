@@ -0,0 +1,164 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, Optional
+from random import Random
+import heapq
+import simulator_simple
+
+
+# discrete-event driver: instead of fixed 4 ms ticks, time jumps straight to the next thing that
+# happens (an arrival, a wakeup, curr going to sleep / exiting, curr's slice running out) and the
+# simulator is only called then. works w/ any simulator module that has run_curr_for
+
+
+@dataclass
+class task_spec:
+    pid: int
+    arrival: int  # real time of the first wakeup
+    bursts: Iterable[tuple[int, int]]  # (cpu time, sleep after it), the task exits after its last burst
+    slice: int = 4000000
+    weight: int = 1024
+
+
+@dataclass(order=True)
+class sim_event:
+    time: int
+    seq: int
+    kind: str = field(compare=False)  # wakeup, sleep, exit, slice-expiry
+    pid: int = field(compare=False)
+    gen: Optional[int] = field(default=None, compare=False)  # dispatch it was queued for, if it depends on curr
+
+
+@dataclass
+class des_result:
+    rq: object
+    now: int = 0
+    events: int = 0
+    picks: int = 0
+    idle_time: int = 0
+
+
+class event_sim:
+
+    def __init__(self, tasks : Iterable[task_spec], module=simulator_simple, rq=None):
+        self.module = module
+        self.rq = rq if rq is not None else module.rq_struct([])
+        self.heap : list[sim_event] = []
+        self.seq = 0
+        self.gen = 0
+        self.now = 0
+        self.result = des_result(self.rq)
+
+        self.entities = {}
+        self.bursts : dict[int, Iterator] = {}
+        self.next_burst : dict[int, Optional[tuple[int, int]]] = {}  # prefetched so we know if a burst is the last
+        self.remaining : dict[int, int] = {}  # cpu time left in the current burst
+        self.sleep_after : dict[int, Optional[int]] = {}
+        self.lags : dict[int, float] = {}
+
+        for task in tasks:
+            self.entities[task.pid] = module.sched_entity(task.pid, slice=task.slice, weight=task.weight)
+            self.bursts[task.pid] = iter(task.bursts)
+            self.next_burst[task.pid] = next(self.bursts[task.pid], None)
+            self.push(task.arrival, "wakeup", task.pid)
+
+    def push(self, time : int, kind : str, pid : int, gen : Optional[int] = None):
+        heapq.heappush(self.heap, sim_event(time, self.seq, kind, pid, gen))
+        self.seq += 1
+
+    def run(self, until : Optional[int] = None) -> des_result:
+        while self.heap:
+            if until is not None and self.heap[0].time > until:
+                self.advance(until)
+                break
+
+            ev = heapq.heappop(self.heap)
+            if ev.gen is not None and ev.gen != self.gen:
+                # curr changed since this was queued
+                continue
+
+            self.advance(ev.time)
+            self.result.events += 1
+
+            if ev.kind == "wakeup":
+                self.wakeup(ev.pid)
+            elif ev.kind in ("sleep", "exit"):
+                self.lags[ev.pid] = self.module.dequeue_entity(self.rq, self.entities[ev.pid])
+                if ev.kind == "sleep":
+                    self.push(self.now + self.sleep_after[ev.pid], "wakeup", ev.pid)
+
+            self.dispatch()
+
+        self.result.now = self.now
+        return self.result
+
+    # run curr (or idle) up to time
+    def advance(self, time : int):
+        delta = time - self.now
+        if delta <= 0:
+            return
+
+        curr = self.rq.curr
+        if curr is not None:
+            self.module.run_curr_for(self.rq, delta)
+            self.remaining[curr.pid] -= delta
+        else:
+            self.result.idle_time += delta
+            self.rq.real_time += delta
+
+        self.now = time
+
+    def wakeup(self, pid : int):
+        burst = self.next_burst[pid]
+        if burst is None:
+            return
+        self.next_burst[pid] = next(self.bursts[pid], None)
+        self.remaining[pid], self.sleep_after[pid] = burst
+        self.module.place_entity(self.rq, self.entities[pid], self.lags.pop(pid, 0))
+
+    def dispatch(self):
+        self.gen += 1
+        if not self.rq.all_procs:
+            self.rq.curr = None
+            return
+
+        self.module.pick_eevdf(self.rq)
+        self.result.picks += 1
+
+        curr = self.rq.curr
+        pid = curr.pid
+
+        # the end of the burst is queued first so it wins a tie w/ the slice running out
+        done = "sleep" if self.next_burst[pid] is not None else "exit"
+        self.push(self.now + self.remaining[pid], done, pid, self.gen)
+
+        to_slice = curr.slice - curr.time_gotten_in_slice
+        if 0 < to_slice < self.remaining[pid]:
+            self.push(self.now + to_slice, "slice-expiry", pid, self.gen)
+
+
+# mostly sleeping tasks: short cpu bursts (exponential, mean run_mean) between long sleeps
+def sleepy_tasks(num_tasks : int, seed : int = 0, run_mean : int = 500000, sleep_mean : int = 20000000,
+                 bursts_per_task : int = 100) -> list[task_spec]:
+    rng = Random(seed)
+    tasks = []
+    for pid in range(1, num_tasks + 1):
+        bursts = [(max(1, int(rng.expovariate(1 / run_mean))), max(1, int(rng.expovariate(1 / sleep_mean))))
+                  for _ in range(bursts_per_task)]
+        tasks.append(task_spec(pid, rng.randrange(0, sleep_mean), bursts))
+    return tasks
+
+
+def main():
+    simulator_simple.verbose = False
+
+    sim = event_sim(sleepy_tasks(200))
+    result = sim.run()
+
+    print(f"simulated {result.now / 1e9:.2f}s: {result.events} events, {result.picks} picks, "
+          f"idle {100 * result.idle_time / max(result.now, 1):.1f}%")
+
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,160 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Optional
+from random import Random
+import argparse
+import time
+import simulator_simple
+from simulator_simple import sched_entity, rq_struct, place_entity, dequeue_entity, pick_eevdf, run_curr
+
+
+# cgroup style hierarchy on top of simulator_simple: a group_entity is queued on its parent's rq
+# like any entity and owns a child rq of its own. every rq keeps its own deadline tree and lag
+# sums, so a pick is one tree pick per level (O(depth log n)) and a tick is one run_curr per level.
+# a group is only queued while its child rq has something queued; when the last entity leaves,
+# the group leaves its parent too and keeps the lag it left w/ for when it is placed again
+
+
+@dataclass
+class group_entity(sched_entity):
+    child: Optional[rq_struct] = None
+    lag: float = 0  # lag it left its parent rq w/, while it has nothing queued
+
+    def __post_init__(self):
+        if self.child is None:
+            self.child = rq_struct([], record_timeline=False)
+
+
+class group_hierarchy:
+
+    def __init__(self, record_timeline : bool = True):
+        self.root = rq_struct([], record_timeline=record_timeline)
+        self.parent : dict[int, Optional[group_entity]] = {}  # id(se) -> group it is queued in, None for the root
+        self.next_group_pid = -1  # groups get negative pids so they never clash w/ tasks
+
+    def rq_of(self, group : Optional[group_entity]) -> rq_struct:
+        return self.root if group is None else group.child
+
+    def new_group(self, parent : Optional[group_entity] = None, weight : int = 1024, slice : int = 4000000) -> group_entity:
+        group = group_entity(self.next_group_pid, slice=slice, weight=weight)
+        self.next_group_pid -= 1
+        self.parent[id(group)] = parent
+        return group
+
+    def attach(self, se : sched_entity, parent : Optional[group_entity] = None):
+        self.parent[id(se)] = parent
+
+    # place se in its group, and the group in its parent if it was empty, up to the root
+    def enqueue(self, se : sched_entity, lag : float = 0):
+        parent = self.parent[id(se)]
+        rq = self.rq_of(parent)
+        was_empty = not rq.procs_by_pid
+
+        place_entity(rq, se, lag)
+
+        if was_empty and parent is not None:
+            self.enqueue(parent, parent.lag)
+
+    # dequeue se from its group, and the group from its parent if that emptied it, returns se's lag
+    def dequeue(self, se : sched_entity) -> float:
+        parent = self.parent[id(se)]
+        rq = self.rq_of(parent)
+
+        lag = dequeue_entity(rq, se)
+
+        if parent is not None and not rq.procs_by_pid:
+            parent.lag = self.dequeue(parent)
+
+        return lag
+
+    # pick at every level down from the root, returns the task that runs
+    def pick(self) -> sched_entity:
+        rq = self.root
+        while True:
+            pick_eevdf(rq)
+            if not isinstance(rq.curr, group_entity):
+                return rq.curr
+            rq = rq.curr.child
+
+    # charge amount to curr at every level, the group entities on the path get it too
+    def run(self, amount : int):
+        for rq in self.path():
+            run_curr(rq, amount)
+
+    # the rqs on the path from the root to the running task
+    def path(self) -> list[rq_struct]:
+        rqs = []
+        rq = self.root
+        while rq is not None and rq.curr is not None:
+            rqs.append(rq)
+            rq = rq.curr.child if isinstance(rq.curr, group_entity) else None
+        return rqs
+
+
+# fanout groups per group, depth levels of them, tasks_per_group tasks in each leaf group
+def build_tree(depth : int, fanout : int, tasks_per_group : int, record_timeline : bool = False):
+    h = group_hierarchy(record_timeline)
+    tasks = []
+    level = [None]
+
+    for _ in range(depth):
+        level = [h.new_group(parent) for parent in level for _ in range(fanout)]
+
+    for group in level:
+        for _ in range(tasks_per_group):
+            se = sched_entity(len(tasks) + 1)
+            h.attach(se, group)
+            tasks.append(se)
+
+    return h, tasks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="hierarchical (cgroup style) eevdf")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=4)
+    parser.add_argument("--tasks-per-group", type=int, default=4)
+    parser.add_argument("--ticks", type=int, default=20000)
+    parser.add_argument("--churn", type=float, default=0.05, help="chance per tick that a random task sleeps or wakes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    simulator_simple.verbose = False
+    rng = Random(args.seed)
+
+    h, tasks = build_tree(args.depth, args.fanout, args.tasks_per_group)
+    runtime = {se.pid: 0 for se in tasks}
+    lags = {}
+    queued = set()
+    for se in tasks:
+        h.enqueue(se)
+        queued.add(se.pid)
+
+    start = time.perf_counter()
+    for _ in range(args.ticks):
+        if rng.random() < args.churn:
+            se = rng.choice(tasks)
+            if se.pid in queued and len(queued) > 1:
+                lags[se.pid] = h.dequeue(se)
+                queued.discard(se.pid)
+            elif se.pid not in queued:
+                h.enqueue(se, lags.pop(se.pid, 0))
+                queued.add(se.pid)
+
+        se = h.pick()
+        h.run(4000000)
+        runtime[se.pid] += 4000000
+    elapsed = time.perf_counter() - start
+
+    # w/ equal weights every group splits its time evenly between its queued children, so w/
+    # little churn every task should get about the same share
+    shares = sorted(r / (args.ticks * 4000000) for r in runtime.values())
+    print(f"{len(tasks)} tasks in {args.fanout ** args.depth} leaf groups, depth {args.depth}: "
+          f"{args.ticks / elapsed:.0f} ticks/s ({1e6 * elapsed / args.ticks:.1f}us per pick + run)")
+    print(f"share per task: min {shares[0]:.5f} median {shares[len(shares) // 2]:.5f} max {shares[-1]:.5f} "
+          f"(fair {1 / len(tasks):.5f})")
+
+
+
+if __name__=="__main__":
+    main()
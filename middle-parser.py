@@ -1,6 +1,7 @@
 from __future__ import annotations
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Optional, List
+from trace_parser import parse_trace, trace_event, update_curr_event, pick_event, place_event, dequeue_event
 
 
 @dataclass
@@ -21,7 +22,11 @@ class rq:
     virt_time: int = 0
     total_load: int = 0
     curr: Optional[sched_entity] = None
+    procs_by_pid: dict[int, sched_entity] = field(default_factory=dict)  # queued entities, kept by place / dequeue
 
+    def __post_init__(self):
+        for se in self.all_procs:
+            self.procs_by_pid[se.pid] = se
 
 
 def print_rq(rq : rq):
@@ -66,9 +71,7 @@ def update_curr(rq: rq, amount_to_tick : int, pid: int) -> bool:
 
     # sometimes linux will deq and then imediately re-place the curr proc
     if rq.curr is None:
-        for s in rq.all_procs:
-            if s.pid == pid:
-                rq.curr = s
+        rq.curr = rq.procs_by_pid.get(pid)
     
     curr : sched_entity = rq.curr
 
@@ -96,6 +99,7 @@ def update_lag(rq : rq, se : sched_entity):
 def place_entity(rq : rq, se : sched_entity, make_curr=False):
     
     rq.all_procs.append(se)
+    rq.procs_by_pid[se.pid] = se
 
     if rq.total_load > 0:
         rq.virt_time -= se.lag / rq.total_load
@@ -117,6 +121,8 @@ def dequeue_entity(rq : rq, se : sched_entity):
         rq.curr = None
 
     rq.all_procs.remove(se)
+    if rq.procs_by_pid.get(se.pid) is se:
+        del rq.procs_by_pid[se.pid]
     rq.total_load -= se.weight
 
     update_lag(rq, se) 
@@ -169,78 +175,53 @@ def main():
 
 def parse_file(file_path, rq : rq):
 
-    with open(file_path, 'r') as file:
-        for line in file:
-            if 'update_curr' in line:
-                vrt_value = get_val('delta exec: ', ',', line)
-                pid_value = get_val('update_curr ', ':', line)
-                new_vrt_value = get_val('virt time: ', '\n', line).split(".")
-                actual_vrt_val = int(new_vrt_value[0]) + (int(new_vrt_value[1]) / (2**16))
-
-                update_curr(rq, int(vrt_value), int(pid_value))
-                print("update ", rq.curr.pid, " by ", vrt_value, " -- V is now ", rq.virt_time, " so curr diff is ", actual_vrt_val - rq.virt_time, " curr's te is now ", rq.curr.time_eligible)
-            if 'pick_next_entity' in line:
-                print("pick")
-                new_pid = get_val('new_curr: ', ' ', line)
-                pick_eevdf(rq)
-                if (rq.curr.pid != int(new_pid)):
-                    print("ERROR - diff in choice -- lnx: ", new_pid, ", this program: ", rq.curr.pid)
-                    for s in rq.all_procs:
-                        if s.pid == int(new_pid):
-                            rq.curr = s
-            if 'place_entity' in line:
-                new_pid = get_val('placing se: ', ', ', line)
-                s_weight = get_val('weight: ', ', ', line)
-                t_g_i_s = get_val('t_g_i_s: ', '\n ', line)
-                lag = get_val('vlag: ', ', ', line)
-                lnx_virt_time_vals = get_val('new virt_time: ', ', ', line).split(".")
-
-                print("vvvvvvvvvvvvvv")
-                print("before: ")
-                print_rq(rq)
-                print("====> place")
-
-                new_se = sched_entity(int(new_pid), lag=int(lag), weight=int(s_weight), time_gotten_in_slice=int(t_g_i_s))
-                print("placing se: ", new_se)
-                if 'RE-' in line:
-                    place_entity(rq, new_se, True)
-                else:
-                    place_entity(rq, new_se)
-                actual_vrt_val = int(lnx_virt_time_vals[0]) + (int(lnx_virt_time_vals[1]) / (2**16))
-                print("after: DIFF: ", actual_vrt_val - rq.virt_time)
+    for event in parse_trace(file_path):
+        if isinstance(event, update_curr_event):
+            update_curr(rq, event.delta_exec, event.pid)
+            print("update ", rq.curr.pid, " by ", event.delta_exec, " -- V is now ", rq.virt_time, " so curr diff is ", vt_diff(event, rq), " curr's te is now ", rq.curr.time_eligible)
+
+        elif isinstance(event, pick_event):
+            print("pick")
+            pick_eevdf(rq)
+            if (rq.curr.pid != event.new_curr):
+                print("ERROR - diff in choice -- lnx: ", event.new_curr, ", this program: ", rq.curr.pid)
+                rq.curr = rq.procs_by_pid.get(event.new_curr, rq.curr)
+
+        elif isinstance(event, place_event):
+            print("vvvvvvvvvvvvvv")
+            print("before: ")
+            print_rq(rq)
+            print("====> place")
+
+            new_se = sched_entity(event.pid, lag=event.vlag, weight=event.weight, time_gotten_in_slice=event.t_g_i_s)
+            print("placing se: ", new_se)
+            place_entity(rq, new_se, event.re_place)
+            print("after: DIFF: ", vt_diff(event, rq))
+            print_rq(rq)
+            print("^^^^^^^^^^^^^^^^^^^^")
+
+        elif isinstance(event, dequeue_event):
+            print("vvvvvvvvvvvvvv")
+            print("before: ")
+            print_rq(rq)
+            print("====> dequeue")
+
+            s = rq.procs_by_pid.get(event.pid)
+            if s is not None:
+                update_lag(rq, s)
+                dequeue_entity(rq, s)
+                print("after: DIFF: ", vt_diff(event, rq))
                 print_rq(rq)
                 print("^^^^^^^^^^^^^^^^^^^^")
-            if 'dequeue_entity' in line:
-                pid = get_val(' task being dequeued ', ' ', line)
-                lnx_virt_time_vals = get_val('new virt_time: ', ' ', line).split(".")
-                actual_vrt_val = int(lnx_virt_time_vals[0]) + (int(lnx_virt_time_vals[1]) / (2**16))
-
-                print("vvvvvvvvvvvvvv")
-                print("before: ")
-                print_rq(rq)
-                print("====> dequeue")
 
-                for s in rq.all_procs:
-                    if s.pid == int(pid):
-                        update_lag(rq, s)
-                        dequeue_entity(rq, s)
-                        print("after: DIFF: ", actual_vrt_val - rq.virt_time)
-                        print_rq(rq)
-                        print("^^^^^^^^^^^^^^^^^^^^")
-                        continue
 
-
-
-def get_val(start : str, end : str, line : str)->str:
-    
-    start_index = line.find(start) + len(start)
-    end_index = line.find(end, start_index)
-    if end_index == -1: 
-        end_index = len(line)
-    return line[start_index:end_index].strip()
+# diff between linux's virt time (if the trace has it) and ours
+def vt_diff(event : trace_event, rq : rq) -> Optional[float]:
+    if event.virt_time is None:
+        return None
+    return event.virt_time - rq.virt_time
 
 
 
 if __name__=="__main__": 
     main() 
-
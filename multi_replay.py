@@ -0,0 +1,204 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from multiprocessing import Pool
+from typing import Iterable, Optional
+import argparse
+import os
+from differential import load_policy
+from trace_parser import parse_trace, trace_event, update_curr_event, pick_event, place_event, dequeue_event
+
+
+# replay of a multi-core trace: every event goes to the rq_struct of the cpu it was printed on
+# (trace_parser's cpu, default_cpu if the line doesn't say, or an error if default_cpu is None).
+# a task that is dequeued on one cpu and placed on another is a migration, its entity and lag move
+# w/ it like they do between a dequeue and a re-place on one cpu. a pick the simulator gets wrong,
+# or an event it raises on, is counted in the cpu's result and the replay goes on.
+#
+# the cpus can also be replayed in parallel, one worker per cpu. a worker can't see the lag a
+# migrating task left the other cpu w/, so those places use the vlag the kernel printed instead,
+# converted to the model's lag units (lag_from_vlag). workers only send their timelines back
+# when asked for, pickling them over to the parent costs about what the replay does
+
+
+@dataclass
+class cpu_result:
+    cpu: int
+    events: int = 0
+    picks: int = 0
+    pick_mismatches: int = 0  # picks where the simulator chose a different pid than the kernel
+    migrations_in: int = 0
+    skipped: int = 0  # events the rq can't take, eg a tick w/ nothing queued (lines lost from the trace)
+    no_cpu: int = 0  # events whose line didn't say the cpu, replayed here as the default cpu
+    errors: int = 0  # events the simulator raised on
+    first_error: str = ""
+    timeline: list = field(default_factory=list)
+
+
+def event_cpu(event : trace_event, default_cpu : Optional[int] = 0) -> int:
+    if event.cpu is not None:
+        return event.cpu
+    if default_cpu is None:
+        raise ValueError(f"the line of {event} doesn't say its cpu")
+    return default_cpu
+
+
+class cpu_replay:
+
+    def __init__(self, module, cpu : int, record_timeline : bool = True):
+        self.module = module
+        self.rq = module.rq_struct([], record_timeline=record_timeline)
+        self.result = cpu_result(cpu, timeline=self.rq.timeline)
+
+    # carry is pid -> (entity, lag) for tasks that are off every rq, shared by all the cpus
+    def replay(self, event : trace_event, carry : dict):
+        rq = self.rq
+        self.result.events += 1
+        if event.cpu is None:
+            self.result.no_cpu += 1
+
+        if isinstance(event, update_curr_event):
+            if rq.curr is None and event.pid not in rq.procs_by_pid:
+                self.result.skipped += 1
+                return
+
+        elif isinstance(event, pick_event):
+            if not rq.procs_by_pid:
+                self.result.skipped += 1
+                return
+
+        elif isinstance(event, place_event):
+            if event.pid in rq.procs_by_pid:
+                self.result.skipped += 1
+                return
+
+        try:
+            if isinstance(event, pick_event):
+                # replay_event's pick, w/o its print
+                self.module.pick_eevdf(rq)
+                self.result.picks += 1
+                if rq.curr.pid != event.new_curr:
+                    self.result.pick_mismatches += 1
+                    rq.curr = rq.procs_by_pid.get(event.new_curr, rq.curr)
+            else:
+                self.module.replay_event(rq, event, carry)
+        except Exception as e:
+            self.result.errors += 1
+            if not self.result.first_error:
+                self.result.first_error = f"{event}: {type(e).__name__}: {e}"
+
+
+def replay_sequential(events : Iterable[trace_event], module, default_cpu : Optional[int] = 0) -> dict[int, cpu_result]:
+    cpus : dict[int, cpu_replay] = {}
+    carry = {}
+    left_from = {}  # pid -> cpu it was last dequeued on
+
+    for event in events:
+        cpu = event_cpu(event, default_cpu)
+        replay = cpus.get(cpu)
+        if replay is None:
+            replay = cpus[cpu] = cpu_replay(module, cpu)
+
+        if isinstance(event, place_event) and left_from.get(event.pid, cpu) != cpu:
+            replay.result.migrations_in += 1
+        if isinstance(event, dequeue_event):
+            left_from[event.pid] = cpu
+
+        replay.replay(event, carry)
+
+    return {cpu: replay.result for cpu, replay in sorted(cpus.items())}
+
+
+# the events of each cpu, w/ every place flagged if the task last left from another cpu
+def split_by_cpu(events : Iterable[trace_event], default_cpu : Optional[int] = 0) -> dict[int, list[tuple[trace_event, bool]]]:
+    per_cpu = {}
+    left_from = {}
+
+    for event in events:
+        cpu = event_cpu(event, default_cpu)
+        migrated = isinstance(event, place_event) and left_from.get(event.pid, cpu) != cpu
+        if isinstance(event, dequeue_event):
+            left_from[event.pid] = cpu
+        per_cpu.setdefault(cpu, []).append((event, migrated))
+
+    return per_cpu
+
+
+def replay_cpu(job : tuple[str, int, list[tuple[trace_event, bool]], bool]) -> cpu_result:
+    policy, cpu, events, timelines = job
+    module = load_policy(policy)
+    replay = cpu_replay(module, cpu, record_timeline=timelines)
+    carry = {}
+
+    for event, migrated in events:
+        if migrated:
+            # the lag it left the other cpu w/ is only in the trace, so does t_g_i_s
+            se = module.sched_entity(event.pid, weight=event.weight)
+            se.time_gotten_in_slice = event.t_g_i_s
+            carry[event.pid] = (se, module.lag_from_vlag(event.vlag, event.weight))
+            replay.result.migrations_in += 1
+        replay.replay(event, carry)
+
+    return replay.result
+
+
+def replay_parallel(events : Iterable[trace_event], policy : str, default_cpu : Optional[int] = 0,
+                    workers : int = None, timelines : bool = False) -> dict[int, cpu_result]:
+    jobs = [(policy, cpu, cpu_events, timelines) for cpu, cpu_events in sorted(split_by_cpu(events, default_cpu).items())]
+    workers = min(workers or os.cpu_count(), max(len(jobs), 1))
+
+    if workers == 1:
+        results = [replay_cpu(job) for job in jobs]
+    else:
+        with Pool(workers) as pool:
+            results = pool.map(replay_cpu, jobs)
+
+    return {result.cpu: result for result in results}
+
+
+def print_summary(results : dict[int, cpu_result]):
+    for result in results.values():
+        print(f"cpu {result.cpu:>3}: {result.events:>8} events, {result.picks:>7} picks, "
+              f"{result.pick_mismatches:>6} mismatched, {result.migrations_in:>5} migrations in, {result.skipped:>5} skipped, "
+              f"{result.no_cpu:>6} w/o a cpu, {result.errors:>5} errors")
+        if result.first_error:
+            print(f"  first error: {result.first_error}")
+
+    picks = sum(r.picks for r in results.values())
+    mismatches = sum(r.pick_mismatches for r in results.values())
+    print(f"{len(results)} cpus, {mismatches} of {picks} picks differ from the kernel's")
+
+    # a trace w/ no cpus at all is a single cpu one, but lines w/o a cpu among lines w/ one were
+    # put on the default cpu whichever cpu printed them
+    events = sum(r.events for r in results.values())
+    no_cpu = sum(r.no_cpu for r in results.values())
+    if 0 < no_cpu < events:
+        print(f"warning: {no_cpu} of {events} events don't say their cpu and were replayed on the default cpu, "
+              f"see --require-cpu")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="replay a multi-core kernel trace on one rq per cpu")
+    parser.add_argument("file", nargs="?", default="out.txt")
+    parser.add_argument("--policy", default="avg_weighted", help="simulator to replay on, see differential.POLICIES")
+    parser.add_argument("--default-cpu", type=int, default=0, help="cpu for lines that don't say which cpu they are from")
+    parser.add_argument("--require-cpu", action="store_true", help="refuse lines that don't say their cpu")
+    parser.add_argument("--parallel", action="store_true", help="one worker process per cpu, migrations use the trace's vlag")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    events = parse_trace(args.file)
+    default_cpu = None if args.require_cpu else args.default_cpu
+    try:
+        if args.parallel:
+            results = replay_parallel(events, args.policy, default_cpu, args.workers)
+        else:
+            results = replay_sequential(events, load_policy(args.policy), default_cpu)
+    except ValueError as e:
+        parser.error(str(e))
+
+    print_summary(results)
+
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,194 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Iterable, Optional
+import argparse
+import html
+import os
+import time
+import numpy as np
+
+
+# headless rendering of stored timelines (columnar_timeline.save files), whole or cut into time
+# windows, w/ draw_timeline_fast on the Agg backend in a pool of worker processes. every image
+# gets a line in an index.html next to it. a job that fails is reported in the index instead of
+# stopping the batch, and w/ skip_existing a rerun only renders what is missing
+
+
+@dataclass
+class render_job:
+    source: str  # .npy timeline
+    out: str  # image path, the extension picks the format (png / svg)
+    window: Optional[tuple[int, int]] = None  # [start, end) in real time, None for all of it
+    simple: bool = False
+    title: str = ""
+
+
+@dataclass
+class render_result:
+    job: render_job
+    events: int = 0
+    seconds: float = 0
+    error: str = ""
+    skipped: bool = False
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+# rows that overlap [start, end). a stored timeline is in the order one rq recorded it, so its
+# start and end real times are both non-decreasing and the window is the slice between two
+# binary searches, only that part of a memory mapped file is read
+def window_rows(rows : np.ndarray, window : Optional[tuple[int, int]]) -> np.ndarray:
+    if window is None:
+        return rows
+    start, end = window
+    lo = np.searchsorted(rows["end_real_time"], start, side="left")
+    hi = np.searchsorted(rows["start_real_time"], end, side="left")
+    return rows[lo:max(lo, hi)]
+
+
+def render_one(job : render_job, width : float = 12, height : float = 6, dpi : int = 100) -> render_result:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from timeline_render import draw_timeline_fast
+
+    result = render_result(job)
+    begin = time.perf_counter()
+    fig = None
+    try:
+        # memory mapped, a window only reads the part it needs
+        rows = window_rows(np.load(job.source, mmap_mode="r"), job.window)
+        result.events = len(rows)
+        if len(rows) == 0:
+            raise ValueError("no events in the window")
+
+        fig, ax = plt.subplots(figsize=(width, height), dpi=dpi)
+        draw_timeline_fast(np.ascontiguousarray(rows), simple=job.simple, ax=ax, window=job.window, show=False)
+        if job.title:
+            ax.set_title(job.title)
+
+        os.makedirs(os.path.dirname(job.out) or ".", exist_ok=True)
+        fig.savefig(job.out)
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    finally:
+        if fig is not None:
+            plt.close(fig)
+
+    result.seconds = time.perf_counter() - begin
+    return result
+
+
+# one job per source, or per window if windows > 1 (equal real time slices of the timeline)
+def make_jobs(sources : Iterable[str], out_dir : str, formats : Iterable[str] = ("png",),
+              windows : int = 1, simple : bool = False) -> list[render_job]:
+    jobs = []
+    for source in sources:
+        name = os.path.splitext(os.path.basename(source))[0]
+
+        cuts = [None]
+        if windows > 1:
+            rows = np.load(source, mmap_mode="r")
+            if len(rows):
+                lo, hi = int(rows["start_real_time"].min()), int(rows["end_real_time"].max())
+                edges = np.linspace(lo, hi, windows + 1).astype(np.int64)
+                cuts = list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+        for i, window in enumerate(cuts):
+            stem = name if window is None else f"{name}.{i:04d}"
+            title = name if window is None else f"{name} [{window[0]}, {window[1]})"
+            for format in formats:
+                jobs.append(render_job(source, os.path.join(out_dir, f"{stem}.{format}"), window, simple, title))
+
+    return jobs
+
+
+def render_all(jobs : list[render_job], workers : Optional[int] = None, skip_existing : bool = False,
+               dpi : int = 100, progress : bool = False) -> list[render_result]:
+    # in job order, the index lists them that way
+    results : list[Optional[render_result]] = [None] * len(jobs)
+    todo = []
+    for i, job in enumerate(jobs):
+        if skip_existing and os.path.exists(job.out) and os.path.getmtime(job.out) >= os.path.getmtime(job.source):
+            results[i] = render_result(job, skipped=True)
+        else:
+            todo.append(i)
+
+    workers = min(workers or os.cpu_count(), max(len(todo), 1))
+    if workers == 1:
+        _init_worker()
+        for i in todo:
+            results[i] = render_one(jobs[i], dpi=dpi)
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+            futures = {pool.submit(render_one, jobs[i], dpi=dpi): i for i in todo}
+            for done, future in enumerate(as_completed(futures), 1):
+                results[futures[future]] = future.result()
+                if progress:
+                    print(f"\r{done}/{len(todo)}", end="", flush=True)
+        if progress and todo:
+            print()
+
+    return results
+
+
+def write_index(results : list[render_result], out_dir : str, title : str = "timelines") -> str:
+    path = os.path.join(out_dir, "index.html")
+    lines = [
+        "<!DOCTYPE html>",
+        f"<html><head><meta charset=\"utf-8\"><title>{html.escape(title)}</title>",
+        "<style>body{font-family:sans-serif} td{padding:2px 8px} img{max-width:480px} .err{color:#b00}</style>",
+        f"</head><body><h1>{html.escape(title)}</h1>",
+        "<table><tr><th>image</th><th>source</th><th>window</th><th>events</th><th>time</th></tr>",
+    ]
+
+    for r in results:
+        rel = html.escape(os.path.relpath(r.job.out, out_dir))
+        window = "all" if r.job.window is None else f"[{r.job.window[0]}, {r.job.window[1]})"
+        if r.error:
+            cell = f"<span class=\"err\">{html.escape(r.error)}</span>"
+        elif rel.endswith(".svg"):
+            cell = f"<a href=\"{rel}\">{rel}</a>"
+        else:
+            cell = f"<a href=\"{rel}\"><img src=\"{rel}\" loading=\"lazy\" alt=\"{rel}\"></a>"
+        seconds = "cached" if r.skipped else f"{r.seconds:.2f}s"
+        lines.append(f"<tr><td>{cell}</td><td>{html.escape(r.job.source)}</td><td>{window}</td>"
+                     f"<td>{r.events if not r.skipped else ''}</td><td>{seconds}</td></tr>")
+
+    lines.append("</table></body></html>")
+    os.makedirs(out_dir, exist_ok=True)
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="render stored timelines (.npy) to images w/o a display")
+    parser.add_argument("sources", nargs="+", help="timelines saved w/ columnar_timeline.save")
+    parser.add_argument("-o", "--out-dir", default="timelines")
+    parser.add_argument("--formats", nargs="+", default=["png"], choices=["png", "svg"])
+    parser.add_argument("--windows", type=int, default=1, help="cut every timeline into this many real time windows")
+    parser.add_argument("--simple", action="store_true", help="run bars and join / leave markers only")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--dpi", type=int, default=100)
+    parser.add_argument("--skip-existing", action="store_true", help="keep images newer than their source")
+    args = parser.parse_args()
+
+    jobs = make_jobs(args.sources, args.out_dir, args.formats, args.windows, args.simple)
+    start = time.perf_counter()
+    results = render_all(jobs, args.workers, args.skip_existing, args.dpi, progress=True)
+    index = write_index(results, args.out_dir)
+
+    failed = [r for r in results if r.error]
+    for r in failed:
+        print(f"{r.job.out}: {r.error}")
+    print(f"{len(results) - len(failed)} of {len(results)} images in {time.perf_counter() - start:.1f}s, index at {index}")
+
+
+
+if __name__=="__main__":
+    main()
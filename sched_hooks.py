@@ -0,0 +1,97 @@
+from __future__ import annotations
+from dataclasses import dataclass, replace
+from typing import Callable, Iterable, Optional
+
+
+# observer api shared by the simulators: callbacks are registered on an rq per event type and
+# called w/ (rq, sched_record). the simulators only build an event if its type is observed, so an
+# rq w/ no observers (rq_struct(..., record_timeline=False) and the print flags off) never creates
+# events or formats strings. the verbose prints, the linux-format echo and the lag sum check are
+# all just observers, see the *_sink functions in each simulator. so is a list timeline; a timeline
+# store (timeline_store) is written to directly instead, see attach_timeline
+
+HOOK_TYPES = ("pick", "run", "new-req", "join", "leave")
+
+
+@dataclass
+class sched_record:
+    event: object  # the simulator's scheduling_event
+    se: object  # entity the event is about
+    lag: Optional[float] = None  # join: lag it was placed w/, leave: lag it left w/
+    prev_pid: int = -1  # pick: pid of curr before the pick, -1 if there was none
+
+
+observer = Callable[[object, sched_record], None]
+
+
+def register(rq, fn : observer, types : Iterable[str] = HOOK_TYPES):
+    for type in types:
+        if type not in HOOK_TYPES:
+            raise ValueError(f"unknown hook type {type!r}, expected one of {HOOK_TYPES}")
+        rq.observers.setdefault(type, []).append(fn)
+
+
+def unregister(rq, fn : observer, types : Iterable[str] = HOOK_TYPES):
+    for type in types:
+        fns = rq.observers.get(type)
+        if fns and fn in fns:
+            fns.remove(fn)
+            # an empty list would still make the call sites build events
+            if not fns:
+                del rq.observers[type]
+
+
+# call sites check `type in rq.observers` first, that check is all an unobserved event costs
+def notify(rq, type : str, record : sched_record):
+    for fn in rq.observers[type]:
+        fn(rq, record)
+
+
+# the timeline part of the simulators' attach_sinks. a list timeline gets a sink like any other
+# observer. a timeline store becomes rq.store, the call sites record their fields into it
+# straight away (see emit), so no scheduling_event or sched_record is made for an event nothing
+# else observes
+def attach_timeline(rq):
+    if not rq.record_timeline:
+        return
+    if isinstance(rq.timeline, list):
+        register(rq, coalescing_timeline_sink if rq.coalesce_runs else timeline_sink)
+    else:
+        rq.store = rq.timeline
+        rq.store.coalesce_runs = rq.coalesce_runs
+
+
+# one event from a simulator call site: its fields go into rq.store as they are, and only if the
+# type is observed are they made into an event (make_event(se.pid, type, *fields), the module's
+# scheduling_event) for the observers. call sites check `rq.store is not None or type in
+# rq.observers` first, so an event nothing wants still costs just that check
+def emit(rq, make_event : Callable, type : str, se, *fields, **record_kw):
+    if rq.store is not None:
+        rq.store.record(se.pid, type, *fields)
+    if type in rq.observers:
+        notify(rq, type, sched_record(make_event(se.pid, type, *fields), se, **record_kw))
+
+
+def timeline_sink(rq, record : sched_record):
+    rq.timeline.append(record.event)
+
+
+# timeline_sink, but a run event that carries on where the last recorded event (a run of the
+# same entity) ended extends that record instead of adding one. every other event (picks
+# included) is recorded and ends the stretch, so every boundary stays where it was. a list
+# timeline gets its last event replaced by an extended copy, the event object other observers
+# were handed is never changed; the timeline stores have extend_run for it
+def coalescing_timeline_sink(rq, record : sched_record):
+    event = record.event
+    timeline = rq.timeline
+
+    if event.type == "run" and len(timeline):
+        if isinstance(timeline, list):
+            last = timeline[-1]
+            if last.type == "run" and last.pid == event.pid and last.end_real_time == event.start_real_time:
+                timeline[-1] = replace(last, end_real_time=event.end_real_time, end_virt_time=event.end_virt_time)
+                return
+        elif timeline.extend_run(event):
+            return
+
+    timeline.append(event)
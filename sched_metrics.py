@@ -0,0 +1,340 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Callable, Optional
+import argparse
+import math
+import sys
+import time
+import simulator_simple
+from sched_hooks import register, unregister, sched_record
+from event_sim import event_sim, sleepy_tasks
+
+
+# online metrics from the observer hooks, nothing is kept per event: per task a few counters,
+# and the distributions go into quantile sketches w/ a bounded number of buckets, so memory is
+# O(tasks) however long the simulation runs and rq_struct(..., record_timeline=False) can be used.
+#
+#   cpu share       run time / real time seen, and run time / real time spent queued
+#   wait latency    real time from becoming runnable (a join, or being preempted) to the next pick
+#   lag             get_lag of the picked entity at every pick, and the lag entities leave w/
+#   slice interval  real time from the start of a request (join or new-req) to the next new-req
+
+
+# ddsketch style: values go into log spaced buckets, bucket k holds (gamma^(k-1), gamma^k], so
+# every quantile is within relative_accuracy of a value that was added. negative values get
+# their own buckets, |x| below min_value counts as 0. past max_buckets the buckets closest to 0
+# are merged, which only loses accuracy for the smallest magnitudes
+class quantile_sketch:
+
+    def __init__(self, relative_accuracy : float = 0.01, max_buckets : int = 2048, min_value : float = 1e-9):
+        # collapse needs a bucket left to merge into
+        if max_buckets < 2:
+            raise ValueError(f"max_buckets has to be at least 2, not {max_buckets}")
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.min_value = min_value
+
+        self.positive : dict[int, int] = {}
+        self.negative : dict[int, int] = {}  # keyed by the bucket of -x
+        self.zeros = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, x : float):
+        self.count += 1
+        self.sum += x
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+
+        if x > self.min_value:
+            store = self.positive
+        elif x < -self.min_value:
+            store = self.negative
+            x = -x
+        else:
+            self.zeros += 1
+            return
+
+        k = math.ceil(math.log(x) / self.log_gamma)
+        store[k] = store.get(k, 0) + 1
+        if len(store) > self.max_buckets:
+            self.collapse(store)
+
+    # merge the bucket closest to 0 into its neighbour
+    def collapse(self, store : dict[int, int]):
+        lowest = min(store)
+        count = store.pop(lowest)
+        nxt = min(store)
+        store[nxt] += count
+
+    def merge(self, other : quantile_sketch):
+        if other.gamma != self.gamma:
+            raise ValueError("can only merge sketches w/ the same relative accuracy")
+        for store, theirs in ((self.positive, other.positive), (self.negative, other.negative)):
+            for k, count in theirs.items():
+                store[k] = store.get(k, 0) + count
+            while len(store) > self.max_buckets:
+                self.collapse(store)
+        self.zeros += other.zeros
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def value(self, k : int) -> float:
+        return 2 * self.gamma ** k / (self.gamma + 1)
+
+    def quantile(self, q : float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+
+        rank = q * (self.count - 1)
+        seen = 0
+        # most negative first: the largest magnitude negative bucket
+        for k in sorted(self.negative, reverse=True):
+            seen += self.negative[k]
+            if seen > rank:
+                return max(-self.value(k), self.min)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for k in sorted(self.positive):
+            seen += self.positive[k]
+            if seen > rank:
+                return min(self.value(k), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+    def buckets(self) -> int:
+        return len(self.positive) + len(self.negative)
+
+
+@dataclass
+class task_stats:
+    pid: int
+    first_seen: int = 0
+    runtime: int = 0
+    queued_time: int = 0
+    queued_at: Optional[int] = None  # set while queued
+    waiting_since: Optional[int] = None  # set while queued and not curr
+    request_since: Optional[int] = None  # start of the current request
+    picks: int = 0
+    slices: int = 0
+    max_wait: int = 0
+
+
+@dataclass
+class sched_metrics:
+    relative_accuracy: float = 0.01
+    per_task_latency: bool = False  # a (bounded) wait latency sketch per task too
+    keep_waits: bool = False  # also keep every wait latency, to check the sketch against
+
+    def __post_init__(self):
+        self.tasks : dict[int, task_stats] = {}
+        self.curr : dict[int, Optional[int]] = {}  # id(rq) -> pid of its curr
+        self.lag_fns : dict[int, Optional[Callable]] = {}  # id(rq) -> get_lag for it, None to skip pick lags
+        self.pick_lag_skipped = 0  # picks on rqs w/o a get_lag, in summary()'s pick lag
+        self.now = 0
+        self.started : Optional[int] = None
+        self.wait = quantile_sketch(self.relative_accuracy)
+        self.pick_lag = quantile_sketch(self.relative_accuracy)
+        self.leave_lag = quantile_sketch(self.relative_accuracy)
+        self.slice_interval = quantile_sketch(self.relative_accuracy)
+        self.task_wait : dict[int, quantile_sketch] = {}
+        self.waits : list[int] = []
+        self.handlers = {"pick": self.on_pick, "run": self.on_run, "new-req": self.on_new_req,
+                         "join": self.on_join, "leave": self.on_leave}
+
+    # metrics of several rqs (eg smp_sim's) can go into one sched_metrics, pids are global.
+    # get_lag defaults to the one of the rq's simulator module, looked up once here. if it has none
+    # (eg group_sched's rqs) the picks on the rq are counted as skipped instead of adding a lag
+    def attach(self, rq, get_lag : Optional[Callable] = None):
+        self.curr[id(rq)] = rq.curr.pid if rq.curr is not None else None
+        if get_lag is None:
+            get_lag = getattr(sys.modules[type(rq).__module__], "get_lag", None)
+        self.lag_fns[id(rq)] = get_lag
+        for hook, fn in self.handlers.items():
+            register(rq, fn, (hook,))
+
+    def detach(self, rq):
+        for hook, fn in self.handlers.items():
+            unregister(rq, fn, (hook,))
+        self.curr.pop(id(rq), None)
+        self.lag_fns.pop(id(rq), None)
+
+    def task(self, pid : int, now : int) -> task_stats:
+        stats = self.tasks.get(pid)
+        if stats is None:
+            stats = self.tasks[pid] = task_stats(pid, first_seen=now)
+        return stats
+
+    def tick(self, now : int):
+        if self.started is None:
+            self.started = now
+        if now > self.now:
+            self.now = now
+
+    def on_join(self, rq, record : sched_record):
+        now = record.event.start_real_time
+        self.tick(now)
+        stats = self.task(record.se.pid, now)
+        stats.queued_at = now
+        stats.waiting_since = now
+        stats.request_since = now
+
+    def on_leave(self, rq, record : sched_record):
+        now = record.event.start_real_time
+        self.tick(now)
+        stats = self.task(record.se.pid, now)
+        if stats.queued_at is not None:
+            stats.queued_time += now - stats.queued_at
+        stats.queued_at = stats.waiting_since = stats.request_since = None
+        if record.lag is not None:
+            self.leave_lag.add(record.lag)
+        if self.curr.get(id(rq)) == record.se.pid:
+            self.curr[id(rq)] = None
+
+    def on_pick(self, rq, record : sched_record):
+        now = record.event.start_real_time
+        self.tick(now)
+        pid = record.se.pid
+        prev = self.curr.get(id(rq))
+
+        if prev != pid:
+            # curr was preempted, it waits from here on if it is still queued
+            if prev is not None:
+                prev_stats = self.tasks.get(prev)
+                if prev_stats is not None and prev_stats.queued_at is not None:
+                    prev_stats.waiting_since = now
+
+            stats = self.task(pid, now)
+            stats.picks += 1
+            if stats.waiting_since is not None:
+                wait = now - stats.waiting_since
+                self.wait.add(wait)
+                if self.keep_waits:
+                    self.waits.append(wait)
+                if wait > stats.max_wait:
+                    stats.max_wait = wait
+                if self.per_task_latency:
+                    sketch = self.task_wait.get(pid)
+                    if sketch is None:
+                        sketch = self.task_wait[pid] = quantile_sketch(self.relative_accuracy, max_buckets=256)
+                    sketch.add(wait)
+                stats.waiting_since = None
+            self.curr[id(rq)] = pid
+
+        get_lag = self.lag_fns.get(id(rq))
+        if get_lag is not None:
+            self.pick_lag.add(get_lag(rq, record.se))
+        else:
+            self.pick_lag_skipped += 1
+
+    def on_run(self, rq, record : sched_record):
+        event = record.event
+        self.tick(event.end_real_time)
+        self.task(record.se.pid, event.start_real_time).runtime += event.end_real_time - event.start_real_time
+
+    def on_new_req(self, rq, record : sched_record):
+        now = record.event.start_real_time
+        self.tick(now)
+        stats = self.task(record.se.pid, now)
+        if stats.request_since is not None:
+            self.slice_interval.add(now - stats.request_since)
+        stats.request_since = now
+        stats.slices += 1
+
+    # pid -> (share of all the real time seen, share of the time it was queued)
+    def shares(self) -> dict[int, tuple[float, float]]:
+        total = max(self.now - (self.started or 0), 1)
+        shares = {}
+        for pid, stats in self.tasks.items():
+            queued = stats.queued_time + (self.now - stats.queued_at if stats.queued_at is not None else 0)
+            shares[pid] = (stats.runtime / total, stats.runtime / queued if queued > 0 else 0.0)
+        return shares
+
+    def sketches(self) -> dict[str, quantile_sketch]:
+        return {"wait": self.wait, "pick lag": self.pick_lag, "leave lag": self.leave_lag,
+                "slice interval": self.slice_interval}
+
+    def summary(self, quantiles : tuple = (0.5, 0.9, 0.99, 0.999)) -> dict:
+        summary = {name: {"count": sketch.count, "mean": sketch.mean, "min": sketch.min if sketch.count else None,
+                          "max": sketch.max if sketch.count else None,
+                          **{f"p{100 * q:g}": sketch.quantile(q) for q in quantiles}}
+                   for name, sketch in self.sketches().items()}
+        summary["pick lag"]["skipped"] = self.pick_lag_skipped
+        return summary
+
+
+# real times are printed in ms, lags as they are
+UNITS = {"wait": (1e6, "ms"), "slice interval": (1e6, "ms")}
+
+
+def print_report(metrics : sched_metrics, top : int = 5):
+    for name, stats in metrics.summary().items():
+        skipped = f", {stats['skipped']} picks skipped w/o a get_lag" if stats.get("skipped") else ""
+        if not stats["count"]:
+            print(f"{name:>15}: no samples{skipped}")
+            continue
+        scale, unit = UNITS.get(name, (1, ""))
+        quantiles = ", ".join(f"{k} {v / scale:.3f}{unit}" for k, v in stats.items() if k.startswith("p"))
+        print(f"{name:>15}: {stats['count']} samples, mean {stats['mean'] / scale:.3f}{unit}, {quantiles}, "
+              f"max {stats['max'] / scale:.3f}{unit}{skipped}")
+
+    shares = sorted(metrics.shares().items(), key=lambda item: -item[1][0])
+    for pid, (share, queued_share) in shares[:top]:
+        stats = metrics.tasks[pid]
+        print(f"   P{pid}: cpu share {100 * share:.2f}%, {100 * queued_share:.1f}% of its queued time, "
+              f"{stats.picks} picks, {stats.slices} slices, max wait {stats.max_wait / 1e6:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="streaming scheduling metrics w/o keeping a timeline")
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument("--bursts", type=int, default=100, help="cpu bursts per task")
+    parser.add_argument("--accuracy", type=float, default=0.01, help="relative accuracy of the quantiles")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--exact", action="store_true", help="also keep every wait latency and print the exact quantiles")
+    args = parser.parse_args()
+
+    simulator_simple.verbose = False
+
+    rq = simulator_simple.rq_struct([], record_timeline=False)
+    metrics = sched_metrics(args.accuracy, keep_waits=args.exact)
+    metrics.attach(rq)
+
+    sim = event_sim(sleepy_tasks(args.tasks, args.seed, bursts_per_task=args.bursts), rq=rq)
+    start = time.perf_counter()
+    result = sim.run()
+    elapsed = time.perf_counter() - start
+
+    print(f"simulated {result.now / 1e9:.2f}s in {elapsed:.1f}s: {result.picks} picks, "
+          f"{sum(s.buckets() for s in metrics.sketches().values())} sketch buckets, timeline {len(rq.timeline)} events")
+    print_report(metrics)
+
+    if args.exact and metrics.waits:
+        waits = sorted(metrics.waits)
+        for q in (0.5, 0.9, 0.99, 0.999):
+            exact = waits[min(len(waits) - 1, int(q * (len(waits) - 1)))]
+            print(f"wait p{100 * q:g}: sketch {metrics.wait.quantile(q) / 1e6:.4f}ms, exact {exact / 1e6:.4f}ms")
+
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,52 @@
+from __future__ import annotations
+from typing import Callable
+
+
+# the slice rollover loops behind the simulators' run_curr_ticks and run_curr_for. what running
+# does to the rq depends on the model, so each simulator passes its own account_run(rq, amount,
+# ticks=1) (move time on by ticks times amount, w/o looking at the slice) and update_deadline(rq)
+# (start a new request if the slice is used up); these only work out how much to account between
+# the update_deadline calls
+
+accounter = Callable[[object, int, int], None]
+deadline_updater = Callable[[object], bool]
+
+
+# same as account_run + update_deadline num_ticks times, one account_run per stretch of ticks
+# between slice rollovers. account_run adds the float parts of a stretch a tick at a time, so the
+# rq ends up bit for bit where the per-tick loop would
+def run_ticks(rq, amount_to_tick : int, num_ticks : int, account_run : accounter, update_deadline : deadline_updater):
+    curr = rq.curr
+
+    while num_ticks > 0:
+        # ticks until update_deadline fires, at most one rollover per tick
+        if amount_to_tick > 0:
+            ticks = max(1, -(-(curr.slice - curr.time_gotten_in_slice) // amount_to_tick))
+        else:
+            ticks = 1 if curr.time_gotten_in_slice >= curr.slice else num_ticks
+        ticks = min(ticks, num_ticks)
+
+        account_run(rq, amount_to_tick, ticks)
+        update_deadline(rq)
+
+        num_ticks -= ticks
+
+
+# run curr for an arbitrary duration, issuing each new request exactly when a slice is used up
+def run_for(rq, duration : int, account_run : accounter, update_deadline : deadline_updater):
+    curr = rq.curr
+
+    # a slice that is never used up would roll over forever w/o time moving on
+    if curr.slice <= 0 and duration > 0:
+        raise ValueError(f"P{curr.pid} has slice {curr.slice}, can't run it for {duration}")
+
+    while True:
+        piece = min(duration, max(curr.slice - curr.time_gotten_in_slice, 0))
+        if piece > 0:
+            account_run(rq, piece)
+            duration -= piece
+
+        update_deadline(rq)
+
+        if duration <= 0:
+            break
@@ -0,0 +1,228 @@
+from __future__ import annotations
+from typing import Callable, Iterator, Optional
+
+
+# slack used when pruning on the lag part of eligibility: a subtree is only skipped if
+# every lag point in it is clearly above virt_time, so float rounding in the cached
+# lag points can never hide an entity that get_lag would call eligible
+LAG_POINT_SLACK : float = 1e-12
+
+
+class tree_node:
+    __slots__ = ("se", "key", "te", "lag_point", "left", "right", "height", "min_te", "min_lag_point")
+
+    def __init__(self, se, key : tuple, te : float, lag_point : float):
+        self.se = se
+        self.key = key  # (deadline, seq) -- seq keeps the order entities were placed in
+        self.te = te
+        self.lag_point = lag_point
+        self.left : Optional[tree_node] = None
+        self.right : Optional[tree_node] = None
+        self.height = 1
+        self.min_te = te
+        self.min_lag_point = lag_point
+
+
+# balanced (avl) tree of entities ordered by deadline, augmented with the min time_eligible
+# and min lag point (the virt_time after which the entity's lag turns positive) per subtree,
+# same idea as the kernel's rbtree w/ min_vruntime
+class deadline_tree:
+
+    def __init__(self, entity_keys : Callable, procs=()):
+        # entity_keys(se) -> (deadline, time_eligible, lag_point)
+        self.entity_keys = entity_keys
+        self.root : Optional[tree_node] = None
+        self.nodes : dict[int, tree_node] = {}
+        self.next_seq = 0
+        for se in procs:
+            self.insert(se)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __bool__(self) -> bool:
+        return self.root is not None
+
+    def __contains__(self, se) -> bool:
+        return id(se) in self.nodes
+
+    def __iter__(self) -> Iterator:
+        stack = []
+        node = self.root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.se
+            node = node.right
+
+    def __repr__(self) -> str:
+        return f"deadline_tree({list(self)})"
+
+    def insert(self, se):
+        self._insert_seq(se, self.next_seq)
+        self.next_seq += 1
+
+    def remove(self, se):
+        node = self.nodes.pop(id(se))
+        self.root = _delete(self.root, node.key)
+
+    # re-key an entity after its deadline, te or lag point changed, keeping its position among ties
+    def update(self, se):
+        node = self.nodes.pop(id(se))
+        self.root = _delete(self.root, node.key)
+        self._insert_seq(se, node.key[1])
+
+    def _insert_seq(self, se, seq : int):
+        deadline, te, lag_point = self.entity_keys(se)
+        node = tree_node(se, (deadline, seq), te, lag_point)
+        self.nodes[id(se)] = node
+        self.root = _insert(self.root, node)
+
+    # same choice as the linear scan: earliest deadline among the eligible entities whose
+    # deadline is below the max, otherwise the first entity w/ the max deadline
+    def pick(self, virt_time : float, eligible : Callable):
+        if self.root is None:
+            raise ValueError("pick from an empty runqueue")
+
+        last = self.root
+        while last.right is not None:
+            last = last.right
+        max_deadline = last.key[0]
+
+        found = _first_eligible(self.root, virt_time, virt_time + LAG_POINT_SLACK * (abs(virt_time) + 1), eligible)
+        if found is not None and found.key[0] < max_deadline:
+            return found.se
+
+        return self._lower_bound(max_deadline).se
+
+    # smallest te / lag point among the entities ordered before se, ie the virt_time at which one
+    # of them can first become eligible
+    def min_point_before(self, se) -> float:
+        key = self.nodes[id(se)].key
+        best = float("inf")
+        node = self.root
+        while node is not None:
+            if node.key < key:
+                best = min(best, node.te, node.lag_point)
+                if node.left is not None:
+                    best = min(best, node.left.min_te, node.left.min_lag_point)
+                node = node.right
+            else:
+                node = node.left
+        return best
+
+    def _lower_bound(self, deadline) -> tree_node:
+        node = self.root
+        best = None
+        while node is not None:
+            if node.key[0] >= deadline:
+                best = node
+                node = node.left
+            else:
+                node = node.right
+        return best
+
+
+def _first_eligible(node : Optional[tree_node], virt_time : float, lag_bound : float, eligible : Callable) -> Optional[tree_node]:
+    if node is None or (virt_time < node.min_te and lag_bound < node.min_lag_point):
+        return None
+
+    found = _first_eligible(node.left, virt_time, lag_bound, eligible)
+    if found is not None:
+        return found
+
+    if eligible(node.se):
+        return node
+
+    return _first_eligible(node.right, virt_time, lag_bound, eligible)
+
+
+def _height(node : Optional[tree_node]) -> int:
+    return node.height if node is not None else 0
+
+
+def _pull(node : tree_node):
+    node.height = 1 + max(_height(node.left), _height(node.right))
+    node.min_te = node.te
+    node.min_lag_point = node.lag_point
+    for child in (node.left, node.right):
+        if child is not None:
+            if child.min_te < node.min_te:
+                node.min_te = child.min_te
+            if child.min_lag_point < node.min_lag_point:
+                node.min_lag_point = child.min_lag_point
+
+
+def _rotate_right(node : tree_node) -> tree_node:
+    top = node.left
+    node.left = top.right
+    top.right = node
+    _pull(node)
+    _pull(top)
+    return top
+
+
+def _rotate_left(node : tree_node) -> tree_node:
+    top = node.right
+    node.right = top.left
+    top.left = node
+    _pull(node)
+    _pull(top)
+    return top
+
+
+def _rebalance(node : tree_node) -> tree_node:
+    _pull(node)
+    balance = _height(node.left) - _height(node.right)
+
+    if balance > 1:
+        if _height(node.left.left) < _height(node.left.right):
+            node.left = _rotate_left(node.left)
+        return _rotate_right(node)
+
+    if balance < -1:
+        if _height(node.right.right) < _height(node.right.left):
+            node.right = _rotate_right(node.right)
+        return _rotate_left(node)
+
+    return node
+
+
+def _insert(node : Optional[tree_node], new : tree_node) -> tree_node:
+    if node is None:
+        return new
+
+    if new.key < node.key:
+        node.left = _insert(node.left, new)
+    else:
+        node.right = _insert(node.right, new)
+
+    return _rebalance(node)
+
+
+def _delete(node : Optional[tree_node], key : tuple) -> Optional[tree_node]:
+    if node is None:
+        raise KeyError(key)
+
+    if key < node.key:
+        node.left = _delete(node.left, key)
+    elif key > node.key:
+        node.right = _delete(node.right, key)
+    else:
+        if node.left is None:
+            return node.right
+        if node.right is None:
+            return node.left
+
+        # replace w/ the in-order successor
+        succ = node.right
+        while succ.left is not None:
+            succ = succ.left
+        node.right = _delete(node.right, succ.key)
+        succ.left = node.left
+        succ.right = node.right
+        node = succ
+
+    return _rebalance(node)
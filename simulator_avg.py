@@ -4,6 +4,9 @@ from typing import Optional
 import matplotlib.pyplot as plt
 from collections import defaultdict
 import random
+from sched_hooks import sched_record, register, emit, attach_timeline
+from timeline_store import columnar_timeline
+from trace_parser import parse_trace, trace_event, update_curr_event, pick_event, place_event, dequeue_event
 
 
 @dataclass
@@ -29,9 +32,24 @@ class rq_struct:
     num_running: int = 0
     curr: Optional[sched_entity] = None
 
-    timeline : list[scheduling_event] = field(default_factory=list)
+    timeline : list[scheduling_event] = field(default_factory=list)  # or a columnar_timeline, see sched_hooks.attach_timeline
     real_time : int = 0
 
+    procs_by_pid : dict[int, sched_entity] = field(default_factory=dict)  # queued entities, kept by place / dequeue
+
+    # event type -> callbacks, see sched_hooks
+    observers : dict[str, list] = field(default_factory=dict)
+    record_timeline : bool = True
+    coalesce_runs : bool = False  # merge back to back run events of one entity, see coalescing_timeline_sink
+    store : Optional[columnar_timeline] = None  # rq.timeline when it is a store, set by attach_timeline
+    # sinks to attach, None for the module's verbose flag at the time the rq is made
+    verbose : Optional[bool] = None
+
+    def __post_init__(self):
+        for se in self.all_procs:
+            self.procs_by_pid[se.pid] = se
+        attach_sinks(self)
+
 
 @dataclass
 class scheduling_event:
@@ -48,9 +66,23 @@ class scheduling_event:
 
     cls: str = "avg"
 
+# defaults for the rq_struct arguments of the same name, read when an rq_struct is made w/o
+# them: setting a flag later doesn't change the sinks of the rqs already made
 verbose : bool = True
 
 
+def attach_sinks(rq : rq_struct):
+    attach_timeline(rq)
+    if rq.verbose is None:
+        rq.verbose = verbose
+    if rq.verbose:
+        register(rq, verbose_sink)
+
+
+def verbose_sink(rq : rq_struct, record : sched_record):
+    print(record.event)
+
+
 def print_rq(rq : rq_struct):
     print(f"avg_vrt: {rq.avg_vrt:.1f}")
     print("  num_running : ", rq.num_running)
@@ -74,12 +106,12 @@ def pick_eevdf(rq : rq_struct):
             min_deadline = se.deadline
             next_se = se
     
+    prev = rq.curr
     rq.curr = next_se
 
-    event = scheduling_event(rq.curr.pid, "pick", rq.real_time, rq.avg_vrt, rq.real_time, rq.avg_vrt, rq.curr.time_eligible, rq.curr.deadline)
-    if verbose:
-        print(event)
-    rq.timeline.append(event)
+    if rq.store is not None or "pick" in rq.observers:
+        emit(rq, scheduling_event, "pick", rq.curr, rq.real_time, rq.avg_vrt, rq.real_time, rq.avg_vrt,
+             rq.curr.time_eligible, rq.curr.deadline, prev_pid=prev.pid if prev else -1)
 
 
 def entity_eligible(rq : rq_struct, se : sched_entity) -> bool:
@@ -97,10 +129,9 @@ def update_deadline(rq: rq_struct) -> bool:
     curr.deadline = curr.time_eligible + curr.slice
 
 
-    event = scheduling_event(rq.curr.pid, "new-req", rq.real_time, rq.avg_vrt, rq.real_time, rq.avg_vrt, curr.time_eligible, curr.deadline)
-    if verbose:
-        print(event)
-    rq.timeline.append(event)
+    if rq.store is not None or "new-req" in rq.observers:
+        emit(rq, scheduling_event, "new-req", curr, rq.real_time, rq.avg_vrt, rq.real_time, rq.avg_vrt,
+             curr.time_eligible, curr.deadline)
 
     curr.time_gotten_in_slice = max(curr.time_gotten_in_slice - curr.slice, 0)
 
@@ -111,17 +142,12 @@ def run_curr(rq: rq_struct, amount_to_tick : int, pid : int = None) -> bool:
     # sometimes linux will deq and then imediately re-place the curr proc
     # this should only be the case when running from linux output, only set the value there
     if rq.curr is None and pid is not None:
-        for s in rq.all_procs:
-            if s.pid == pid:
-                rq.curr = s
+        rq.curr = rq.procs_by_pid.get(pid)
     
     curr : sched_entity = rq.curr
 
-    event = scheduling_event(rq.curr.pid, "run", rq.real_time, rq.avg_vrt, rq.real_time + amount_to_tick, 
-                             rq.avg_vrt +  amount_to_tick / rq.num_running, curr.time_eligible, curr.deadline)
-    if verbose:
-        print(event)
-    rq.timeline.append(event)
+    start_real_time = rq.real_time
+    start_avg_vrt = rq.avg_vrt
 
     curr.vruntime += amount_to_tick
     curr.time_gotten_in_slice += amount_to_tick
@@ -130,6 +156,10 @@ def run_curr(rq: rq_struct, amount_to_tick : int, pid : int = None) -> bool:
 
     rq.avg_vrt += amount_to_tick / rq.num_running
 
+    if rq.store is not None or "run" in rq.observers:
+        emit(rq, scheduling_event, "run", curr, start_real_time, start_avg_vrt, start_real_time + amount_to_tick,
+             start_avg_vrt +  amount_to_tick / rq.num_running, curr.time_eligible, curr.deadline)
+
     update_deadline(rq)
     
 
@@ -139,9 +169,16 @@ def get_lag(rq : rq_struct, se : sched_entity) -> float:
     return rq.avg_vrt - se.vruntime
 
 
+# the kernel's vlag (place_entity's vlag: in the traces) is avg_vruntime - vruntime, the same as
+# get_lag here (vruntime goes up 1:1 w/ runtime in this model, as it does at NICE_0_LOAD)
+def lag_from_vlag(vlag : float, weight : int) -> float:
+    return vlag
+
+
 def place_entity(rq : rq_struct, se : sched_entity, lag : int):
     
     rq.all_procs.append(se)
+    rq.procs_by_pid[se.pid] = se
 
     rq.num_running += 1
 
@@ -154,11 +191,9 @@ def place_entity(rq : rq_struct, se : sched_entity, lag : int):
     se.time_eligible = rq.avg_vrt - se.time_gotten_in_slice
     se.deadline = se.time_eligible + se.slice
 
-    event = scheduling_event(se.pid, "join", rq.real_time, og_avg_vrt, rq.real_time, 
-                             rq.avg_vrt, se.time_eligible, se.deadline)
-    if verbose:
-        print(event)
-    rq.timeline.append(event)
+    if rq.store is not None or "join" in rq.observers:
+        emit(rq, scheduling_event, "join", se, rq.real_time, og_avg_vrt, rq.real_time, rq.avg_vrt, se.time_eligible,
+             se.deadline, lag=lag)
     
 
 
@@ -170,6 +205,8 @@ def dequeue_entity(rq : rq_struct, se : sched_entity) -> float:
     og_avg_vrt = rq.avg_vrt
 
     rq.all_procs.remove(se)
+    if rq.procs_by_pid.get(se.pid) is se:
+        del rq.procs_by_pid[se.pid]
     rq.num_running -= 1
 
     p_lag = get_lag(rq, se)
@@ -177,11 +214,9 @@ def dequeue_entity(rq : rq_struct, se : sched_entity) -> float:
     if rq.num_running > 0:
         rq.avg_vrt = sum(s.vruntime for s in rq.all_procs) / rq.num_running
 
-    event = scheduling_event(se.pid, "leave", rq.real_time, og_avg_vrt, rq.real_time, 
-                             rq.avg_vrt, se.time_eligible, se.deadline)
-    if verbose:
-        print(event)
-    rq.timeline.append(event)
+    if rq.store is not None or "leave" in rq.observers:
+        emit(rq, scheduling_event, "leave", se, rq.real_time, og_avg_vrt, rq.real_time, rq.avg_vrt, se.time_eligible,
+             se.deadline, lag=p_lag)
     
 
     return p_lag
@@ -288,59 +323,40 @@ def random_short(rq : rq_struct):
 
 
 
-def run_from_linux_output_file(rq : rq_struct):
+def run_from_linux_output_file(rq : rq_struct, file_path : str = 'out.txt'):
 
     pid_to_se_and_lag = {}
 
-    with open('out.txt', 'r') as file:
-        for line in file:
-            if 'update_curr' in line:
-                time_run = get_val('delta exec: ', ',', line)
-                pid_value = get_val('update_curr ', ':', line)
-                run_curr(rq, int(time_run), int(pid_value))
-
-            if 'pick_next_entity' in line:
-                new_pid = get_val('new_curr: ', ' ', line)
-                pick_eevdf(rq)
-
-                if (rq.curr.pid != int(new_pid)):
-                    print("ERROR - diff in choice -- lnx: ", new_pid, ", this program: ", rq.curr.pid)
-                    for s in rq.all_procs:
-                        if s.pid == int(new_pid):
-                            rq.curr = s
-    
-            if 'place_entity' in line:
-                new_pid = get_val('placing se: ', ', ', line)
-                s_weight = get_val('weight: ', ', ', line)
+    for event in parse_trace(file_path):
+        replay_event(rq, event, pid_to_se_and_lag)
 
-                if new_pid in pid_to_se_and_lag:
-                    se_to_add = pid_to_se_and_lag[new_pid][0]
-                    lag = pid_to_se_and_lag[new_pid][1]
-                    pid_to_se_and_lag.__delitem__(new_pid)
-                else:
-                    se_to_add = sched_entity(int(new_pid), weight=int(s_weight))
-                    lag = 0
 
-                place_entity(rq, se_to_add, lag)
+def replay_event(rq : rq_struct, event : trace_event, pid_to_se_and_lag : dict):
 
-            if 'dequeue_entity' in line:
-                pid = get_val(' task being dequeued ', ', ', line)
+    if isinstance(event, update_curr_event):
+        run_curr(rq, event.delta_exec, event.pid)
 
-                for s in rq.all_procs:
-                    if s.pid == int(pid):
-                        lag = dequeue_entity(rq, s)
-                        pid_to_se_and_lag[s.pid] = (s, lag)
-                        break
+    elif isinstance(event, pick_event):
+        pick_eevdf(rq)
 
+        if (rq.curr.pid != event.new_curr):
+            print("ERROR - diff in choice -- lnx: ", event.new_curr, ", this program: ", rq.curr.pid)
+            rq.curr = rq.procs_by_pid.get(event.new_curr, rq.curr)
 
+    elif isinstance(event, place_event):
+        if event.pid in pid_to_se_and_lag:
+            se_to_add, lag = pid_to_se_and_lag.pop(event.pid)
+        else:
+            se_to_add = sched_entity(event.pid, weight=event.weight)
+            lag = 0
 
-def get_val(start : str, end : str, line : str)->str:
-    
-    start_index = line.find(start) + len(start)
-    end_index = line.find(end, start_index)
-    if end_index == -1: 
-        end_index = len(line)
-    return line[start_index:end_index].strip()
+        place_entity(rq, se_to_add, lag)
+
+    elif isinstance(event, dequeue_event):
+        s = rq.procs_by_pid.get(event.pid)
+        if s is not None:
+            lag = dequeue_entity(rq, s)
+            pid_to_se_and_lag[s.pid] = (s, lag)
 
 
 
@@ -4,6 +4,11 @@ from typing import Optional
 import matplotlib.pyplot as plt
 from collections import defaultdict
 import random
+from sched_run import run_ticks, run_for
+from sched_hooks import sched_record, register, emit, attach_timeline
+from timeline_store import columnar_timeline
+from trace_writer import trace_writer, format_echo, ECHO_TYPES
+from trace_parser import parse_trace, trace_event, update_curr_event, pick_event, place_event, dequeue_event
 
 
 @dataclass
@@ -25,11 +30,33 @@ class rq_struct:
     all_procs: list[sched_entity]
     avg_vrt: int = 0 # weighted avg
     total_load: int = 0
+    # sum of weight * (vruntime - min_vruntime) over all_procs, kept up to date so avg_vrt is O(1).
+    # relative to min_vruntime like linux.py's avg_vruntime, so it stays small however long the run
+    weighted_vrt_sum: float = 0
+    min_vruntime: float = 0
     curr: Optional[sched_entity] = None
 
-    timeline : list[scheduling_event] = field(default_factory=list)
+    timeline : list[scheduling_event] = field(default_factory=list)  # or a columnar_timeline, see sched_hooks.attach_timeline
     real_time : int = 0
 
+    procs_by_pid : dict[int, sched_entity] = field(default_factory=dict)  # queued entities, kept by place / dequeue
+
+    # event type -> callbacks, see sched_hooks
+    observers : dict[str, list] = field(default_factory=dict)
+    record_timeline : bool = True
+    coalesce_runs : bool = False  # merge back to back run events of one entity, see coalescing_timeline_sink
+    store : Optional[columnar_timeline] = None  # rq.timeline when it is a store, set by attach_timeline
+    # sinks to attach, None for the module's verbose / print_match_linux flags at the time the rq is made
+    verbose : Optional[bool] = None
+    print_match_linux : Optional[bool] = None
+    # the echo_file writer, set by attach_sinks. the call sites write the echo to it themselves
+    echo : Optional[trace_writer] = field(default=None, init=False)
+
+    def __post_init__(self):
+        for se in self.all_procs:
+            self.procs_by_pid[se.pid] = se
+        attach_sinks(self)
+
 
 @dataclass
 class scheduling_event:
@@ -46,8 +73,56 @@ class scheduling_event:
 
     cls: str = "avg"
 
+# defaults for the rq_struct arguments of the same name, read when an rq_struct is made w/o
+# them: setting a flag later doesn't change the sinks of the rqs already made
 verbose : bool = False
 print_match_linux = True
+# w/ print_match_linux, write the echo to this file through a buffered trace_writer instead of
+# printing it (rq.echo), see trace_writer.to_text for getting the text back
+echo_file : Optional[str] = None
+echo_format : str = "binary"  # or jsonl
+_echo_writers : dict[str, trace_writer] = {}  # one per file, shared by every rq like stdout is
+
+
+def attach_sinks(rq : rq_struct):
+    attach_timeline(rq)
+    if rq.verbose is None:
+        rq.verbose = verbose
+    if rq.print_match_linux is None:
+        rq.print_match_linux = print_match_linux
+    if rq.print_match_linux:
+        if echo_file is not None:
+            writer = _echo_writers.get(echo_file)
+            if writer is None or writer.file.closed:
+                writer = _echo_writers[echo_file] = trace_writer(echo_file, format=echo_format)
+            rq.echo = writer
+        else:
+            register(rq, linux_echo_sink, ECHO_TYPES)
+    if rq.verbose:
+        register(rq, verbose_sink)
+
+
+def verbose_sink(rq : rq_struct, record : sched_record):
+    print(record.event)
+
+
+# the values of the kernel's printks for an event, in trace_writer.ECHO_FIELDS order
+def echo_values(rq : rq_struct, record : sched_record) -> tuple[str, tuple]:
+    event, se = record.event, record.se
+
+    if event.type == "pick":
+        return "pick", (record.prev_pid, se.pid)
+    if event.type == "run":
+        return "run", (se.pid, event.end_real_time - event.start_real_time, rq.avg_vrt)
+    if event.type == "join":
+        return "join", (se.pid, se.weight, record.lag, se.vruntime, se.time_eligible, se.time_gotten_in_slice)
+    if event.type == "leave":
+        return "leave", (rq.curr.pid if rq.curr else -1, se.pid, record.lag)
+
+
+# echo in the format of the kernel's printks, so a run can be diffed against out.txt
+def linux_echo_sink(rq : rq_struct, record : sched_record):
+    print(format_echo(*echo_values(rq, record)))
 
 
 def print_rq(rq : rq_struct):
@@ -67,21 +142,25 @@ def print_se(rq : rq_struct, se : sched_entity):
 def pick_eevdf(rq : rq_struct):
     next_se = max(rq.all_procs, key=lambda s: s.deadline)
     min_deadline : int = next_se.deadline
+    min_vrt = next_se.vruntime
 
     for se in rq.all_procs:
+        if se.vruntime < min_vrt:
+            min_vrt = se.vruntime
         if se.deadline < min_deadline and entity_eligible(rq, se):
             min_deadline = se.deadline
             next_se = se
+
+    update_min_vruntime(rq, min_vrt)
     
-    if print_match_linux:
-        print(f"pick_next_entity: curr: {rq.curr.pid if rq.curr else -1}, new_curr: {next_se.pid}")
-    
+    prev = rq.curr
     rq.curr = next_se
 
-    event = scheduling_event(rq.curr.pid, "pick", rq.real_time, rq.avg_vrt, rq.real_time, rq.avg_vrt, rq.curr.time_eligible, rq.curr.deadline)
-    if verbose:
-        print(event)
-    rq.timeline.append(event)
+    if rq.store is not None or "pick" in rq.observers:
+        emit(rq, scheduling_event, "pick", rq.curr, rq.real_time, rq.avg_vrt, rq.real_time, rq.avg_vrt,
+             rq.curr.time_eligible, rq.curr.deadline, prev_pid=prev.pid if prev else -1)
+    if rq.echo is not None:
+        rq.echo.write("pick", (prev.pid if prev else -1, rq.curr.pid))
 
 
 def entity_eligible(rq : rq_struct, se : sched_entity) -> bool:
@@ -99,10 +178,9 @@ def update_deadline(rq: rq_struct) -> bool:
     curr.deadline = curr.time_eligible + curr.slice
 
 
-    event = scheduling_event(rq.curr.pid, "new-req", rq.real_time, rq.avg_vrt, rq.real_time, rq.avg_vrt, curr.time_eligible, curr.deadline)
-    if verbose:
-        print(event)
-    rq.timeline.append(event)
+    if rq.store is not None or "new-req" in rq.observers:
+        emit(rq, scheduling_event, "new-req", curr, rq.real_time, rq.avg_vrt, rq.real_time, rq.avg_vrt,
+             curr.time_eligible, curr.deadline)
 
     curr.time_gotten_in_slice = max(curr.time_gotten_in_slice - curr.slice, 0)
 
@@ -113,30 +191,65 @@ def run_curr(rq: rq_struct, amount_to_tick : int, pid : int = None) -> bool:
     # sometimes linux will deq and then imediately re-place the curr proc
     # this should only be the case when running from linux output, only set the value there
     if rq.curr is None and pid is not None:
-        for s in rq.all_procs:
-            if s.pid == pid:
-                rq.curr = s
-    
+        rq.curr = rq.procs_by_pid.get(pid)
+
+    account_run(rq, amount_to_tick)
+
+    update_deadline(rq)
+
+
+# same as calling run_curr num_ticks times, but the slice rollovers are worked out directly and
+# there is one run event per stretch of ticks between them
+def run_curr_ticks(rq: rq_struct, amount_to_tick : int, num_ticks : int, pid : int = None):
+
+    if rq.curr is None and pid is not None:
+        rq.curr = rq.procs_by_pid.get(pid)
+
+    run_ticks(rq, amount_to_tick, num_ticks, account_run, update_deadline)
+
+
+# run curr for an arbitrary duration, issuing each new request exactly when a slice is used up
+def run_curr_for(rq: rq_struct, duration : int, pid : int = None):
+
+    if rq.curr is None and pid is not None:
+        rq.curr = rq.procs_by_pid.get(pid)
+
+    run_for(rq, duration, account_run, update_deadline)
+
+
+# ticks > 1 runs curr for ticks times amount as one run event, see sched_run.run_ticks
+def account_run(rq: rq_struct, amount : int, ticks : int = 1):
+
     curr : sched_entity = rq.curr
 
-    event = scheduling_event(rq.curr.pid, "run", rq.real_time, rq.avg_vrt, rq.real_time + amount_to_tick, 
-                             rq.avg_vrt +  amount_to_tick / rq.total_load, curr.time_eligible, curr.deadline)
-    if verbose:
-        print(event)
-    rq.timeline.append(event)
+    start_real_time = rq.real_time
+    start_avg_vrt = rq.avg_vrt
 
-    curr.vruntime += amount_to_tick
-    curr.time_gotten_in_slice += amount_to_tick
+    curr.vruntime += amount * ticks
+    curr.time_gotten_in_slice += amount * ticks
 
-    rq.real_time += amount_to_tick
+    rq.real_time += amount * ticks
 
-    rq.avg_vrt += amount_to_tick * curr.weight / rq.total_load
+    # a tick at a time, the float sums have to round like run_curr's would
+    step = amount * curr.weight / rq.total_load
+    for _ in range(ticks):
+        rq.weighted_vrt_sum += curr.weight * amount
+        rq.avg_vrt += step
+
+    if rq.store is not None or "run" in rq.observers:
+        emit(rq, scheduling_event, "run", curr, start_real_time, start_avg_vrt, rq.real_time,
+             start_avg_vrt +  amount * ticks / rq.total_load, curr.time_eligible, curr.deadline)
+    if rq.echo is not None:
+        rq.echo.write("run", (curr.pid, amount * ticks, rq.avg_vrt))
 
-    if print_match_linux:
-        print(f"update_curr {curr.pid}, delta_exec: {amount_to_tick}, new avg vrt: {rq.avg_vrt}")
 
-    update_deadline(rq)
-    
+
+# move the reference of weighted_vrt_sum up to min_vrt, avg_vrt doesn't change
+def update_min_vruntime(rq : rq_struct, min_vrt : float):
+    delta = min_vrt - rq.min_vruntime
+    if delta > 0:
+        rq.weighted_vrt_sum -= rq.total_load * delta
+        rq.min_vruntime = min_vrt
 
 
 def get_lag(rq : rq_struct, se : sched_entity) -> float:
@@ -144,9 +257,16 @@ def get_lag(rq : rq_struct, se : sched_entity) -> float:
     return rq.avg_vrt - se.vruntime
 
 
+# the kernel's vlag (place_entity's vlag: in the traces) is avg_vruntime - vruntime, the same as
+# get_lag here (vruntime goes up 1:1 w/ runtime in this model, as it does at NICE_0_LOAD)
+def lag_from_vlag(vlag : float, weight : int) -> float:
+    return vlag
+
+
 def place_entity(rq : rq_struct, se : sched_entity, lag : int):
     
     rq.all_procs.append(se)
+    rq.procs_by_pid[se.pid] = se
 
     rq.total_load += se.weight
 
@@ -154,19 +274,17 @@ def place_entity(rq : rq_struct, se : sched_entity, lag : int):
 
     se.vruntime = rq.avg_vrt - lag
 
-    rq.avg_vrt = sum(s.weight * s.vruntime for s in rq.all_procs) / rq.total_load
+    rq.weighted_vrt_sum += se.weight * (se.vruntime - rq.min_vruntime)
+    rq.avg_vrt = rq.min_vruntime + rq.weighted_vrt_sum / rq.total_load
 
     se.time_eligible = rq.avg_vrt - se.time_gotten_in_slice
     se.deadline = se.time_eligible + se.slice
 
-    if print_match_linux:
-        print(f"place_entity placing se: {se.pid}, w/ weight: {se.weight}, vlag: {lag},  vrt: {se.vruntime}, new te val: {se.time_eligible}, t_g_i_s: {se.time_gotten_in_slice}")
-    
-    event = scheduling_event(se.pid, "join", rq.real_time, og_avg_vrt, rq.real_time, 
-                             rq.avg_vrt, se.time_eligible, se.deadline)
-    if verbose:
-        print(event)
-    rq.timeline.append(event)
+    if rq.store is not None or "join" in rq.observers:
+        emit(rq, scheduling_event, "join", se, rq.real_time, og_avg_vrt, rq.real_time, rq.avg_vrt, se.time_eligible,
+             se.deadline, lag=lag)
+    if rq.echo is not None:
+        rq.echo.write("join", (se.pid, se.weight, lag, se.vruntime, se.time_eligible, se.time_gotten_in_slice))
     
 
 
@@ -178,22 +296,26 @@ def dequeue_entity(rq : rq_struct, se : sched_entity) -> float:
     og_avg_vrt = rq.avg_vrt
 
     rq.all_procs.remove(se)
+    if rq.procs_by_pid.get(se.pid) is se:
+        del rq.procs_by_pid[se.pid]
     rq.total_load -= se.weight
+    rq.weighted_vrt_sum -= se.weight * (se.vruntime - rq.min_vruntime)
 
     p_lag = get_lag(rq, se)
     clamped_lag = max(-2 * se.slice, min(p_lag, 2 * se.slice))
 
     if rq.total_load > 0:
-        rq.avg_vrt = sum(s.weight * s.vruntime for s in rq.all_procs) / rq.total_load
+        rq.avg_vrt = rq.min_vruntime + rq.weighted_vrt_sum / rq.total_load
+    else:
+        # nothing left to sum, drop any rounding that built up and start over from avg_vrt
+        rq.weighted_vrt_sum = 0
+        rq.min_vruntime = rq.avg_vrt
     
-    if print_match_linux:
-        print(f"dequeue_entity: curr: {rq.curr.pid if rq.curr else -1}, task being dequeued {se.pid}, it's lag: {clamped_lag}")
-
-    event = scheduling_event(se.pid, "leave", rq.real_time, og_avg_vrt, rq.real_time, 
-                             rq.avg_vrt, se.time_eligible, se.deadline)
-    if verbose:
-        print(event)
-    rq.timeline.append(event)
+    if rq.store is not None or "leave" in rq.observers:
+        emit(rq, scheduling_event, "leave", se, rq.real_time, og_avg_vrt, rq.real_time, rq.avg_vrt, se.time_eligible,
+             se.deadline, lag=clamped_lag)
+    if rq.echo is not None:
+        rq.echo.write("leave", (rq.curr.pid if rq.curr else -1, se.pid, clamped_lag))
     
 
     return clamped_lag
@@ -232,8 +354,7 @@ def random_long(rq : rq_struct):
 
         ticks_to_tick = random.randrange(1, 5)
 
-        for _ in range(ticks_to_tick):
-            run_curr(rq, 4000000)
+        run_curr_ticks(rq, 4000000, ticks_to_tick)
         
         curr_tick += ticks_to_tick
         pick_eevdf(rq)
@@ -300,62 +421,42 @@ def random_short(rq : rq_struct):
 
 
 
-def run_from_linux_output_file(rq : rq_struct):
+def run_from_linux_output_file(rq : rq_struct, file_path : str = 'out.txt'):
 
     pid_to_se_and_lag = {}
 
-    with open('out.txt', 'r') as file:
-        for line in file:
-            if 'update_curr' in line:
-                time_run = get_val('delta exec: ', ',', line)
-                pid_value = get_val('update_curr ', ':', line)
-                run_curr(rq, int(time_run), int(pid_value))
-
-            if 'pick_next_entity' in line:
-                new_pid = int(get_val('new_curr: ', ' ', line))
-                pick_eevdf(rq)
-
-                if (rq.curr.pid != new_pid):
-                    print("ERROR - diff in choice -- lnx: ", new_pid, ", this program: ", rq.curr.pid)
-                    for s in rq.all_procs:
-                        if s.pid == new_pid:
-                            rq.curr = s
-    
-            if 'place_entity' in line:
-                new_pid = int(get_val('placing se: ', ', ', line))
-                s_weight = get_val('weight: ', ', ', line)
+    for event in parse_trace(file_path):
+        replay_event(rq, event, pid_to_se_and_lag)
 
-                if new_pid in pid_to_se_and_lag.keys():
-                    se_to_add = pid_to_se_and_lag[new_pid][0]
-                    lag = pid_to_se_and_lag[new_pid][1]
-                    pid_to_se_and_lag.__delitem__(new_pid)
-                else:
-                    se_to_add = sched_entity(int(new_pid), weight=int(s_weight))
-                    lag = 0
 
-                if int(new_pid) in [s.pid for s in rq.all_procs]:
-                    print(line)
-                    exit(-1)
-                place_entity(rq, se_to_add, lag)
-
-            if 'dequeue_entity' in line:
-                pid = get_val(' task being dequeued ', ', ', line)
-
-                for s in rq.all_procs:
-                    if s.pid == int(pid):
-                        lag = dequeue_entity(rq, s)
-                        pid_to_se_and_lag[s.pid] = (s, lag)
-                        break
+def replay_event(rq : rq_struct, event : trace_event, pid_to_se_and_lag : dict):
 
+    if isinstance(event, update_curr_event):
+        run_curr(rq, event.delta_exec, event.pid)
 
+    elif isinstance(event, pick_event):
+        pick_eevdf(rq)
 
-def get_val(start : str, end : str, line : str)->str:
-    
-    start_index = line.find(start) + len(start)
-    end_index = line.find(end, start_index)
-    if end_index == -1: 
-        end_index = len(line)
-    return line[start_index:end_index].strip()
+        if (rq.curr.pid != event.new_curr):
+            print("ERROR - diff in choice -- lnx: ", event.new_curr, ", this program: ", rq.curr.pid)
+            rq.curr = rq.procs_by_pid.get(event.new_curr, rq.curr)
+
+    elif isinstance(event, place_event):
+        if event.pid in pid_to_se_and_lag:
+            se_to_add, lag = pid_to_se_and_lag.pop(event.pid)
+        else:
+            se_to_add = sched_entity(event.pid, weight=event.weight)
+            lag = 0
+
+        if event.pid in rq.procs_by_pid:
+            raise ValueError(f"P{event.pid} placed while it is still queued: {event}")
+        place_entity(rq, se_to_add, lag)
+
+    elif isinstance(event, dequeue_event):
+        s = rq.procs_by_pid.get(event.pid)
+        if s is not None:
+            lag = dequeue_entity(rq, s)
+            pid_to_se_and_lag[s.pid] = (s, lag)
 
 
 
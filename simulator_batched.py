@@ -0,0 +1,309 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Optional, Union
+import numpy as np
+
+
+# runs K independent runqueues (lanes) of the simulator_simple model in lockstep. every per-entity
+# value is a (lanes, slots) array, slot i of a lane is entity pid i + 1, and place / pick / run /
+# dequeue act on all lanes selected by a boolean lane mask at once
+
+lanes_arg = Union[np.ndarray, slice]
+
+
+@dataclass
+class batched_rq:
+    num_lanes: int
+    weights: list[int]
+    slices: list[int]
+
+    virt_time: np.ndarray = field(init=False)
+    total_load: np.ndarray = field(init=False)
+    real_time: np.ndarray = field(init=False)
+    curr: np.ndarray = field(init=False)  # slot of the current entity per lane, -1 if none
+    next_seq: np.ndarray = field(init=False)
+
+    present: np.ndarray = field(init=False)
+    weight: np.ndarray = field(init=False)
+    slice: np.ndarray = field(init=False)
+    runtime_since_placed: np.ndarray = field(init=False)
+    virt_time_placed: np.ndarray = field(init=False)
+    time_eligible: np.ndarray = field(init=False)
+    deadline: np.ndarray = field(init=False)
+    time_gotten_in_slice: np.ndarray = field(init=False)
+    seq: np.ndarray = field(init=False)
+
+    def __post_init__(self):
+        shape = (self.num_lanes, len(self.weights))
+        self.virt_time = np.zeros(self.num_lanes)
+        self.total_load = np.zeros(self.num_lanes, dtype=np.int64)
+        self.real_time = np.zeros(self.num_lanes, dtype=np.int64)
+        self.curr = np.full(self.num_lanes, -1, dtype=np.int64)
+        self.next_seq = np.zeros(self.num_lanes, dtype=np.int64)
+
+        self.present = np.zeros(shape, dtype=bool)
+        self.weight = np.broadcast_to(np.array(self.weights, dtype=np.int64), shape).copy()
+        self.slice = np.broadcast_to(np.array(self.slices, dtype=np.int64), shape).copy()
+        self.runtime_since_placed = np.zeros(shape, dtype=np.int64)
+        self.virt_time_placed = np.zeros(shape)
+        self.time_eligible = np.zeros(shape)
+        self.deadline = np.full(shape, 3906.0)
+        self.time_gotten_in_slice = np.zeros(shape, dtype=np.int64)
+        self.seq = np.zeros(shape, dtype=np.int64)
+
+    @property
+    def num_slots(self) -> int:
+        return len(self.weights)
+
+
+# per lane results of a batched run, slot-indexed where it is per entity
+@dataclass
+class lane_stats:
+    picks: np.ndarray  # (lanes, slots) times each entity was picked
+    runtime: np.ndarray  # (lanes, slots) real time each entity ran
+    new_reqs: np.ndarray  # (lanes, slots) slice rollovers
+    max_abs_lag: np.ndarray  # (lanes,) largest |lag| of any queued entity seen at a pick
+    virt_time: np.ndarray  # (lanes,) final virt time
+
+
+def lane_index(brq : batched_rq, lanes : lanes_arg) -> np.ndarray:
+    if isinstance(lanes, slice):
+        return np.arange(brq.num_lanes)[lanes]
+    return np.flatnonzero(lanes)
+
+
+def get_lag(brq : batched_rq) -> np.ndarray:
+    lag = brq.weight * (brq.virt_time[:, None] - brq.virt_time_placed) - brq.runtime_since_placed
+    return np.where(brq.present, lag, 0.0)
+
+
+def place_entity(brq : batched_rq, lanes : lanes_arg, slot, lag):
+    idx = lane_index(brq, lanes)
+    slot = np.broadcast_to(slot, brq.num_lanes)[idx]
+    lag = np.broadcast_to(lag, brq.num_lanes)[idx]
+    w = brq.weight[idx, slot]
+
+    brq.total_load[idx] += w
+
+    brq.runtime_since_placed[idx, slot] = 0
+    brq.virt_time_placed[idx, slot] = brq.virt_time[idx] - lag / w
+
+    load = brq.total_load[idx]
+    brq.virt_time[idx] -= np.where(load > 0, lag / np.maximum(load, 1), 0.0)
+
+    te = brq.virt_time[idx] - brq.time_gotten_in_slice[idx, slot] / w
+    brq.time_eligible[idx, slot] = te
+    brq.deadline[idx, slot] = te + brq.slice[idx, slot] / w
+
+    brq.seq[idx, slot] = brq.next_seq[idx]
+    brq.next_seq[idx] += 1
+    brq.present[idx, slot] = True
+
+
+# returns the lag of the dequeued entity per lane (0 for lanes not in the mask)
+def dequeue_entity(brq : batched_rq, lanes : lanes_arg, slot) -> np.ndarray:
+    idx = lane_index(brq, lanes)
+    slot = np.broadcast_to(slot, brq.num_lanes)[idx]
+    w = brq.weight[idx, slot]
+
+    was_curr = brq.curr[idx] == slot
+    brq.curr[idx[was_curr]] = -1
+
+    brq.present[idx, slot] = False
+    brq.total_load[idx] -= w
+
+    p_lag = w * (brq.virt_time[idx] - brq.virt_time_placed[idx, slot]) - brq.runtime_since_placed[idx, slot]
+
+    load = brq.total_load[idx]
+    brq.virt_time[idx] += np.where(load > 0, p_lag / np.maximum(load, 1), 0.0)
+
+    out = np.zeros(brq.num_lanes)
+    out[idx] = p_lag
+    return out
+
+
+def pick_eevdf(brq : batched_rq, lanes : lanes_arg, stats : Optional[lane_stats] = None):
+    idx = lane_index(brq, lanes)
+    if len(idx) == 0:
+        return
+
+    present = brq.present[idx]
+    deadline = brq.deadline[idx]
+    seq = brq.seq[idx]
+    v = brq.virt_time[idx, None]
+
+    lag = brq.weight[idx] * (v - brq.virt_time_placed[idx]) - brq.runtime_since_placed[idx]
+    eligible = present & ((v >= brq.time_eligible[idx]) | (lag > 0))
+
+    # same choice as simulator_simple: earliest eligible deadline below the lane's max deadline,
+    # else the first entity w/ the max deadline, ties go to the earliest placed
+    max_deadline = np.where(present, deadline, -np.inf).max(axis=1, keepdims=True)
+    cand = eligible & (deadline < max_deadline)
+    best = np.where(cand, deadline, np.inf).min(axis=1, keepdims=True)
+    has_cand = cand.any(axis=1, keepdims=True)
+    chosen = np.where(has_cand, cand & (deadline == best), present & (deadline == max_deadline))
+    slot = np.where(chosen, seq, np.iinfo(np.int64).max).argmin(axis=1)
+    slot = np.where(present.any(axis=1), slot, -1)
+
+    brq.curr[idx] = slot
+
+    if stats is not None:
+        picked = slot >= 0
+        stats.picks[idx[picked], slot[picked]] += 1
+        stats.max_abs_lag[idx] = np.maximum(stats.max_abs_lag[idx], np.abs(np.where(present, lag, 0.0)).max(axis=1))
+
+
+def run_curr(brq : batched_rq, lanes : lanes_arg, amount_to_tick : int, stats : Optional[lane_stats] = None):
+    idx = lane_index(brq, lanes)
+    idx = idx[brq.curr[idx] >= 0]
+    slot = brq.curr[idx]
+
+    brq.runtime_since_placed[idx, slot] += amount_to_tick
+    brq.time_gotten_in_slice[idx, slot] += amount_to_tick
+    brq.real_time[idx] += amount_to_tick
+    brq.virt_time[idx] += amount_to_tick / brq.total_load[idx]
+
+    if stats is not None:
+        stats.runtime[idx, slot] += amount_to_tick
+
+    # update_deadline for the lanes whose curr used up its slice
+    tgis = brq.time_gotten_in_slice[idx, slot]
+    slices = brq.slice[idx, slot]
+    roll = tgis >= slices
+    idx, slot = idx[roll], slot[roll]
+
+    te = brq.deadline[idx, slot]
+    brq.time_eligible[idx, slot] = te
+    brq.deadline[idx, slot] = te + brq.slice[idx, slot] / brq.weight[idx, slot]
+    brq.time_gotten_in_slice[idx, slot] = np.maximum(tgis[roll] - slices[roll], 0)
+
+    if stats is not None:
+        stats.new_reqs[idx, slot] += 1
+
+
+def new_stats(brq : batched_rq) -> lane_stats:
+    shape = (brq.num_lanes, brq.num_slots)
+    return lane_stats(np.zeros(shape, dtype=np.int64), np.zeros(shape, dtype=np.int64), np.zeros(shape, dtype=np.int64),
+                      np.zeros(brq.num_lanes), np.zeros(brq.num_lanes))
+
+
+
+
+# the random drivers from simulator_simple, one lane per scenario. bursts of 1-4 ticks between
+# picks are drawn per lane, lanes that finish their burst pick while the others keep running
+
+def run_bursts(brq : batched_rq, rng : np.random.Generator, total_num_ticks : int, stats : lane_stats,
+               before_pick=None, after_burst=None):
+
+    all_lanes = np.ones(brq.num_lanes, dtype=bool)
+    pick_eevdf(brq, all_lanes, stats)
+
+    curr_tick = np.zeros(brq.num_lanes, dtype=np.int64)
+    remaining = np.zeros(brq.num_lanes, dtype=np.int64)
+    active = curr_tick < total_num_ticks
+    first = True
+
+    while active.any():
+        starting = active & (remaining == 0)
+        if not first and before_pick is not None:
+            before_pick(starting)
+        if not first:
+            pick_eevdf(brq, starting, stats)
+        first = False
+        remaining[starting] = rng.integers(1, 5, size=int(starting.sum()))
+
+        run_curr(brq, active, 4000000, stats)
+        remaining[active] -= 1
+        curr_tick[active] += 1
+
+        ended = active & (remaining == 0)
+        if after_burst is not None:
+            after_burst(ended)
+        active &= ~ended | (curr_tick < total_num_ticks)
+
+    stats.virt_time[:] = brq.virt_time
+
+
+def random_short(num_lanes : int, seed : int = 0, total_num_ticks : int = 50) -> lane_stats:
+    rng = np.random.default_rng(seed)
+    brq = batched_rq(num_lanes, [1024] * 4, [4000000] * 4)
+    stats = new_stats(brq)
+
+    for slot in range(4):
+        place_entity(brq, slice(None), slot, 0.0)
+
+    run_bursts(brq, rng, total_num_ticks, stats)
+    return stats
+
+
+def random_long(num_lanes : int, seed : int = 0, total_num_ticks : int = 50) -> lane_stats:
+    rng = np.random.default_rng(seed)
+    brq = batched_rq(num_lanes, [1024] * 2, [80000000, 60000000])  # 80 ms, 60 ms
+    stats = new_stats(brq)
+
+    for slot in range(2):
+        place_entity(brq, slice(None), slot, 0.0)
+
+    run_bursts(brq, rng, total_num_ticks, stats)
+    return stats
+
+
+# p1 (80 ms slice) and p2 (4 ms) leave w/ prob 0.1 after a burst and come back w/ prob 0.5 before
+# the next pick, keeping the lag they left with
+def random_mixed(num_lanes : int, seed : int = 0, total_num_ticks : int = 1000) -> lane_stats:
+    rng = np.random.default_rng(seed)
+    brq = batched_rq(num_lanes, [1024] * 2, [80000000, 4000000])
+    stats = new_stats(brq)
+    saved_lag = np.zeros((num_lanes, 2))
+
+    for slot in range(2):
+        place_entity(brq, slice(None), slot, 0.0)
+
+    def rejoin(lanes):
+        both_gone = lanes & ~brq.present.any(axis=1)
+        coin = rng.random(num_lanes) > 0.5
+        # both gone: one of them always comes back
+        for slot, pick_it in ((0, coin), (1, ~coin)):
+            m = both_gone & pick_it
+            place_entity(brq, m, slot, saved_lag[:, slot])
+        one_gone = lanes & ~both_gone & (brq.present.sum(axis=1) == 1) & (rng.random(num_lanes) > 0.5)
+        missing = np.argmin(brq.present, axis=1)
+        place_entity(brq, one_gone, missing, saved_lag[np.arange(num_lanes), missing])
+
+    def leave(lanes):
+        leaving = lanes & (rng.random(num_lanes) > 0.9) & brq.present.any(axis=1)
+        coin = rng.random(num_lanes) > 0.5
+        both = brq.present.all(axis=1)
+        slot = np.where(both, np.where(coin, 1, 0), np.argmax(brq.present, axis=1))
+        lag = dequeue_entity(brq, leaving, slot)
+        idx = np.flatnonzero(leaving)
+        saved_lag[idx, slot[idx]] = lag[idx]
+
+    run_bursts(brq, rng, total_num_ticks, stats, before_pick=rejoin, after_burst=leave)
+    return stats
+
+
+def summarise(stats : lane_stats, quantiles=(0.5, 0.9, 0.99, 0.999)) -> dict:
+    total = np.maximum(stats.runtime.sum(axis=1, keepdims=True), 1)
+    share = stats.runtime / total
+    return {
+        "lanes": len(stats.virt_time),
+        "max_abs_lag": {q: float(np.quantile(stats.max_abs_lag, q)) for q in quantiles},
+        "cpu_share_per_slot": {slot: {q: float(np.quantile(share[:, slot], q)) for q in quantiles}
+                               for slot in range(share.shape[1])},
+    }
+
+
+def main():
+    import time
+
+    for driver in (random_short, random_long, random_mixed):
+        start = time.time()
+        stats = driver(10000, seed=0)
+        print(f"{driver.__name__}: {time.time() - start:.2f}s")
+        print(summarise(stats))
+
+
+
+if __name__=="__main__":
+    main()
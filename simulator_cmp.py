@@ -1,3 +1,10 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from multiprocessing import Pool
+from statistics import median
+import argparse
+import os
+import random
 import simulator_simple
 import simulator_avg_weighted
 from random import uniform, randrange
@@ -9,21 +16,72 @@ simulator_simple.verbose = False
 
 
 
+@dataclass
+class cmp_result:
+    seed: int
+    scenario: str
+    divergences: int
+    first_divergence: int  # tick of the first pick the two simulators disagreed on, -1 if none
+
+
 def main():
-    rq_simple = simulator_simple.rq_struct([])
-    rq_avg = simulator_avg_weighted.rq_struct([])
+    parser = argparse.ArgumentParser(description="compare simulator_simple and simulator_avg_weighted over many seeds")
+    parser.add_argument("--seeds", type=int, default=1000, help="number of seeds per scenario")
+    parser.add_argument("--start-seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, defaults to all cores")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    args = parser.parse_args()
+
+    seeds = range(args.start_seed, args.start_seed + args.seeds)
+    results = run_comparisons(seeds, args.scenarios, args.workers)
+
+    print_summary(results)
 
-    random_mixed(rq_simple, rq_avg)
 
-    print("done w/ one")
+def compare_seed(job : tuple[int, str]) -> cmp_result:
+    seed, scenario = job
+    random.seed(seed)
 
     rq_simple = simulator_simple.rq_struct([])
     rq_avg = simulator_avg_weighted.rq_struct([])
 
-    random_short(rq_simple, rq_avg)
+    divergences, first_divergence = SCENARIOS[scenario](rq_simple, rq_avg)
+
+    return cmp_result(seed, scenario, divergences, first_divergence)
+
+
+def run_comparisons(seeds, scenarios, workers : int = None) -> list[cmp_result]:
+    jobs = [(seed, scenario) for scenario in scenarios for seed in seeds]
+    workers = workers or os.cpu_count()
+
+    if workers == 1:
+        return [compare_seed(job) for job in jobs]
+
+    with Pool(workers) as pool:
+        return list(pool.imap_unordered(compare_seed, jobs, chunksize=max(1, len(jobs) // (workers * 16))))
 
 
-def random_mixed(rq_simple : simulator_simple.rq_struct, rq_avg : simulator_avg_weighted.rq_struct):
+def print_summary(results : list[cmp_result]):
+    print(f"{'scenario':<14}{'runs':>8}{'diverged':>10}{'divergences':>13}{'per run':>9}{'first tick min':>16}{'first tick med':>16}")
+
+    for scenario in sorted({r.scenario for r in results}):
+        runs = [r for r in results if r.scenario == scenario]
+        diverged = [r for r in runs if r.divergences > 0]
+        total = sum(r.divergences for r in runs)
+        firsts = [r.first_divergence for r in diverged]
+
+        print(f"{scenario:<14}{len(runs):>8}{len(diverged):>10}{total:>13}{total / len(runs):>9.2f}"
+              f"{min(firsts) if firsts else '-':>16}{median(firsts) if firsts else '-':>16}")
+
+    # the seeds that diverge soonest are the easiest to dig into
+    diverged = sorted((r for r in results if r.divergences > 0), key=lambda r: (r.first_divergence, r.seed))
+    if diverged:
+        print("\nearliest divergences:")
+        for r in diverged[:10]:
+            print(f"  {r.scenario} seed {r.seed}: first at tick {r.first_divergence}, {r.divergences} total")
+
+
+def random_mixed(rq_simple : simulator_simple.rq_struct, rq_avg : simulator_avg_weighted.rq_struct) -> tuple[int, int]:
 
     # all procs have default weight and slice
     p1_simple = simulator_simple.sched_entity(1, slice=80000000) # 80 ms
@@ -48,6 +106,9 @@ def random_mixed(rq_simple : simulator_simple.rq_struct, rq_avg : simulator_avg_
     p2_lag_simple = 0
     p2_lag_avg = 0
 
+    divergences = 0
+    first_divergence = -1
+
     curr_tick = 0
     while curr_tick < total_num_ticks:
 
@@ -75,7 +136,9 @@ def random_mixed(rq_simple : simulator_simple.rq_struct, rq_avg : simulator_avg_
         simulator_simple.pick_eevdf(rq_simple)
         simulator_avg_weighted.pick_eevdf(rq_avg)
         if rq_simple.curr.pid != rq_avg.curr.pid:
-            print("DIFF")
+            divergences += 1
+            if first_divergence < 0:
+                first_divergence = curr_tick
 
         ticks_to_tick = randrange(1, 5)
         for _ in range(ticks_to_tick):
@@ -103,10 +166,12 @@ def random_mixed(rq_simple : simulator_simple.rq_struct, rq_avg : simulator_avg_
 
         curr_tick += ticks_to_tick
 
+    return divergences, first_divergence
 
 
 
-def random_short(rq_simple : simulator_simple.rq_struct, rq_avg : simulator_avg_weighted.rq_struct):
+
+def random_short(rq_simple : simulator_simple.rq_struct, rq_avg : simulator_avg_weighted.rq_struct) -> tuple[int, int]:
 
     # all procs have default weight and slice
     p1_simple = simulator_simple.sched_entity(1)
@@ -132,6 +197,9 @@ def random_short(rq_simple : simulator_simple.rq_struct, rq_avg : simulator_avg_
     simulator_simple.pick_eevdf(rq_simple)
     simulator_avg_weighted.pick_eevdf(rq_avg)
 
+    divergences = 0
+    first_divergence = -1
+
     # TODO still need to do randomly joining and leaving
     curr_tick = 0
     while curr_tick < total_num_ticks:
@@ -147,7 +215,17 @@ def random_short(rq_simple : simulator_simple.rq_struct, rq_avg : simulator_avg_
         simulator_avg_weighted.pick_eevdf(rq_avg)
 
         if rq_simple.curr.pid != rq_avg.curr.pid:
-            print("DIFF")
+            divergences += 1
+            if first_divergence < 0:
+                first_divergence = curr_tick
+
+    return divergences, first_divergence
+
+
+SCENARIOS = {
+    "random_mixed": random_mixed,
+    "random_short": random_short,
+}
 
 
 
@@ -4,6 +4,11 @@ from typing import Optional
 import matplotlib.pyplot as plt
 from collections import defaultdict
 from random import randrange, uniform
+from sched_tree import deadline_tree, LAG_POINT_SLACK
+from sched_run import run_ticks, run_for
+from sched_hooks import sched_record, register, emit, attach_timeline
+from timeline_store import columnar_timeline
+from trace_parser import parse_trace, trace_event, update_curr_event, pick_event, place_event, dequeue_event
 
 
 @dataclass
@@ -25,14 +30,43 @@ class sched_entity:
 
 @dataclass
 class rq_struct:
-    all_procs: list[sched_entity]
+    all_procs: deadline_tree = field(default_factory=lambda: deadline_tree(entity_keys))
     virt_time: int = 0
     total_load: int = 0
     curr: Optional[sched_entity] = None
 
-    timeline : list[scheduling_event] = field(default_factory=list)
+    timeline : list[scheduling_event] = field(default_factory=list)  # or a columnar_timeline, see sched_hooks.attach_timeline
     real_time : int = 0
 
+    # running sums over all_procs so the sum of lags is O(1), see lag_sum
+    weighted_placed_sum : float = 0  # sum of weight * virt_time_placed
+    runtime_sum : int = 0  # sum of runtime_since_placed
+
+    # last pick, reused until a join / leave / new request or until virt_time reaches
+    # pick_cache_until, the first point an entity ahead of it in the tree can turn eligible
+    pick_cache : Optional[sched_entity] = None
+    pick_cache_until : float = 0
+    pick_cache_eligible : bool = False  # picked for being eligible (not as the max deadline fallback)
+
+    procs_by_pid : dict[int, sched_entity] = field(default_factory=dict)  # queued entities, kept by place / dequeue
+
+    # event type -> callbacks, see sched_hooks
+    observers : dict[str, list] = field(default_factory=dict)
+    record_timeline : bool = True
+    coalesce_runs : bool = False  # merge back to back run events of one entity, see coalescing_timeline_sink
+    store : Optional[columnar_timeline] = None  # rq.timeline when it is a store, set by attach_timeline
+    # sinks to attach, None for the module's verbose / check_lag_sum flags at the time the rq is made
+    verbose : Optional[bool] = None
+    check_lag_sum : Optional[bool] = None
+
+    def __post_init__(self):
+        # still accept a plain list of procs, eg rq_struct([])
+        if not isinstance(self.all_procs, deadline_tree):
+            self.all_procs = deadline_tree(entity_keys, self.all_procs)
+        for se in self.all_procs:
+            self.procs_by_pid[se.pid] = se
+        attach_sinks(self)
+
 
 @dataclass
 class scheduling_event:
@@ -50,8 +84,40 @@ class scheduling_event:
     cls : str = "simple"
 
 
+# defaults for the rq_struct arguments of the same name, read when an rq_struct is made w/o
+# them: setting a flag later doesn't change the sinks of the rqs already made
 verbose : bool = True
 
+# assert after every place, dequeue and run that the lags on the rq still sum to ~0
+check_lag_sum : bool = False
+lag_sum_tolerance : float = 1e-9  # relative to the size of the terms in the sum
+
+
+def attach_sinks(rq : rq_struct):
+    attach_timeline(rq)
+    if rq.verbose is None:
+        rq.verbose = verbose
+    if rq.check_lag_sum is None:
+        rq.check_lag_sum = check_lag_sum
+    if rq.verbose:
+        register(rq, verbose_sink)
+    if rq.check_lag_sum:
+        register(rq, lag_sum_sink, ("run", "join", "leave"))
+
+
+def verbose_sink(rq : rq_struct, record : sched_record):
+    if record.event.type == "join":
+        print("placing pid ", record.se.pid, " w/ lag ", record.lag)
+    print(record.event)
+    print("simple - sum: ", lag_sum(rq))
+    if record.event.type == "join":
+        for s in rq.all_procs:
+            print_se(rq, s)
+
+
+def lag_sum_sink(rq : rq_struct, record : sched_record):
+    assert_lag_sum(rq)
+
 
 def print_rq(rq : rq_struct):
     print(f"virt_time: {rq.virt_time:.1f}")
@@ -68,27 +134,50 @@ def print_se(rq : rq_struct, se : sched_entity):
 
 
 def pick_eevdf(rq : rq_struct):
-    next_se = max(rq.all_procs, key=lambda s: s.deadline)
-    min_deadline : int = next_se.deadline
+    prev = rq.curr
+    rq.curr = cached_pick(rq)
 
-    for se in rq.all_procs:
-        if se.deadline < min_deadline and entity_eligible(rq, se):
-            min_deadline = se.deadline
-            next_se = se
-    
-    rq.curr = next_se
+    if rq.curr is None:
+        rq.curr = rq.all_procs.pick(rq.virt_time, lambda se: entity_eligible(rq, se))
+        rq.pick_cache = rq.curr
+        rq.pick_cache_until = rq.all_procs.min_point_before(rq.curr)
+        rq.pick_cache_eligible = entity_eligible(rq, rq.curr)
+
+    if rq.store is not None or "pick" in rq.observers:
+        emit(rq, scheduling_event, "pick", rq.curr, rq.real_time, rq.virt_time, rq.real_time, rq.virt_time,
+             rq.curr.time_eligible, rq.curr.deadline, prev_pid=prev.pid if prev else -1)
+
+
+def cached_pick(rq : rq_struct) -> Optional[sched_entity]:
+    se = rq.pick_cache
+    if se is None:
+        return None
+
+    # the cached lag points can be off by float rounding, so give up a little early
+    if rq.virt_time + LAG_POINT_SLACK * (abs(rq.virt_time) + 1) >= rq.pick_cache_until:
+        return None
+
+    # running curr pushes its own lag point up, it may no longer be eligible
+    if rq.pick_cache_eligible and not entity_eligible(rq, se):
+        return None
+
+    return se
 
-    event = scheduling_event(rq.curr.pid, "pick", rq.real_time, rq.virt_time, rq.real_time, rq.virt_time, rq.curr.time_eligible, rq.curr.deadline)
-    if verbose:
-        print(event)
-        print("simple - sum: ", sum([get_lag(rq, s) for s in rq.all_procs]))
-    rq.timeline.append(event)
+
+def invalidate_pick(rq : rq_struct):
+    rq.pick_cache = None
 
 
 def entity_eligible(rq : rq_struct, se : sched_entity) -> bool:
     return rq.virt_time >= se.time_eligible or get_lag(rq, se) > 0
 
 
+# keys the runqueue tree is ordered and augmented by -- the lag point is the virt_time at
+# which get_lag turns positive, so entity_eligible is virt_time >= te or virt_time > lag point
+def entity_keys(se : sched_entity) -> tuple:
+    return se.deadline, se.time_eligible, se.virt_time_placed + se.runtime_since_placed / se.weight
+
+
 def update_deadline(rq: rq_struct) -> bool:
 
     curr : sched_entity = rq.curr
@@ -98,13 +187,12 @@ def update_deadline(rq: rq_struct) -> bool:
 
     curr.time_eligible = curr.deadline
     curr.deadline = curr.time_eligible + (curr.slice / curr.weight)
+    invalidate_pick(rq)
 
 
-    event = scheduling_event(rq.curr.pid, "new-req", rq.real_time, rq.virt_time, rq.real_time, rq.virt_time, curr.time_eligible, curr.deadline)
-    if verbose:
-        print(event)
-        print("simple - sum: ", sum([get_lag(rq, s) for s in rq.all_procs]))
-    rq.timeline.append(event)
+    if rq.store is not None or "new-req" in rq.observers:
+        emit(rq, scheduling_event, "new-req", curr, rq.real_time, rq.virt_time, rq.real_time, rq.virt_time,
+             curr.time_eligible, curr.deadline)
 
     curr.time_gotten_in_slice = max(curr.time_gotten_in_slice - curr.slice, 0)
 
@@ -115,28 +203,71 @@ def run_curr(rq: rq_struct, amount_to_tick : int, pid : int = None) -> bool:
     # sometimes linux will deq and then imediately re-place the curr proc
     # this should only be the case when running from linux output, only set the value there
     if rq.curr is None and pid is not None:
-        for s in rq.all_procs:
-            if s.pid == pid:
-                rq.curr = s
+        rq.curr = rq.procs_by_pid.get(pid)
     
     curr : sched_entity = rq.curr
 
-    event = scheduling_event(rq.curr.pid, "run", rq.real_time, rq.virt_time, rq.real_time + amount_to_tick, 
-                             rq.virt_time +  amount_to_tick / rq.total_load, curr.time_eligible, curr.deadline)
-    if verbose:
-        print(event)
-        print("simple - sum: ", sum([get_lag(rq, s) for s in rq.all_procs]))
-    rq.timeline.append(event)
+    account_run(rq, amount_to_tick)
 
-    curr.runtime_since_placed += amount_to_tick
-    curr.time_gotten_in_slice += amount_to_tick
+    update_deadline(rq)
 
-    rq.real_time += amount_to_tick
+    if curr in rq.all_procs:
+        rq.all_procs.update(curr)
 
-    rq.virt_time += amount_to_tick / rq.total_load 
 
-    update_deadline(rq)
-    
+# same as calling run_curr num_ticks times, but the slice rollovers are worked out directly and
+# there is one run event per stretch of ticks between them
+def run_curr_ticks(rq: rq_struct, amount_to_tick : int, num_ticks : int, pid : int = None):
+
+    if rq.curr is None and pid is not None:
+        rq.curr = rq.procs_by_pid.get(pid)
+
+    curr : sched_entity = rq.curr
+
+    run_ticks(rq, amount_to_tick, num_ticks, account_run, update_deadline)
+
+    if curr in rq.all_procs:
+        rq.all_procs.update(curr)
+
+
+# run curr for an arbitrary duration, issuing each new request exactly when a slice is used up
+def run_curr_for(rq: rq_struct, duration : int, pid : int = None):
+
+    if rq.curr is None and pid is not None:
+        rq.curr = rq.procs_by_pid.get(pid)
+
+    curr : sched_entity = rq.curr
+
+    run_for(rq, duration, account_run, update_deadline)
+
+    if curr in rq.all_procs:
+        rq.all_procs.update(curr)
+
+
+# ticks > 1 runs curr for ticks times amount as one run event, see sched_run.run_ticks
+def account_run(rq: rq_struct, amount : int, ticks : int = 1):
+
+    curr : sched_entity = rq.curr
+
+    start_real_time = rq.real_time
+    start_virt_time = rq.virt_time
+
+    curr.runtime_since_placed += amount * ticks
+    curr.time_gotten_in_slice += amount * ticks
+
+    rq.real_time += amount * ticks
+
+    # a tick at a time, the float sum has to round like run_curr's would
+    step = amount / rq.total_load
+    for _ in range(ticks):
+        rq.virt_time += step
+
+    if curr in rq.all_procs:
+        rq.runtime_sum += amount * ticks
+
+    if rq.store is not None or "run" in rq.observers:
+        emit(rq, scheduling_event, "run", curr, start_real_time, start_virt_time, rq.real_time, rq.virt_time,
+             curr.time_eligible, curr.deadline)
 
 
 def get_lag(rq : rq_struct, se : sched_entity) -> float:
@@ -147,9 +278,24 @@ def get_lag(rq : rq_struct, se : sched_entity) -> float:
     return ideal_service - real_service
 
 
+# the kernel's vlag (place_entity's vlag: in the traces) is in vruntime units, where a task of
+# weight w gets NICE_0_LOAD / w ns of vruntime per ns it runs; lag here is in service (ns) units
+def lag_from_vlag(vlag : float, weight : int) -> float:
+    return vlag * weight / 1024
+
+
+# sum of get_lag over all_procs, from the running sums instead of a pass over the rq
+def lag_sum(rq : rq_struct) -> float:
+    return rq.total_load * rq.virt_time - rq.weighted_placed_sum - rq.runtime_sum
+
+
+def assert_lag_sum(rq : rq_struct):
+    drift = lag_sum(rq)
+    scale = abs(rq.total_load * rq.virt_time) + abs(rq.weighted_placed_sum) + rq.runtime_sum
+    assert abs(drift) <= lag_sum_tolerance * max(scale, 1), f"lag sum drifted to {drift} at real time {rq.real_time}"
+
+
 def place_entity(rq : rq_struct, se : sched_entity, lag : float):
-    
-    rq.all_procs.append(se)
 
     rq.total_load += se.weight
 
@@ -157,6 +303,7 @@ def place_entity(rq : rq_struct, se : sched_entity, lag : float):
 
     se.runtime_since_placed = 0
     se.virt_time_placed = rq.virt_time - (lag / se.weight)
+    rq.weighted_placed_sum += se.weight * se.virt_time_placed
 
     if rq.total_load > 0:
         rq.virt_time -= lag / rq.total_load
@@ -164,15 +311,13 @@ def place_entity(rq : rq_struct, se : sched_entity, lag : float):
     se.time_eligible = rq.virt_time - (se.time_gotten_in_slice / se.weight)
     se.deadline = se.time_eligible + (se.slice / se.weight)
 
-    event = scheduling_event(se.pid, "join", rq.real_time, og_virt_time, rq.real_time, 
-                             rq.virt_time, se.time_eligible, se.deadline)
-    if verbose:
-        print("placing pid ", se.pid, " w/ lag ", lag)
-        print(event)
-        print("simple - sum: ", sum([get_lag(rq, s) for s in rq.all_procs]))
-        for s in rq.all_procs:
-            print_se(rq, s)
-    rq.timeline.append(event)
+    rq.all_procs.insert(se)
+    rq.procs_by_pid[se.pid] = se
+    invalidate_pick(rq)
+
+    if rq.store is not None or "join" in rq.observers:
+        emit(rq, scheduling_event, "join", se, rq.real_time, og_virt_time, rq.real_time, rq.virt_time,
+             se.time_eligible, se.deadline, lag=lag)
     
 
 
@@ -184,20 +329,25 @@ def dequeue_entity(rq : rq_struct, se : sched_entity) -> float:
     og_virt_time = rq.virt_time
 
     rq.all_procs.remove(se)
+    if rq.procs_by_pid.get(se.pid) is se:
+        del rq.procs_by_pid[se.pid]
+    invalidate_pick(rq)
     rq.total_load -= se.weight
+    rq.weighted_placed_sum -= se.weight * se.virt_time_placed
+    rq.runtime_sum -= se.runtime_since_placed
 
     p_lag = get_lag(rq, se)
 
     if rq.total_load > 0:
         rq.virt_time += p_lag / rq.total_load
+    else:
+        # empty rq, drop any rounding left in the running sums
+        rq.weighted_placed_sum = 0
+        rq.runtime_sum = 0
 
-    event = scheduling_event(se.pid, "leave", rq.real_time, og_virt_time, rq.real_time, 
-                             rq.virt_time, se.time_eligible, se.deadline)
-    if verbose:
-        print(event)
-        print("simple - sum: ", sum([get_lag(rq, s) for s in rq.all_procs]))
-    rq.timeline.append(event)
-    
+    if rq.store is not None or "leave" in rq.observers:
+        emit(rq, scheduling_event, "leave", se, rq.real_time, og_virt_time, rq.real_time, rq.virt_time,
+             se.time_eligible, se.deadline, lag=p_lag)
 
     return p_lag
 
@@ -233,10 +383,9 @@ def random_long(rq : rq_struct):
     curr_tick = 0
     while curr_tick < total_num_ticks:
 
-        ticks_to_tick = random.randrange(1, 5)
+        ticks_to_tick = randrange(1, 5)
 
-        for _ in range(ticks_to_tick):
-            run_curr(rq, 4000000)
+        run_curr_ticks(rq, 4000000, ticks_to_tick)
         
         curr_tick += ticks_to_tick
         pick_eevdf(rq)
@@ -349,59 +498,40 @@ def random_short(rq : rq_struct):
 
 
 
-def run_from_linux_output_file(rq : rq_struct):
+def run_from_linux_output_file(rq : rq_struct, file_path : str = 'out.txt'):
 
     pid_to_se_and_lag = {}
 
-    with open('out.txt', 'r') as file:
-        for line in file:
-            if 'update_curr' in line:
-                time_run = get_val('delta exec: ', ',', line)
-                pid_value = get_val('update_curr ', ':', line)
-                run_curr(rq, int(time_run), int(pid_value))
-
-            if 'pick_next_entity' in line:
-                new_pid = get_val('new_curr: ', ' ', line)
-                pick_eevdf(rq)
-
-                if (rq.curr.pid != int(new_pid)):
-                    print("ERROR - diff in choice -- lnx: ", new_pid, ", this program: ", rq.curr.pid)
-                    for s in rq.all_procs:
-                        if s.pid == int(new_pid):
-                            rq.curr = s
-    
-            if 'place_entity' in line:
-                new_pid = get_val('placing se: ', ', ', line)
-                s_weight = get_val('weight: ', ', ', line)
-
-                if new_pid in pid_to_se_and_lag:
-                    se_to_add = pid_to_se_and_lag[new_pid][0]
-                    lag = pid_to_se_and_lag[new_pid][1]
-                    pid_to_se_and_lag.__delitem__(new_pid)
-                else:
-                    se_to_add = sched_entity(int(new_pid), weight=int(s_weight))
-                    lag = 0
+    for event in parse_trace(file_path):
+        replay_event(rq, event, pid_to_se_and_lag)
 
-                place_entity(rq, se_to_add, lag)
 
-            if 'dequeue_entity' in line:
-                pid = get_val(' task being dequeued ', ', ', line)
+def replay_event(rq : rq_struct, event : trace_event, pid_to_se_and_lag : dict):
 
-                for s in rq.all_procs:
-                    if s.pid == int(pid):
-                        lag = dequeue_entity(rq, s)
-                        pid_to_se_and_lag[s.pid] = (s, lag)
-                        break
+    if isinstance(event, update_curr_event):
+        run_curr(rq, event.delta_exec, event.pid)
 
+    elif isinstance(event, pick_event):
+        pick_eevdf(rq)
 
+        if (rq.curr.pid != event.new_curr):
+            print("ERROR - diff in choice -- lnx: ", event.new_curr, ", this program: ", rq.curr.pid)
+            rq.curr = rq.procs_by_pid.get(event.new_curr, rq.curr)
 
-def get_val(start : str, end : str, line : str)->str:
-    
-    start_index = line.find(start) + len(start)
-    end_index = line.find(end, start_index)
-    if end_index == -1: 
-        end_index = len(line)
-    return line[start_index:end_index].strip()
+    elif isinstance(event, place_event):
+        if event.pid in pid_to_se_and_lag:
+            se_to_add, lag = pid_to_se_and_lag.pop(event.pid)
+        else:
+            se_to_add = sched_entity(event.pid, weight=event.weight)
+            lag = 0
+
+        place_entity(rq, se_to_add, lag)
+
+    elif isinstance(event, dequeue_event):
+        s = rq.procs_by_pid.get(event.pid)
+        if s is not None:
+            lag = dequeue_entity(rq, s)
+            pid_to_se_and_lag[s.pid] = (s, lag)
 
 
 
@@ -0,0 +1,358 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Optional
+import numpy as np
+from simulator_simple import sched_entity, scheduling_event
+from sched_run import run_ticks, run_for
+from sched_hooks import sched_record, register, emit, attach_timeline
+from timeline_store import columnar_timeline
+from trace_parser import trace_event, update_curr_event, pick_event, place_event, dequeue_event
+
+
+# same model as simulator_simple, but the per-entity state lives in parallel numpy arrays (one row
+# per queued entity) so eligibility and the pick are a few masked array ops instead of a python
+# loop over entities. the sched_entity objects are only written back on dequeue / sync_entity /
+# sync_all, except curr's time_gotten_in_slice, which sched_run reads. it has simulator_simple's
+# rq api (place / dequeue / pick / run_curr, run_curr_ticks / run_curr_for, replay_event); the
+# drivers, print_rq and draw_timeline are only in simulator_simple
+
+COLUMNS = {
+    "pid": np.int64,
+    "weight": np.int64,
+    "slice": np.int64,
+    "runtime_since_placed": np.int64,
+    "virt_time_placed": np.float64,
+    "time_eligible": np.float64,
+    "deadline": np.float64,
+    "time_gotten_in_slice": np.int64,
+    "seq": np.int64,  # placement order, breaks deadline ties the same way the list scan does
+}
+
+
+# simulator_simple's event, tagged as coming from this model
+@dataclass
+class soa_event(scheduling_event):
+    cls : str = "soa"
+
+
+@dataclass
+class rq_struct:
+    all_procs: list[sched_entity] = field(default_factory=list)  # row -> entity, see sync_all for their fields
+    virt_time: float = 0
+    total_load: int = 0
+    curr: Optional[sched_entity] = None
+
+    timeline : list[scheduling_event] = field(default_factory=list)  # or a columnar_timeline, see sched_hooks.attach_timeline
+    real_time : int = 0
+
+    procs_by_pid : dict[int, sched_entity] = field(default_factory=dict)  # queued entities, kept by add_row / remove_row
+
+    # event type -> callbacks, see sched_hooks
+    observers : dict[str, list] = field(default_factory=dict)
+    record_timeline : bool = True
+    coalesce_runs : bool = False  # merge back to back run events of one entity, see coalescing_timeline_sink
+    store : Optional[columnar_timeline] = None  # rq.timeline when it is a store, set by attach_timeline
+    # sinks to attach, None for the module's verbose flag at the time the rq is made
+    verbose : Optional[bool] = None
+
+    size : int = field(default=0, init=False)
+    next_seq : int = field(default=0, init=False)
+    cols : dict[str, np.ndarray] = field(default_factory=dict, init=False)
+    row_of : dict[int, int] = field(default_factory=dict, init=False)  # id(se) -> row
+
+    def __post_init__(self):
+        procs = self.all_procs
+        self.all_procs = []
+        self.cols = {name: np.zeros(16, dtype=dtype) for name, dtype in COLUMNS.items()}
+        # like rq_struct([...]) in simulator_simple, given procs are queued as they are, not placed
+        for se in procs:
+            add_row(self, se)
+        attach_sinks(self)
+
+
+# defaults for the rq_struct arguments of the same name, read when an rq_struct is made w/o
+# them: setting a flag later doesn't change the sinks of the rqs already made
+verbose : bool = False
+
+
+def attach_sinks(rq : rq_struct):
+    attach_timeline(rq)
+    if rq.verbose is None:
+        rq.verbose = verbose
+    if rq.verbose:
+        register(rq, verbose_sink)
+
+
+def verbose_sink(rq : rq_struct, record : sched_record):
+    if record.event.type == "join":
+        print("placing pid ", record.se.pid, " w/ lag ", record.lag)
+    print(record.event)
+    print("soa - sum: ", lag_sum(rq))
+
+
+def add_row(rq : rq_struct, se : sched_entity):
+    if rq.size == len(rq.cols["pid"]):
+        for name, col in rq.cols.items():
+            rq.cols[name] = np.resize(col, 2 * len(col))
+
+    row = rq.size
+    c = rq.cols
+    c["pid"][row] = se.pid
+    c["weight"][row] = se.weight
+    c["slice"][row] = se.slice
+    c["runtime_since_placed"][row] = se.runtime_since_placed
+    c["virt_time_placed"][row] = se.virt_time_placed
+    c["time_eligible"][row] = se.time_eligible
+    c["deadline"][row] = se.deadline
+    c["time_gotten_in_slice"][row] = se.time_gotten_in_slice
+    c["seq"][row] = rq.next_seq
+
+    rq.next_seq += 1
+    rq.all_procs.append(se)
+    rq.procs_by_pid[se.pid] = se
+    rq.row_of[id(se)] = row
+    rq.size += 1
+
+
+def remove_row(rq : rq_struct, se : sched_entity):
+    row = rq.row_of.pop(id(se))
+    last = rq.size - 1
+    if rq.procs_by_pid.get(se.pid) is se:
+        del rq.procs_by_pid[se.pid]
+
+    # fill the hole w/ the last row, seq keeps the placement order intact
+    if row != last:
+        for col in rq.cols.values():
+            col[row] = col[last]
+        moved = rq.all_procs[last]
+        rq.all_procs[row] = moved
+        rq.row_of[id(moved)] = row
+
+    rq.all_procs.pop()
+    rq.size -= 1
+
+
+# write an entity's row back into the sched_entity object
+def sync_entity(rq : rq_struct, se : sched_entity):
+    row = rq.row_of[id(se)]
+    c = rq.cols
+    se.runtime_since_placed = int(c["runtime_since_placed"][row])
+    se.virt_time_placed = float(c["virt_time_placed"][row])
+    se.time_eligible = float(c["time_eligible"][row])
+    se.deadline = float(c["deadline"][row])
+    se.time_gotten_in_slice = int(c["time_gotten_in_slice"][row])
+
+
+def sync_all(rq : rq_struct):
+    for se in rq.all_procs:
+        sync_entity(rq, se)
+
+
+def eligible_mask(rq : rq_struct) -> np.ndarray:
+    n = rq.size
+    c = rq.cols
+    lag = c["weight"][:n] * (rq.virt_time - c["virt_time_placed"][:n]) - c["runtime_since_placed"][:n]
+    return (rq.virt_time >= c["time_eligible"][:n]) | (lag > 0)
+
+
+def pick_eevdf(rq : rq_struct):
+    n = rq.size
+    if n == 0:
+        raise ValueError("pick from an empty runqueue")
+
+    deadline = rq.cols["deadline"][:n]
+    seq = rq.cols["seq"][:n]
+    max_deadline = deadline.max()
+
+    # earliest eligible deadline below the max, else the first entity w/ the max deadline
+    cand = eligible_mask(rq) & (deadline < max_deadline)
+    if cand.any():
+        rows = np.flatnonzero(cand & (deadline == deadline[cand].min()))
+    else:
+        rows = np.flatnonzero(deadline == max_deadline)
+    row = rows[np.argmin(seq[rows])]
+
+    prev = rq.curr
+    rq.curr = rq.all_procs[row]
+
+    if rq.store is not None or "pick" in rq.observers:
+        emit(rq, soa_event, "pick", rq.curr, rq.real_time, rq.virt_time, rq.real_time, rq.virt_time,
+             float(rq.cols["time_eligible"][row]), float(deadline[row]), prev_pid=prev.pid if prev else -1)
+
+
+def update_deadline(rq: rq_struct) -> bool:
+
+    row = rq.row_of[id(rq.curr)]
+    c = rq.cols
+    slice = int(c["slice"][row])
+    time_gotten_in_slice = int(c["time_gotten_in_slice"][row])
+
+    if time_gotten_in_slice < slice:
+        return False
+
+    time_eligible = float(c["deadline"][row])
+    deadline = time_eligible + (slice / int(c["weight"][row]))
+    c["time_eligible"][row] = time_eligible
+    c["deadline"][row] = deadline
+
+    if rq.store is not None or "new-req" in rq.observers:
+        emit(rq, soa_event, "new-req", rq.curr, rq.real_time, rq.virt_time, rq.real_time, rq.virt_time, time_eligible,
+             deadline)
+
+    c["time_gotten_in_slice"][row] = max(time_gotten_in_slice - slice, 0)
+    rq.curr.time_gotten_in_slice = int(c["time_gotten_in_slice"][row])
+
+    return True
+
+
+def run_curr(rq: rq_struct, amount_to_tick : int, pid : int = None) -> bool:
+
+    # sometimes linux will deq and then imediately re-place the curr proc
+    # this should only be the case when running from linux output, only set the value there
+    if rq.curr is None and pid is not None:
+        rq.curr = rq.procs_by_pid.get(pid)
+
+    account_run(rq, amount_to_tick)
+
+    update_deadline(rq)
+
+
+# same as calling run_curr num_ticks times, see simulator_simple.run_curr_ticks
+def run_curr_ticks(rq: rq_struct, amount_to_tick : int, num_ticks : int, pid : int = None):
+
+    if rq.curr is None and pid is not None:
+        rq.curr = rq.procs_by_pid.get(pid)
+
+    sync_entity(rq, rq.curr)
+    run_ticks(rq, amount_to_tick, num_ticks, account_run, update_deadline)
+
+
+# run curr for an arbitrary duration, issuing each new request exactly when a slice is used up
+def run_curr_for(rq: rq_struct, duration : int, pid : int = None):
+
+    if rq.curr is None and pid is not None:
+        rq.curr = rq.procs_by_pid.get(pid)
+
+    sync_entity(rq, rq.curr)
+    run_for(rq, duration, account_run, update_deadline)
+
+
+# ticks > 1 runs curr for ticks times amount as one run event, see sched_run.run_ticks
+def account_run(rq: rq_struct, amount : int, ticks : int = 1):
+
+    row = rq.row_of[id(rq.curr)]
+    c = rq.cols
+
+    start_real_time = rq.real_time
+    start_virt_time = rq.virt_time
+
+    c["runtime_since_placed"][row] += amount * ticks
+    c["time_gotten_in_slice"][row] += amount * ticks
+    rq.curr.time_gotten_in_slice = int(c["time_gotten_in_slice"][row])
+
+    rq.real_time += amount * ticks
+
+    # a tick at a time, the float sum has to round like run_curr's would
+    step = amount / rq.total_load
+    for _ in range(ticks):
+        rq.virt_time += step
+
+    if rq.store is not None or "run" in rq.observers:
+        emit(rq, soa_event, "run", rq.curr, start_real_time, start_virt_time, rq.real_time, rq.virt_time,
+             float(c["time_eligible"][row]), float(c["deadline"][row]))
+
+
+def get_lag(rq : rq_struct, se : sched_entity) -> float:
+
+    if id(se) in rq.row_of:
+        sync_entity(rq, se)
+
+    ideal_service : int = se.weight * (rq.virt_time - se.virt_time_placed)
+    real_service : int = se.runtime_since_placed
+
+    return ideal_service - real_service
+
+
+# the kernel's vlag (place_entity's vlag: in the traces) is in vruntime units, where a task of
+# weight w gets NICE_0_LOAD / w ns of vruntime per ns it runs; lag here is in service (ns) units
+def lag_from_vlag(vlag : float, weight : int) -> float:
+    return vlag * weight / 1024
+
+
+def lag_sum(rq : rq_struct) -> float:
+    n = rq.size
+    c = rq.cols
+    return float(np.sum(c["weight"][:n] * (rq.virt_time - c["virt_time_placed"][:n]) - c["runtime_since_placed"][:n]))
+
+
+def place_entity(rq : rq_struct, se : sched_entity, lag : float):
+
+    rq.total_load += se.weight
+
+    og_virt_time = rq.virt_time
+
+    se.runtime_since_placed = 0
+    se.virt_time_placed = rq.virt_time - (lag / se.weight)
+
+    if rq.total_load > 0:
+        rq.virt_time -= lag / rq.total_load
+
+    se.time_eligible = rq.virt_time - (se.time_gotten_in_slice / se.weight)
+    se.deadline = se.time_eligible + (se.slice / se.weight)
+
+    add_row(rq, se)
+
+    if rq.store is not None or "join" in rq.observers:
+        emit(rq, soa_event, "join", se, rq.real_time, og_virt_time, rq.real_time, rq.virt_time, se.time_eligible,
+             se.deadline, lag=lag)
+
+
+def dequeue_entity(rq : rq_struct, se : sched_entity) -> float:
+
+    if (rq.curr is se):
+        rq.curr = None
+
+    og_virt_time = rq.virt_time
+
+    sync_entity(rq, se)
+    remove_row(rq, se)
+    rq.total_load -= se.weight
+
+    p_lag = get_lag(rq, se)
+
+    if rq.total_load > 0:
+        rq.virt_time += p_lag / rq.total_load
+
+    if rq.store is not None or "leave" in rq.observers:
+        emit(rq, soa_event, "leave", se, rq.real_time, og_virt_time, rq.real_time, rq.virt_time, se.time_eligible,
+             se.deadline, lag=p_lag)
+
+    return p_lag
+
+
+def replay_event(rq : rq_struct, event : trace_event, pid_to_se_and_lag : dict):
+
+    if isinstance(event, update_curr_event):
+        run_curr(rq, event.delta_exec, event.pid)
+
+    elif isinstance(event, pick_event):
+        pick_eevdf(rq)
+
+        if (rq.curr.pid != event.new_curr):
+            print("ERROR - diff in choice -- lnx: ", event.new_curr, ", this program: ", rq.curr.pid)
+            rq.curr = rq.procs_by_pid.get(event.new_curr, rq.curr)
+
+    elif isinstance(event, place_event):
+        if event.pid in pid_to_se_and_lag:
+            se_to_add, lag = pid_to_se_and_lag.pop(event.pid)
+        else:
+            se_to_add = sched_entity(event.pid, weight=event.weight)
+            lag = 0
+
+        place_entity(rq, se_to_add, lag)
+
+    elif isinstance(event, dequeue_event):
+        s = rq.procs_by_pid.get(event.pid)
+        if s is not None:
+            lag = dequeue_entity(rq, s)
+            pid_to_se_and_lag[s.pid] = (s, lag)
@@ -0,0 +1,300 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+import argparse
+import heapq
+import simulator_simple
+from event_sim import task_spec, sleepy_tasks
+
+
+# many cpus, one rq_struct each, stepped together a tick at a time. tasks sleep and wake up
+# (event_sim's task_spec workloads) and a balancer decides where a waking task goes, what an idle
+# cpu steals and what the periodic balance pulls. a migration is a dequeue_entity on the old rq
+# and a place_entity w/ the returned lag on the new one, the same as a sleep + wakeup, so the
+# lag a task built up on one cpu follows it. works w/ any simulator module w/ run_curr_for
+
+
+@dataclass
+class smp_task:
+    spec: task_spec
+    se: object
+    cpu: Optional[int] = None  # rq it is queued on, None while asleep
+    remaining: int = 0  # cpu time left in the current burst
+    sleep_after: int = 0
+    lag: float = 0  # lag it left its last rq w/
+    woke_at: Optional[int] = None  # set until it first runs after a wakeup
+    last_cpu: int = 0
+
+
+@dataclass
+class smp_result:
+    now: int = 0
+    ticks: int = 0
+    migrations: int = 0
+    wakeups: int = 0
+    idle_time: int = 0  # summed over the cpus
+    latencies: list[int] = field(default_factory=list)  # wakeup -> first run, per wakeup
+    migration_lags: list[float] = field(default_factory=list)
+
+
+# no-op balancer, tasks wake up on the cpu they last ran on and stay there
+class balancer:
+
+    # cpu a waking task is placed on
+    def select_cpu(self, sim : smp_sim, task : smp_task) -> int:
+        return task.last_cpu
+
+    # called for a cpu w/ nothing queued at the start of a tick
+    def idle(self, sim : smp_sim, cpu : int):
+        pass
+
+    # called every tick
+    def periodic(self, sim : smp_sim):
+        pass
+
+
+# wakeup push: place a waking task on the least loaded cpu, staying put on ties
+class wake_push(balancer):
+
+    def select_cpu(self, sim : smp_sim, task : smp_task) -> int:
+        if sim.nr[task.last_cpu] == sim.min_nr:
+            return task.last_cpu
+        return sim.idlest()
+
+
+# idle stealing: an idle cpu takes a queued (not running) task from the busiest cpu
+class idle_steal(balancer):
+
+    def idle(self, sim : smp_sim, cpu : int):
+        busiest = sim.busiest()
+        if sim.nr_running(busiest) >= 2:
+            sim.migrate_one(busiest, cpu)
+
+
+# periodic pull: every interval ticks, pull queued tasks from the busiest cpus to the idlest ones
+# until they are within imbalance tasks of each other
+class periodic_pull(balancer):
+
+    def __init__(self, interval : int = 4, imbalance : int = 1):
+        self.interval = interval
+        self.imbalance = imbalance
+
+    def periodic(self, sim : smp_sim):
+        if sim.result.ticks % self.interval:
+            return
+
+        # every migration narrows the gap, and a cpu w/ only curr queued ends it
+        while sim.max_nr - sim.min_nr > self.imbalance:
+            if not sim.migrate_one(sim.busiest(), sim.idlest()):
+                break
+
+
+class combined(balancer):
+
+    def __init__(self, *balancers : balancer):
+        self.balancers = balancers
+
+    def select_cpu(self, sim : smp_sim, task : smp_task) -> int:
+        cpu = task.last_cpu
+        for b in self.balancers:
+            if type(b).select_cpu is not balancer.select_cpu:
+                cpu = b.select_cpu(sim, task)
+        return cpu
+
+    def idle(self, sim : smp_sim, cpu : int):
+        for b in self.balancers:
+            b.idle(sim, cpu)
+
+    def periodic(self, sim : smp_sim):
+        for b in self.balancers:
+            b.periodic(sim)
+
+
+BALANCERS = {
+    "none": lambda: balancer(),
+    "push": lambda: wake_push(),
+    "steal": lambda: idle_steal(),
+    "pull": lambda: periodic_pull(),
+    "all": lambda: combined(wake_push(), idle_steal(), periodic_pull()),
+}
+
+
+class smp_sim:
+
+    def __init__(self, num_cpus : int, tasks : Iterable[task_spec], module=simulator_simple,
+                 balance : Optional[balancer] = None, tick : int = 4000000, record_timeline : bool = False):
+        self.module = module
+        self.rqs = [module.rq_struct([], record_timeline=record_timeline) for _ in range(num_cpus)]
+        self.balance = balance if balance is not None else balancer()
+        self.tick = tick
+        self.now = 0
+        self.result = smp_result()
+
+        # queued tasks per cpu, and the cpus bucketed by that count w/ the lowest and highest
+        # count in use, kept by wakeup / sleep / migrate so the balancers find the busiest and
+        # idlest cpu in O(1) instead of walking every rq
+        self.nr = [0] * num_cpus
+        self.by_nr : list[set[int]] = [set(range(num_cpus))]
+        self.min_nr = 0
+        self.max_nr = 0
+
+        self.tasks : dict[int, smp_task] = {}
+        self.bursts = {}
+        self.sleeping : list[tuple[int, int]] = []  # (wake time, pid)
+        for i, spec in enumerate(tasks):
+            se = module.sched_entity(spec.pid, slice=spec.slice, weight=spec.weight)
+            self.tasks[spec.pid] = smp_task(spec, se, last_cpu=i % num_cpus)
+            self.bursts[spec.pid] = iter(spec.bursts)
+            heapq.heappush(self.sleeping, (spec.arrival, spec.pid))
+
+    def nr_running(self, cpu : int) -> int:
+        return self.nr[cpu]
+
+    # the cpus w/ nothing queued
+    @property
+    def idle_cpus(self) -> set[int]:
+        return self.by_nr[0]
+
+    # any cpu w/ the most / fewest tasks queued
+    def busiest(self) -> int:
+        return next(iter(self.by_nr[self.max_nr]))
+
+    def idlest(self) -> int:
+        return next(iter(self.by_nr[self.min_nr]))
+
+    # delta is +1 or -1
+    def count(self, cpu : int, delta : int):
+        old = self.nr[cpu]
+        new = self.nr[cpu] = old + delta
+        if new == len(self.by_nr):
+            self.by_nr.append(set())
+        self.by_nr[old].discard(cpu)
+        self.by_nr[new].add(cpu)
+
+        if new > self.max_nr:
+            self.max_nr = new
+        elif not self.by_nr[self.max_nr]:
+            self.max_nr -= 1
+        if new < self.min_nr:
+            self.min_nr = new
+        elif not self.by_nr[self.min_nr]:
+            self.min_nr += 1
+
+    # move one queued, not running task from src to dst, False if src has none
+    def migrate_one(self, src : int, dst : int) -> bool:
+        rq = self.rqs[src]
+        for se in rq.procs_by_pid.values():
+            if se is not rq.curr:
+                self.migrate(self.tasks[se.pid], dst)
+                return True
+        return False
+
+    def migrate(self, task : smp_task, dst : int):
+        lag = self.module.dequeue_entity(self.rqs[task.cpu], task.se)
+        self.module.place_entity(self.rqs[dst], task.se, lag)
+        self.count(task.cpu, -1)
+        self.count(dst, 1)
+        task.cpu = task.last_cpu = dst
+        self.result.migrations += 1
+        self.result.migration_lags.append(lag)
+
+    def wakeup(self, pid : int):
+        task = self.tasks[pid]
+        burst = next(self.bursts[pid], None)
+        if burst is None:
+            return
+
+        task.remaining, task.sleep_after = burst
+        task.cpu = task.last_cpu = self.balance.select_cpu(self, task)
+        task.woke_at = self.now
+        self.module.place_entity(self.rqs[task.cpu], task.se, task.lag)
+        self.count(task.cpu, 1)
+        self.result.wakeups += 1
+
+    def sleep(self, task : smp_task):
+        task.lag = self.module.dequeue_entity(self.rqs[task.cpu], task.se)
+        self.count(task.cpu, -1)
+        task.cpu = None
+        heapq.heappush(self.sleeping, (self.now + task.sleep_after, task.spec.pid))
+
+    def run(self, until : int) -> smp_result:
+        while self.now < until and (self.sleeping or len(self.idle_cpus) < len(self.rqs)):
+            while self.sleeping and self.sleeping[0][0] <= self.now:
+                self.wakeup(heapq.heappop(self.sleeping)[1])
+
+            for cpu in sorted(self.idle_cpus):
+                if self.nr[cpu] == 0:
+                    self.balance.idle(self, cpu)
+
+            for rq in self.rqs:
+                self.run_tick(rq)
+
+            self.now += self.tick
+            self.result.ticks += 1
+            self.balance.periodic(self)
+
+        self.result.now = self.now
+        return self.result
+
+    # one tick on one cpu: pick (tick preemption), run, and repick whenever curr goes to sleep
+    def run_tick(self, rq):
+        budget = self.tick
+        while budget > 0 and rq.procs_by_pid:
+            self.module.pick_eevdf(rq)
+            task = self.tasks[rq.curr.pid]
+            if task.woke_at is not None:
+                self.result.latencies.append(self.now + self.tick - budget - task.woke_at)
+                task.woke_at = None
+
+            amount = min(budget, task.remaining)
+            self.module.run_curr_for(rq, amount)
+            task.remaining -= amount
+            budget -= amount
+
+            if task.remaining <= 0:
+                self.sleep(task)
+
+        if budget > 0:
+            rq.real_time += budget
+            self.result.idle_time += budget
+
+
+def percentile(values : list, p : float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def print_summary(name : str, sim : smp_sim):
+    r = sim.result
+    busy = 1 - r.idle_time / max(r.now * len(sim.rqs), 1)
+    lags = [abs(lag) for lag in r.migration_lags]
+    print(f"{name:>6}: {len(sim.rqs)} cpus, {r.ticks} ticks, busy {100 * busy:5.1f}%, {r.wakeups} wakeups, "
+          f"{r.migrations} migrations, latency p50 {percentile(r.latencies, 50) / 1e6:.2f}ms "
+          f"p99 {percentile(r.latencies, 99) / 1e6:.2f}ms, |lag| at migration p99 {percentile(lags, 99) / 1e6:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="eevdf on many cpus w/ load balancing")
+    parser.add_argument("--cpus", type=int, default=32)
+    parser.add_argument("--tasks", type=int, default=1000)
+    parser.add_argument("--seconds", type=float, default=2)
+    parser.add_argument("--balancers", nargs="+", default=list(BALANCERS), choices=list(BALANCERS))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    simulator_simple.verbose = False
+
+    for name in args.balancers:
+        # tasks are mostly asleep, about half the cpus' worth of them are runnable at a time
+        tasks = sleepy_tasks(args.tasks, args.seed, run_mean=2000000,
+                             sleep_mean=max(1, int(2000000 * (2 * args.tasks / args.cpus - 1))))
+        sim = smp_sim(args.cpus, tasks, balance=BALANCERS[name]())
+        sim.run(int(args.seconds * 1e9))
+        print_summary(name, sim)
+
+
+
+if __name__=="__main__":
+    main()
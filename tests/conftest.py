@@ -0,0 +1,8 @@
+import os
+import sys
+
+import matplotlib
+
+# the simulators are top level modules next to this directory, and import pyplot
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+matplotlib.use("Agg")
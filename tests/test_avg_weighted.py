@@ -0,0 +1,50 @@
+from random import Random
+
+import pytest
+
+import simulator_avg_weighted as avg_weighted
+
+
+@pytest.fixture(autouse=True)
+def quiet(monkeypatch):
+    monkeypatch.setattr(avg_weighted, "verbose", False)
+    monkeypatch.setattr(avg_weighted, "print_match_linux", False)
+
+
+def check_running_sum(rq):
+    procs = list(rq.all_procs)
+    if not procs:
+        return
+    expected = sum(s.weight * s.vruntime for s in procs) / rq.total_load
+    assert rq.avg_vrt == pytest.approx(expected, rel=1e-9, abs=1e-3)
+    relative = sum(s.weight * (s.vruntime - rq.min_vruntime) for s in procs)
+    assert rq.weighted_vrt_sum == pytest.approx(relative, rel=1e-9, abs=1e-3)
+
+
+# the running sum against the full recompute it replaced, through joins and leaves w/ fractional
+# lags and a long run so min_vruntime moves a lot
+@pytest.mark.parametrize("seed", range(40))
+def test_running_sum_matches_recompute(seed):
+    rng = Random(seed)
+    rq = avg_weighted.rq_struct([])
+    entities = [avg_weighted.sched_entity(pid, slice=rng.choice([1000000, 4000000, 80000000]),
+                                          weight=rng.choice([512, 1024, 2048])) for pid in range(1, 9)]
+    queued = []
+    lags = {}
+
+    for _ in range(400):
+        op = rng.random()
+        idle = [se for se in entities if se not in queued]
+        if idle and (op < 0.2 or not queued):
+            se = rng.choice(idle)
+            avg_weighted.place_entity(rq, se, lags.pop(se.pid, rng.uniform(-1e6, 1e6)))
+            queued.append(se)
+        elif len(queued) > 1 and op < 0.4:
+            se = rng.choice(queued)
+            lags[se.pid] = avg_weighted.dequeue_entity(rq, se)
+            queued.remove(se)
+        check_running_sum(rq)
+
+        avg_weighted.pick_eevdf(rq)
+        avg_weighted.run_curr(rq, rng.choice([1000000, 4000000]))
+        check_running_sum(rq)
@@ -0,0 +1,44 @@
+from random import Random
+
+import pytest
+
+import simulator_simple as simple
+
+
+@pytest.fixture(autouse=True)
+def quiet(monkeypatch):
+    monkeypatch.setattr(simple, "verbose", False)
+    monkeypatch.setattr(simple, "check_lag_sum", True)
+
+
+def scan_lag_sum(rq) -> float:
+    return sum(simple.get_lag(rq, s) for s in rq.all_procs)
+
+
+# the running sums against a pass over the rq, w/ the assertion mode on for every event
+@pytest.mark.parametrize("seed", range(40))
+def test_lag_sum_matches_scan(seed):
+    rng = Random(seed)
+    rq = simple.rq_struct([])
+    entities = [simple.sched_entity(pid, slice=rng.choice([1000000, 4000000, 80000000]),
+                                    weight=rng.choice([512, 1024, 2048])) for pid in range(1, 9)]
+    queued = []
+    lags = {}
+
+    for _ in range(400):
+        op = rng.random()
+        idle = [se for se in entities if se not in queued]
+        if idle and (op < 0.2 or not queued):
+            se = rng.choice(idle)
+            simple.place_entity(rq, se, lags.pop(se.pid, 0))
+            queued.append(se)
+        elif len(queued) > 1 and op < 0.4:
+            se = rng.choice(queued)
+            lags[se.pid] = simple.dequeue_entity(rq, se)
+            queued.remove(se)
+
+        simple.pick_eevdf(rq)
+        simple.run_curr(rq, rng.choice([1000000, 4000000]))
+
+        scale = rq.total_load * abs(rq.virt_time) + rq.runtime_sum + 1
+        assert simple.lag_sum(rq) == pytest.approx(scan_lag_sum(rq), abs=1e-9 * scale)
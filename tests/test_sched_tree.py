@@ -0,0 +1,50 @@
+from random import Random
+
+import pytest
+
+import simulator_simple as simple
+
+
+@pytest.fixture(autouse=True)
+def quiet(monkeypatch):
+    monkeypatch.setattr(simple, "verbose", False)
+
+
+# the pick as it was before the deadline tree: the first entity (in placement order) w/ the max
+# deadline, else the first eligible one w/ the smallest deadline below it
+def scan_pick(rq, queued : list):
+    next_se = max(queued, key=lambda s: s.deadline)
+    min_deadline = next_se.deadline
+    for se in queued:
+        if se.deadline < min_deadline and simple.entity_eligible(rq, se):
+            min_deadline = se.deadline
+            next_se = se
+    return next_se
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_pick_matches_scan(seed):
+    rng = Random(seed)
+    rq = simple.rq_struct([])
+    entities = [simple.sched_entity(pid, slice=rng.choice([1000000, 3000000, 4000000, 80000000]),
+                                    weight=rng.choice([512, 1024, 2048])) for pid in range(1, rng.randrange(2, 12))]
+    queued = []
+    lags = {}
+
+    for _ in range(300):
+        op = rng.random()
+        idle = [se for se in entities if se not in queued]
+        if idle and (op < 0.15 or not queued):
+            se = rng.choice(idle)
+            simple.place_entity(rq, se, lags.pop(se.pid, 0))
+            queued.append(se)
+        elif len(queued) > 1 and op < 0.3:
+            se = rng.choice(queued)
+            lags[se.pid] = simple.dequeue_entity(rq, se)
+            queued.remove(se)
+
+        expected = scan_pick(rq, queued)
+        simple.pick_eevdf(rq)
+        assert rq.curr is expected
+
+        simple.run_curr(rq, rng.choice([1000000, 2500000, 4000000]))
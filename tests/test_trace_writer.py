@@ -0,0 +1,55 @@
+import io
+from random import seed
+
+import pytest
+
+import simulator_avg_weighted as avg_weighted
+from trace_writer import trace_writer, format_echo, read_records, to_text
+
+
+RECORDS = [
+    ("pick", (-1, 3)),
+    ("run", (3, 4000000, 1234.5)),
+    ("run", (3, 0, 0.0)),
+    ("join", (7, 1024, -2.5, 2 ** 60 + 1, 0, 4000000)),
+    ("leave", (3, 7, 1e-300)),
+]
+
+
+@pytest.mark.parametrize("format", ["binary", "jsonl"])
+def test_round_trip(tmp_path, format):
+    path = str(tmp_path / f"echo.{format}")
+    with trace_writer(path, format=format, buffer_records=2) as writer:
+        for type, values in RECORDS:
+            writer.write(type, values)
+
+    assert list(read_records(path, chunk_size=7)) == RECORDS
+    out = io.StringIO()
+    assert to_text(path, out) == len(RECORDS)
+    assert out.getvalue().splitlines() == [format_echo(type, values) for type, values in RECORDS]
+
+
+# the echo_file text against the print echo of the same runs
+@pytest.mark.parametrize("format", ["binary", "jsonl"])
+def test_echo_file_matches_print(tmp_path, monkeypatch, capsys, format):
+    monkeypatch.setattr(avg_weighted, "verbose", False)
+    monkeypatch.setattr(avg_weighted, "print_match_linux", True)
+
+    def run():
+        for s in range(5):
+            seed(s)
+            avg_weighted.random_mixed(avg_weighted.rq_struct([]))
+
+    run()
+    printed = capsys.readouterr().out.splitlines()
+
+    path = str(tmp_path / f"echo.{format}")
+    monkeypatch.setattr(avg_weighted, "echo_file", path)
+    monkeypatch.setattr(avg_weighted, "echo_format", format)
+    run()
+    avg_weighted._echo_writers.pop(path).close()
+    assert capsys.readouterr().out == ""
+
+    out = io.StringIO()
+    to_text(path, out)
+    assert out.getvalue().splitlines() == printed
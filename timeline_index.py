@@ -0,0 +1,107 @@
+from __future__ import annotations
+from typing import Optional
+import argparse
+import numpy as np
+from timeline_store import EVENT_TYPES, TYPE_CODES, as_array
+
+
+# time window queries over a timeline w/o a pass over all of it. the events are sorted by start
+# real time once, next to the running max of their end times: everything that can overlap
+# [t1, t2] is between the first event whose running max end reaches t1 and the last one starting
+# by t2, both a binary search away. run events don't overlap each other, so that range is the
+# answer plus at most the few instant events (picks, joins) sharing its edges, O(log n + k).
+# queries for one type and / or pid get an index of their own the first time they are asked for.
+# the index is a snapshot, build a new one after the timeline grew
+
+
+class timeline_index:
+
+    def __init__(self, events):
+        rows = as_array(events)
+        order = np.argsort(rows["start_real_time"], kind="stable")  # ties stay in timeline order
+        self.rows = rows[order]
+        self.starts = self.rows["start_real_time"]
+        self.ends = self.rows["end_real_time"]
+        self.max_end = np.maximum.accumulate(self.ends) if len(rows) else self.ends
+        self.subsets : dict[tuple[Optional[int], Optional[int]], timeline_index] = {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    # the index of just one event type and / or pid
+    def subset(self, type : Optional[str] = None, pid : Optional[int] = None) -> timeline_index:
+        if type is None and pid is None:
+            return self
+
+        key = (None if type is None else TYPE_CODES[type], pid)
+        index = self.subsets.get(key)
+        if index is None:
+            mask = np.ones(len(self.rows), dtype=bool)
+            if type is not None:
+                mask &= self.rows["type"] == key[0]
+            if pid is not None:
+                mask &= self.rows["pid"] == pid
+            index = self.subsets[key] = timeline_index(self.rows[mask])
+        return index
+
+    # events that overlap [t1, t2] (an event ending at t1 or starting at t2 counts), sorted by start
+    def between(self, t1 : int, t2 : int, type : Optional[str] = None, pid : Optional[int] = None) -> np.ndarray:
+        index = self.subset(type, pid)
+        lo = np.searchsorted(index.max_end, t1, side="left")
+        hi = np.searchsorted(index.starts, t2, side="right")
+        if lo >= hi:
+            return index.rows[:0]
+        rows = index.rows[lo:hi]
+        return rows[rows["end_real_time"] >= t1]
+
+    # events going on at real time t
+    def at(self, t : int, type : Optional[str] = None, pid : Optional[int] = None) -> np.ndarray:
+        return self.between(t, t, type, pid)
+
+    # pid -> real time it ran within [t1, t2]
+    def ran_between(self, t1 : int, t2 : int) -> dict[int, int]:
+        runs = self.between(t1, t2, "run")
+        ran = np.minimum(runs["end_real_time"], t2) - np.maximum(runs["start_real_time"], t1)
+        pids, where = np.unique(runs["pid"], return_inverse=True)
+        totals = np.bincount(where, weights=ran, minlength=len(pids))
+        return {int(pid): int(total) for pid, total in zip(pids, totals) if total > 0}
+
+    # rq virt_time at real time t: the end virt time of the last event started by t, or in
+    # between its start and end virt time if t is inside it (virt time goes up linearly while
+    # something runs). None before the first event
+    def virt_time_at(self, t : int) -> Optional[float]:
+        i = np.searchsorted(self.starts, t, side="right") - 1
+        if i < 0:
+            return None
+
+        row = self.rows[i]
+        start, end = int(row["start_real_time"]), int(row["end_real_time"])
+        if t >= end or end == start:
+            return float(row["end_virt_time"])
+        return float(row["start_virt_time"] + (row["end_virt_time"] - row["start_virt_time"]) * (t - start) / (end - start))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="time window queries on a stored timeline (.npy)")
+    parser.add_argument("file", help="timeline saved w/ columnar_timeline.save")
+    parser.add_argument("start", type=int, help="real time the window starts at")
+    parser.add_argument("end", type=int, help="real time the window ends at")
+    parser.add_argument("--type", choices=EVENT_TYPES, default=None, help="list the events of this type in the window")
+    parser.add_argument("--pid", type=int, default=None, help="list the events of this pid in the window")
+    args = parser.parse_args()
+
+    index = timeline_index(np.load(args.file, mmap_mode="r"))
+
+    print(f"virt_time at {args.start}: {index.virt_time_at(args.start)}, at {args.end}: {index.virt_time_at(args.end)}")
+    for pid, ran in sorted(index.ran_between(args.start, args.end).items()):
+        print(f"P{pid} ran {ran}")
+
+    if args.type is not None or args.pid is not None:
+        for row in index.between(args.start, args.end, args.type, args.pid).tolist():
+            print(f"{EVENT_TYPES[row[1]]:>7} P{row[0]}: real {row[2]} -> {row[4]}, virt {row[3]:.1f} -> {row[5]:.1f}, "
+                  f"te {row[6]:.1f}, dl {row[7]:.1f}")
+
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,140 @@
+from __future__ import annotations
+from typing import Optional
+import numpy as np
+import matplotlib.pyplot as plt
+from timeline_store import TYPE_CODES, as_array
+
+
+# batched, level of detail version of the simulators' draw_timeline: one matplotlib call per pid
+# (run bars) or per event type (markers, pick lines, virt time ticks) instead of one per event,
+# everything merged / deduplicated down to what can show up at the axes' pixel width, and the
+# text labels only drawn when there are few enough of them to read. takes a list of
+# scheduling_events, a columnar_timeline or a timeline_dtype array
+
+
+# merge [start, end) spans (sorted by start) whose gap is under px, returns (starts, widths)
+def lod_bars(starts : np.ndarray, ends : np.ndarray, px : float) -> tuple[np.ndarray, np.ndarray]:
+    if len(starts) == 0:
+        return starts, ends
+    # a span can start before the previous one ends, the running max end is what covers the gap
+    covered = np.maximum.accumulate(ends)
+    breaks = np.flatnonzero(starts[1:] - covered[:-1] > px) + 1
+    first = np.concatenate(([0], breaks))
+    last = np.concatenate((breaks - 1, [len(starts) - 1]))
+    return starts[first], covered[last] - starts[first]
+
+
+# one point per pixel column (and pid), for markers. left of x0 is dropped like in lod_columns,
+# a negative column would make a key of the row below
+def lod_points(x : np.ndarray, y : np.ndarray, x0 : float, px : float) -> tuple[np.ndarray, np.ndarray]:
+    cols = np.floor((x - x0) / px).astype(np.int64)
+    on_screen = cols >= 0
+    x, y, cols = x[on_screen], y[on_screen], cols[on_screen]
+    if len(x) == 0:
+        return x, y
+    _, keep = np.unique((y.astype(np.int64) - y.min()) * (cols.max() + 1) + cols, return_index=True)
+    return x[keep], y[keep]
+
+
+# the pixel columns anything in x falls in, as x positions (column centers), left of x0 is dropped
+def lod_columns(x : np.ndarray, x0 : float, px : float) -> np.ndarray:
+    cols = np.floor((x - x0) / px).astype(np.int64)
+    cols = cols[cols >= 0]
+    return x0 + (np.flatnonzero(np.bincount(cols)) + 0.5) * px
+
+
+def draw_timeline_fast(events, simple : bool = False, ax=None, width_px : Optional[int] = None,
+                       max_labels : int = 200, window : Optional[tuple[int, int]] = None, show : bool = True):
+    rows = as_array(events)
+    if len(rows) == 0:
+        raise ValueError("nothing to draw")
+
+    if ax is None:
+        _, ax = plt.subplots(figsize=(12, 6))
+    if width_px is None:
+        width_px = max(int(ax.get_window_extent().width), 1)
+
+    pid = rows["pid"]
+    type = rows["type"]
+    start = rows["start_real_time"]
+    end = rows["end_real_time"]
+
+    min_pid, max_pid = int(pid.min()), int(pid.max())
+    y_offset = (min_pid - 1) * 10
+    max_rtime = int(end.max())
+    # the real time range on screen, all of it or just the window
+    left, right = (0, max_rtime) if window is None else window
+    x0 = left - 0.05 * (right - left)
+    px = max(1.1 * (right - left) / width_px, 1e-9)  # real time per pixel
+
+    # run bars, merged per pid
+    runs = rows[type == TYPE_CODES["run"]]
+    if np.all(runs["start_real_time"][1:] >= runs["start_real_time"][:-1]):
+        # timelines are appended in time order, a stable sort on pid keeps it
+        runs = runs[np.argsort(runs["pid"], kind="stable")]
+    else:
+        runs = runs[np.lexsort((runs["start_real_time"], runs["pid"]))]
+    pids, first = np.unique(runs["pid"], return_index=True)
+    labels = []
+    for p, lo, hi in zip(pids, first, np.append(first[1:], len(runs))):
+        starts, widths = lod_bars(runs["start_real_time"][lo:hi].astype(np.float64),
+                                  runs["end_real_time"][lo:hi].astype(np.float64), px)
+        ax.broken_barh(np.column_stack((starts, widths)), (p * 10, 5), facecolors=('tab:blue'))
+        if not simple:
+            wide = widths > 30 * px
+            labels.extend((s + w / 2, p) for s, w in zip(starts[wide], widths[wide]))
+
+    if labels and len(labels) <= max_labels:
+        for x, p in labels:
+            ax.text(x, p * 10 + 2.5, f'P{p}', ha='center', va='center', color='white')
+
+    # joins and leaves, one marker per pixel column per pid
+    size = 200 if not simple else 40
+    for name, marker, color in (("join", "^", "green"), ("leave", "v", "red")):
+        sel = type == TYPE_CODES[name]
+        x, p = lod_points(start[sel].astype(np.float64), pid[sel], x0, px)
+        if len(x):
+            ax.scatter(x, p * 10, marker=marker, color=color, s=size, zorder=3)
+
+    if not simple:
+        # picks, one line per pixel column
+        picks = start[type == TYPE_CODES["pick"]]
+        if len(picks):
+            ax.vlines(lod_columns(picks, x0, px), y_offset - 15, max_pid * 10 + 10, color='gray', linestyle='--', linewidth=0.5)
+
+        sel = type == TYPE_CODES["new-req"]
+        reqs = rows[sel]
+        x, p = lod_points(reqs["start_real_time"].astype(np.float64), reqs["pid"], x0, px)
+        if len(x):
+            ax.scatter(x, p * 10, marker='*', color='orange', s=200, zorder=3)
+        if 0 < len(reqs) <= max_labels:
+            for r in reqs:
+                ax.text(r["start_real_time"] - 1000000, r["pid"] * 10 - 0.3, f'\n ({r["req_te"]}, \n {r["req_dl"]})',
+                        ha='left', va='center', fontsize=8, color='orange')
+
+        # virt time line w/ a tick at every real time something happened
+        ax.hlines(y=y_offset, xmin=left, xmax=min(right, max_rtime), color='black')
+        ax.vlines(lod_columns(np.concatenate((start, end)), x0, px), y_offset - 1, y_offset + 1, color='black')
+
+        if 2 * len(rows) <= max_labels:
+            # the distinct virt times at each real time, stacked under each other like draw_timeline does
+            points = np.unique(np.stack((np.concatenate((start, end)).astype(np.float64),
+                                         np.concatenate((rows["start_virt_time"], rows["end_virt_time"])))), axis=1)
+            order = np.searchsorted(points[0], points[0], side="left")
+            for i, (real_time, virt_time) in enumerate(points.T):
+                ax.text(real_time, y_offset - 2 - (i - order[i]) * 2, f'{virt_time:.1f}',
+                        ha='center', va='center', fontsize=8, color='black')
+
+    ax.set_ylim(y_offset - 15, max_pid * 10 + 10)
+    ax.set_xlim(x0, right + 0.05 * (right - left))
+    ax.set_xlabel('Real Time')
+
+    # a tick per pid, thinned out when there are too many to read
+    step = max(1, (max_pid - min_pid + 1) // 50)
+    ticks = range(min_pid, max_pid + 1, step)
+    ax.set_yticks([p * 10 + 2.5 for p in ticks])
+    ax.set_yticklabels([f'P{p}' for p in ticks])
+
+    if show:
+        plt.show()
+    return ax
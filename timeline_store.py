@@ -0,0 +1,258 @@
+from __future__ import annotations
+from collections import namedtuple
+from typing import Iterable, Iterator, Optional, Union
+import atexit
+import numpy as np
+
+
+# event types as stored in the type column
+EVENT_TYPES = ("join", "leave", "run", "new-req", "pick")
+TYPE_CODES = {name: code for code, name in enumerate(EVENT_TYPES)}
+
+timeline_dtype = np.dtype([
+    ("pid", np.int64),
+    ("type", np.uint8),
+    ("start_real_time", np.int64),
+    ("start_virt_time", np.float64),
+    ("end_real_time", np.int64),
+    ("end_virt_time", np.float64),
+    ("req_te", np.float64),
+    ("req_dl", np.float64),
+])
+
+# what iterating a columnar timeline hands back, has the same attributes as scheduling_event
+timeline_row = namedtuple("timeline_row", ["pid", "type", "start_real_time", "start_virt_time", "end_real_time",
+                                           "end_virt_time", "req_te", "req_dl", "cls"])
+
+
+# drop-in replacement for the rq.timeline list: one growable structured array instead of a
+# scheduling_event object per event. pass one as an rq_struct's timeline and the simulators write
+# to it straight from the call sites (see sched_hooks.attach_timeline), w/o making an event. w/
+# coalesce_runs, record extends the last row like
+# sched_hooks.coalescing_timeline_sink would
+class columnar_timeline:
+
+    def __init__(self, capacity : int = 1024, cls : str = "simple", coalesce_runs : bool = False):
+        self.data = np.empty(max(capacity, 1), dtype=timeline_dtype)
+        self.size = 0
+        self.cls = cls
+        self.coalesce_runs = coalesce_runs
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[timeline_row]:
+        for row in self.array.tolist():
+            yield timeline_row(row[0], EVENT_TYPES[row[1]], *row[2:], self.cls)
+
+    # a slice gives a list of rows, like slicing the list timeline would
+    def __getitem__(self, i : Union[int, slice]) -> Union[timeline_row, list[timeline_row]]:
+        if isinstance(i, slice):
+            return [timeline_row(row[0], EVENT_TYPES[row[1]], *row[2:], self.cls) for row in self.array[i].tolist()]
+        row = self.array[i].tolist()
+        return timeline_row(row[0], EVENT_TYPES[row[1]], *row[2:], self.cls)
+
+    # the filled part of the store, columns are eg timeline.array["pid"]
+    @property
+    def array(self) -> np.ndarray:
+        return self.data[:self.size]
+
+    def append(self, event):
+        self.record(event.pid, event.type, event.start_real_time, event.start_virt_time,
+                    event.end_real_time, event.end_virt_time, event.req_te, event.req_dl)
+
+    def record(self, pid : int, type : str, start_real_time : int, start_virt_time : float,
+               end_real_time : int, end_virt_time : float, req_te : float, req_dl : float):
+        if (self.coalesce_runs and type == "run" and self.size
+                and _extend_run(self.data, self.size - 1, pid, start_real_time, end_real_time, end_virt_time)):
+            return
+        if self.size == len(self.data):
+            self.data = np.resize(self.data, 2 * len(self.data))
+        self.data[self.size] = (pid, TYPE_CODES[type], start_real_time, start_virt_time,
+                                end_real_time, end_virt_time, req_te, req_dl)
+        self.size += 1
+
+    def extend(self, events : Iterable):
+        for event in events:
+            self.append(event)
+
+    # stretch the last row to the end of event if both are runs of the same pid back to back,
+    # False if they aren't (see sched_hooks.coalescing_timeline_sink)
+    def extend_run(self, event) -> bool:
+        if self.size == 0 or event.type != "run":
+            return False
+        return _extend_run(self.data, self.size - 1, event.pid, event.start_real_time, event.end_real_time,
+                           event.end_virt_time)
+
+    # rows of one type and/or pid, as a structured array
+    def select(self, type : Optional[str] = None, pid : Optional[int] = None) -> np.ndarray:
+        rows = self.array
+        mask = np.ones(len(rows), dtype=bool)
+        if type is not None:
+            mask &= rows["type"] == TYPE_CODES[type]
+        if pid is not None:
+            mask &= rows["pid"] == pid
+        return rows[mask]
+
+    def save(self, file_path : str):
+        np.save(file_path, self.array)
+
+    @classmethod
+    def load(cls, file_path : str, cls_name : str = "simple") -> columnar_timeline:
+        data = np.load(file_path)
+        timeline = cls(len(data), cls_name)
+        timeline.data[:len(data)] = data
+        timeline.size = len(data)
+        return timeline
+
+    @classmethod
+    def from_events(cls, events : Iterable, cls_name : str = "simple") -> columnar_timeline:
+        timeline = cls(cls=cls_name)
+        timeline.extend(events)
+        return timeline
+
+
+# columnar_timeline that only keeps the last capacity events, so memory stays flat however long
+# the run is. w/ a spill_path every event is also written there, a chunk at a time, as raw
+# timeline_dtype records (read them back w/ load_spill). a chunk is written before any of it
+# can be overwritten, so the file plus what is still in the ring is the whole run
+class ring_timeline:
+
+    def __init__(self, capacity : int = 1 << 20, cls : str = "simple", spill_path : Optional[str] = None,
+                 chunk : Optional[int] = None, coalesce_runs : bool = False):
+        self.capacity = max(capacity, 1)
+        self.data = np.empty(self.capacity, dtype=timeline_dtype)
+        self.total = 0  # events ever recorded, event i is at data[i % capacity] while it is kept
+        self.cls = cls
+        self.coalesce_runs = coalesce_runs
+
+        self.spilled = 0  # events written to the spill file
+        self.chunk = min(chunk or max(self.capacity // 8, 1), self.capacity)
+        self.spill = None
+        if spill_path is not None:
+            self.spill = open(spill_path, "wb")
+            # rq_structs never close their timeline
+            atexit.register(self.close)
+
+    def __len__(self) -> int:
+        return min(self.total, self.capacity)
+
+    # events that fell out of the ring
+    @property
+    def dropped(self) -> int:
+        return self.total - len(self)
+
+    def __iter__(self) -> Iterator[timeline_row]:
+        for row in self.array.tolist():
+            yield timeline_row(row[0], EVENT_TYPES[row[1]], *row[2:], self.cls)
+
+    def __getitem__(self, i : Union[int, slice]) -> Union[timeline_row, list[timeline_row]]:
+        size = len(self)
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(size))]
+        if not -size <= i < size:
+            raise IndexError("ring_timeline index out of range")
+        row = self.data[(self.total - size + i % size) % self.capacity].tolist()
+        return timeline_row(row[0], EVENT_TYPES[row[1]], *row[2:], self.cls)
+
+    # global event numbers first .. last (exclusive), they must still be in the ring
+    def rows(self, first : int, last : int) -> np.ndarray:
+        if last == first:
+            return self.data[:0].copy()
+        lo, hi = first % self.capacity, last % self.capacity
+        if lo < hi:
+            return self.data[lo:hi].copy()
+        return np.concatenate((self.data[lo:], self.data[:hi]))
+
+    # the kept events oldest first, a copy (the ring wraps so it can't be a view)
+    @property
+    def array(self) -> np.ndarray:
+        return self.rows(self.total - len(self), self.total)
+
+    def append(self, event):
+        self.record(event.pid, event.type, event.start_real_time, event.start_virt_time,
+                    event.end_real_time, event.end_virt_time, event.req_te, event.req_dl)
+
+    def record(self, pid : int, type : str, start_real_time : int, start_virt_time : float,
+               end_real_time : int, end_virt_time : float, req_te : float, req_dl : float):
+        if (self.coalesce_runs and type == "run" and self.can_extend()
+                and _extend_run(self.data, (self.total - 1) % self.capacity, pid, start_real_time, end_real_time,
+                                end_virt_time)):
+            return
+        if self.spill is not None and self.total - self.spilled >= self.capacity:
+            # the row about to be overwritten isn't in the file yet
+            self.flush()
+        self.data[self.total % self.capacity] = (pid, TYPE_CODES[type], start_real_time, start_virt_time,
+                                                 end_real_time, end_virt_time, req_te, req_dl)
+        self.total += 1
+        # the newest row is held back, extend_run may still stretch it
+        if self.spill is not None and self.total - 1 - self.spilled >= self.chunk:
+            self.flush(keep_last=True)
+
+    def extend(self, events : Iterable):
+        for event in events:
+            self.append(event)
+
+    # see columnar_timeline.extend_run, a row already in the spill file stays as it is
+    def extend_run(self, event) -> bool:
+        if not self.can_extend() or event.type != "run":
+            return False
+        return _extend_run(self.data, (self.total - 1) % self.capacity, event.pid, event.start_real_time,
+                           event.end_real_time, event.end_virt_time)
+
+    def can_extend(self) -> bool:
+        return self.total > 0 and (self.spill is None or self.spilled < self.total)
+
+    def select(self, type : Optional[str] = None, pid : Optional[int] = None) -> np.ndarray:
+        rows = self.array
+        mask = np.ones(len(rows), dtype=bool)
+        if type is not None:
+            mask &= rows["type"] == TYPE_CODES[type]
+        if pid is not None:
+            mask &= rows["pid"] == pid
+        return rows[mask]
+
+    # write out everything not spilled yet
+    def flush(self, keep_last : bool = False):
+        last = self.total - 1 if keep_last else self.total
+        if self.spill is None or self.spill.closed or last <= self.spilled:
+            return
+        self.rows(self.spilled, last).tofile(self.spill)
+        self.spilled = last
+
+    def close(self):
+        if self.spill is None or self.spill.closed:
+            return
+        self.flush()
+        self.spill.close()
+        atexit.unregister(self.close)
+
+    # the kept events, in the same format as columnar_timeline.save
+    def save(self, file_path : str):
+        np.save(file_path, self.array)
+
+
+# stretch row i to end_real_time / end_virt_time if it is a run of pid ending at start_real_time
+def _extend_run(data : np.ndarray, i : int, pid : int, start_real_time : int, end_real_time : int,
+                end_virt_time : float) -> bool:
+    row = data[i]
+    if row["type"] != TYPE_CODES["run"] or row["pid"] != pid or row["end_real_time"] != start_real_time:
+        return False
+    row["end_real_time"] = end_real_time
+    row["end_virt_time"] = end_virt_time
+    return True
+
+
+def load_spill(file_path : str) -> np.ndarray:
+    return np.fromfile(file_path, dtype=timeline_dtype)
+
+
+# a list of scheduling_events, a columnar_timeline / ring_timeline or a timeline_dtype array,
+# as a timeline_dtype array
+def as_array(events) -> np.ndarray:
+    if isinstance(events, np.ndarray):
+        return events
+    if isinstance(events, (columnar_timeline, ring_timeline)):
+        return events.array
+    return np.array([(e.pid, TYPE_CODES[e.type], e.start_real_time, e.start_virt_time, e.end_real_time,
+                      e.end_virt_time, e.req_te, e.req_dl) for e in events], dtype=timeline_dtype)
@@ -0,0 +1,130 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional, Union
+import re
+
+
+# typed records for the lines of the kernel dmesg output (out.txt) the replays care about,
+# time is the dmesg timestamp in seconds. cpu is the cpu the line was printed on when the trace
+# says (a printk caller prefix like [    C3] or a cpu: 3 token after the event text), otherwise None
+
+@dataclass
+class update_curr_event:
+    time: float
+    pid: int
+    delta_exec: int
+    avg_vrt: Optional[int] = None
+    virt_time: Optional[float] = None
+    cpu: Optional[int] = None
+
+
+@dataclass
+class pick_event:
+    time: float
+    curr: int
+    new_curr: int
+    real_time: Optional[int] = None
+    cpu: Optional[int] = None
+
+
+@dataclass
+class place_event:
+    time: float
+    pid: int
+    weight: int
+    vlag: int
+    vrt: int
+    te: int
+    t_g_i_s: int
+    virt_time: Optional[float] = None
+    re_place: bool = False
+    cpu: Optional[int] = None
+
+
+@dataclass
+class dequeue_event:
+    time: float
+    curr: int
+    pid: int
+    lag: Optional[int] = None
+    virt_time: Optional[float] = None
+    last: bool = False
+    cpu: Optional[int] = None
+
+
+trace_event = Union[update_curr_event, pick_event, place_event, dequeue_event]
+
+
+# one pattern for every line type, so each line is scanned once. virt times are printed by the
+# kernel as fixed point, <int>.<frac / 2**16>
+_trace_re = re.compile(
+    r"\[\s*(?P<time>\d+\.\d+)\](?:\[\s*(?:C(?P<caller_cpu>\d+)|T\d+)\])?\s+(?:"
+    r"(?P<update_curr>update_curr (?P<uc_pid>-?\d+): delta exec: (?P<uc_delta>-?\d+)"
+        r"(?:, new avg_vrt: (?P<uc_avg>-?\d+))?(?:.*?virt time: (?P<uc_vt>-?\d+\.\d+))?)"
+    r"|(?P<pick>pick_next_entity: curr: (?P<pk_curr>-?\d+)(?:, real_time: (?P<pk_rt>-?\d+))?, new_curr: (?P<pk_new>-?\d+))"
+    r"|(?P<place>(?P<pl_re>RE-)?place_entity placing se: (?P<pl_pid>-?\d+), w/ weight: (?P<pl_weight>\d+), vlag: (?P<pl_lag>-?\d+),"
+        r"\s+vrt: (?P<pl_vrt>-?\d+), new te val: (?P<pl_te>-?\d+), t_g_i_s: (?P<pl_tgis>-?\d+)"
+        r"(?:.*?new virt_time: (?P<pl_vt>-?\d+\.\d+))?)"
+    r"|(?P<dequeue>dequeue_entity: (?P<dq_last>removing last pid -- )?curr: (?P<dq_curr>-?\d+), task being dequeued (?P<dq_pid>-?\d+)"
+        r"(?:,? it'?s lag: (?P<dq_lag>-?\d+))?(?:.*?new virt_time: (?P<dq_vt>-?\d+\.\d+))?)"
+    r")"
+    r"(?:.*?\bcpu[:=]\s*(?P<token_cpu>\d+))?"
+)
+
+
+def fixed_point(val : Optional[str]) -> Optional[float]:
+    if val is None:
+        return None
+    whole, frac = val.split(".")
+    return int(whole) + int(frac) / (2**16)
+
+
+def parse_line(line : str) -> Optional[trace_event]:
+    m = _trace_re.search(line)
+    if m is None:
+        return None
+
+    g = m.group
+    time = float(g("time"))
+    kind = line_kind(m)
+    cpu = g("caller_cpu") or g("token_cpu")
+    cpu = int(cpu) if cpu is not None else None
+
+    if kind == "update_curr":
+        avg = g("uc_avg")
+        return update_curr_event(time, int(g("uc_pid")), int(g("uc_delta")),
+                                 int(avg) if avg is not None else None, fixed_point(g("uc_vt")), cpu)
+
+    if kind == "pick":
+        real_time = g("pk_rt")
+        return pick_event(time, int(g("pk_curr")), int(g("pk_new")), int(real_time) if real_time is not None else None, cpu)
+
+    if kind == "place":
+        return place_event(time, int(g("pl_pid")), int(g("pl_weight")), int(g("pl_lag")), int(g("pl_vrt")),
+                           int(g("pl_te")), int(g("pl_tgis")), fixed_point(g("pl_vt")), g("pl_re") is not None, cpu)
+
+    lag = g("dq_lag")
+    return dequeue_event(time, int(g("dq_curr")), int(g("dq_pid")), int(lag) if lag is not None else None,
+                         fixed_point(g("dq_vt")), g("dq_last") is not None, cpu)
+
+
+# the event group that matched, lastgroup is token_cpu when the line has a cpu token
+def line_kind(m : re.Match) -> str:
+    kind = m.lastgroup
+    if kind == "token_cpu":
+        for kind in ("update_curr", "pick", "place", "dequeue"):
+            if m.group(kind) is not None:
+                break
+    return kind
+
+
+def parse_lines(lines : Iterable[str]) -> Iterator[trace_event]:
+    for line in lines:
+        event = parse_line(line)
+        if event is not None:
+            yield event
+
+
+def parse_trace(file_path : str) -> Iterator[trace_event]:
+    with open(file_path, 'r') as file:
+        yield from parse_lines(file)
@@ -0,0 +1,190 @@
+from __future__ import annotations
+from typing import Callable, Iterator, Optional, TextIO
+import argparse
+import atexit
+import json
+import struct
+import sys
+
+
+# buffered sink for the kernel-format echo (print_match_linux): instead of formatting and printing
+# a line per event, the raw values are appended to a buffer and written out in batches, either as
+# compact binary records or as jsonl. to_text turns either file back into the exact lines the
+# print echo would have produced. simulator_avg_weighted's call sites write to it straight away,
+# so an echoed event costs a tuple and no string formatting, print or scheduling_event. w/ a
+# values function it can also be registered as an observer like any other
+
+ECHO_TYPES = ("pick", "run", "join", "leave")
+
+ECHO_FIELDS = {
+    "pick": ("curr", "new_curr"),
+    "run": ("pid", "delta_exec", "avg_vrt"),
+    "join": ("pid", "weight", "vlag", "vrt", "te", "t_g_i_s"),
+    "leave": ("curr", "pid", "lag"),
+}
+
+ECHO_FORMATS = {
+    "pick": "pick_next_entity: curr: {}, new_curr: {}",
+    "run": "update_curr {}, delta_exec: {}, new avg vrt: {}",
+    "join": "place_entity placing se: {}, w/ weight: {}, vlag: {},  vrt: {}, new te val: {}, t_g_i_s: {}",
+    "leave": "dequeue_entity: curr: {}, task being dequeued {}, it's lag: {}",
+}
+
+
+def format_echo(type : str, values : tuple) -> str:
+    return ECHO_FORMATS[type].format(*values)
+
+
+# binary layout: a magic header, then per record a type byte, a flags byte w/ bit i set if value i
+# is an int and the values, 8 bytes each: ints as int64 (pids and ns times past 2^53 stay exact,
+# and 0 and 0.0 come back printed the same as they went in), the rest as doubles. version 1
+# files, where every value was a double, can still be read
+MAGIC = b"EEVT\x02"
+MAGIC_V1 = b"EEVT\x01"
+TYPE_CODES = {type: code for code, type in enumerate(ECHO_TYPES)}
+_head = struct.Struct("<BB")
+_bodies : dict[tuple[str, int], struct.Struct] = {}
+
+
+# record body layout for a type and flags, cached
+def _body(type : str, flags : int) -> struct.Struct:
+    body = _bodies.get((type, flags))
+    if body is None:
+        body = _bodies[type, flags] = struct.Struct(
+            "<" + "".join("q" if flags >> i & 1 else "d" for i in range(len(ECHO_FIELDS[type]))))
+    return body
+
+
+class trace_writer:
+
+    # values(rq, record) -> (type, tuple of the ECHO_FIELDS for that type), or None to skip, for
+    # use as an observer
+    def __init__(self, path : str, values : Optional[Callable] = None, format : str = "binary",
+                 buffer_records : int = 8192):
+        if format not in ("binary", "jsonl"):
+            raise ValueError(f"unknown trace format {format!r}")
+
+        self.values = values
+        self.format = format
+        self.buffer_records = buffer_records
+        self.buffer : list[tuple[str, tuple]] = []
+        self.records = 0
+
+        self.file = open(path, "wb" if format == "binary" else "w")
+        if format == "binary":
+            self.file.write(MAGIC)
+
+        # the module flag path (echo_file) never gets an explicit close
+        atexit.register(self.close)
+
+    # values in ECHO_FIELDS order for the type
+    def write(self, type : str, values : tuple):
+        self.buffer.append((type, values))
+        if len(self.buffer) >= self.buffer_records:
+            self.flush()
+
+    # the observer, see sched_hooks
+    def __call__(self, rq, record):
+        item = self.values(rq, record)
+        if item is not None:
+            self.write(*item)
+
+    def flush(self):
+        if not self.buffer or self.file.closed:
+            return
+
+        if self.format == "binary":
+            chunks = []
+            for type, values in self.buffer:
+                flags = 0
+                for i, v in enumerate(values):
+                    if isinstance(v, int):
+                        flags |= 1 << i
+                chunks.append(_head.pack(TYPE_CODES[type], flags))
+                chunks.append(_body(type, flags).pack(*values))
+            self.file.write(b"".join(chunks))
+        else:
+            self.file.write("".join(json.dumps({"type": type, **dict(zip(ECHO_FIELDS[type], values))}) + "\n"
+                                    for type, values in self.buffer))
+
+        self.records += len(self.buffer)
+        self.buffer.clear()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+        atexit.unregister(self.close)
+
+    def __enter__(self) -> trace_writer:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# streams the file, binary files are read chunk_size bytes at a time
+def read_records(path : str, chunk_size : int = 1 << 20) -> Iterator[tuple[str, tuple]]:
+    with open(path, "rb") as f:
+        magic = f.read(len(MAGIC))
+
+        if magic not in (MAGIC, MAGIC_V1):
+            f.seek(0)
+            for line in f:
+                if line.strip():
+                    d = json.loads(line)
+                    yield d["type"], tuple(d[name] for name in ECHO_FIELDS[d["type"]])
+            return
+
+        v1 = magic == MAGIC_V1
+        buffer = b""
+        offset = 0
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            buffer = buffer[offset:] + chunk
+            offset = 0
+
+            while offset + _head.size <= len(buffer):
+                code, flags = _head.unpack_from(buffer, offset)
+                type = ECHO_TYPES[code]
+                body = _body(type, 0) if v1 else _body(type, flags)
+                if offset + _head.size + body.size > len(buffer):
+                    break  # the rest of the record is in the next chunk
+                values = body.unpack_from(buffer, offset + _head.size)
+                offset += _head.size + body.size
+                if v1:
+                    values = tuple(int(v) if flags >> i & 1 else v for i, v in enumerate(values))
+                yield type, values
+
+        if offset < len(buffer):
+            raise ValueError(f"{path}: truncated record at the end of the file")
+
+
+def to_text(path : str, out : Optional[TextIO] = None) -> int:
+    out = out if out is not None else sys.stdout
+    count = 0
+    for type, values in read_records(path):
+        out.write(format_echo(type, values) + "\n")
+        count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="print a binary / jsonl echo trace in the print_match_linux text format")
+    parser.add_argument("path")
+    parser.add_argument("-o", "--out", help="write to a file instead of stdout")
+    args = parser.parse_args()
+
+    if args.out:
+        with open(args.out, "w") as f:
+            to_text(args.path, f)
+    else:
+        to_text(args.path)
+
+
+
+if __name__=="__main__":
+    main()